@@ -0,0 +1,641 @@
+"""Approximate nearest-neighbour search over every course, using an IVF index."""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+import numpy as np
+
+from vector_index import LOCK_NAME, VectorIndex, normalize_vectors, quantize_vectors
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+META_NAME = "ivf.json"
+PART_ARRAYS = ("codes", "scales", "course_ids", "doc_ids", "offsets", "assignments", "order")
+# Prefixes of the files and directories a saved index is made of; "ivf-" states predate parts
+SAVED_PREFIXES = ("part-", "live-", "centroids-", "ivf-")
+
+
+class IVFPart:
+    """A run of quantized vectors saved together: the rows present at the last training, or rows added since.
+
+    Row ``i`` holds the chunk at ``offsets[i]`` within document ``doc_ids[i]``
+    of course ``course_ids[i]``, as int8 ``codes`` times ``scales[i]``, and is
+    assigned to centroid ``assignments[i]``. ``order`` lists rows grouped by
+    centroid, and ``bounds[c]:bounds[c + 1]`` is the slice of ``order`` for
+    centroid ``c``. ``name`` is the directory the part is saved in, None
+    until it has been.
+    """
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray, course_ids: np.ndarray, doc_ids: np.ndarray,
+                 offsets: np.ndarray, assignments: np.ndarray, order: Optional[np.ndarray] = None,
+                 name: Optional[str] = None):
+        self.codes = codes
+        self.scales = scales
+        self.course_ids = course_ids
+        self.doc_ids = doc_ids
+        self.offsets = offsets
+        self.assignments = assignments
+        self.order = order if order is not None else np.argsort(assignments, kind='stable').astype(np.int32)
+        lists = int(assignments.max()) + 1 if len(assignments) else 0
+        self.bounds = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=lists))])
+        self.name = name
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def rows_in(self, centroid: int) -> np.ndarray:
+        if centroid + 1 >= len(self.bounds):
+            return self.order[:0]
+        return self.order[self.bounds[centroid]:self.bounds[centroid + 1]]
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Dequantized float32 vectors of ``rows``"""
+        return self.codes[rows].astype(np.float32) * self.scales[rows][:, None]
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in PART_ARRAYS}
+
+
+def merge_parts(parts: List[IVFPart], keep: List[np.ndarray], assignments: Optional[np.ndarray] = None) -> IVFPart:
+    """One unsaved part holding rows ``keep[i]`` of each ``parts[i]``, in order, optionally reassigned"""
+    def gather(name):
+        return np.concatenate([getattr(part, name)[rows] for part, rows in zip(parts, keep)])
+    return IVFPart(gather("codes"), gather("scales"), gather("course_ids"), gather("doc_ids"), gather("offsets"),
+                   assignments if assignments is not None else gather("assignments"))
+
+
+class IVFState:
+    """Immutable view of the index: its parts, their tombstones and the centroids.
+
+    Rows are numbered across the parts in order, and ``live[row]`` is False
+    once the row has been tombstoned. Without ``centroids`` every row is
+    assigned to list 0 and queries scan them all.
+    """
+
+    def __init__(self, parts: List[IVFPart], live: np.ndarray, centroids: Optional[np.ndarray]):
+        self.parts = parts
+        self.live = live
+        self.centroids = centroids
+        self.starts = np.cumsum([0] + [len(part) for part in parts])
+
+    @property
+    def size(self) -> int:
+        return int(self.starts[-1])
+
+    @property
+    def live_count(self) -> int:
+        return int(self.live.sum())
+
+    def locate(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """The part each of ``rows`` is in, and its row within that part"""
+        owners = np.searchsorted(self.starts, rows, side='right') - 1
+        return owners, rows - self.starts[owners]
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Dequantized float32 vectors of ``rows``"""
+        rows = np.asarray(rows)
+        dimensions = self.parts[0].codes.shape[1] if self.parts else 0
+        vectors = np.empty((len(rows), dimensions), dtype=np.float32)
+        owners, local = self.locate(rows)
+        for i, part in enumerate(self.parts):
+            picked = owners == i
+            if picked.any():
+                vectors[picked] = part.vectors(local[picked])
+        return vectors
+
+    def scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Approximate similarity of ``rows`` to ``query``, reading only their codes"""
+        scores = np.empty(len(rows), dtype=np.float32)
+        owners, local = self.locate(rows)
+        for i, part in enumerate(self.parts):
+            picked = owners == i
+            if picked.any():
+                scores[picked] = (part.codes[local[picked]].astype(np.float32) @ query) * part.scales[local[picked]]
+        return scores
+
+    def keys(self, rows: np.ndarray) -> List[Tuple[str, str, int]]:
+        """(course id, doc id, chunk offset) of each of ``rows``"""
+        owners, local = self.locate(rows)
+        keys = []
+        for owner, row in zip(owners, local):
+            part = self.parts[owner]
+            keys.append((str(part.course_ids[row]), str(part.doc_ids[row]), int(part.offsets[row])))
+        return keys
+
+    def in_course(self, course_id: str) -> np.ndarray:
+        if not self.parts:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate([part.course_ids == course_id for part in self.parts])
+
+    def document_rows(self, course_id: str, doc_ids) -> np.ndarray:
+        """Mask of the rows of course ``course_id`` belonging to any of ``doc_ids``"""
+        if not self.parts:
+            return np.zeros(0, dtype=bool)
+        doc_ids = list(doc_ids)
+        return np.concatenate([(part.course_ids == course_id) & np.isin(part.doc_ids, doc_ids)
+                               for part in self.parts])
+
+    def documents(self, course_id: str, live: np.ndarray) -> set:
+        """Ids of the documents of ``course_id`` with a row live in ``live``"""
+        found = set()
+        for part, start in zip(self.parts, self.starts):
+            rows = (part.course_ids == course_id) & live[start:start + len(part)]
+            found.update(np.unique(part.doc_ids[rows]).tolist())
+        return found
+
+    def candidates(self, lists: np.ndarray) -> np.ndarray:
+        """Live rows assigned to any of the centroids in ``lists``"""
+        rows = [start + part.rows_in(int(c)) for part, start in zip(self.parts, self.starts) for c in lists]
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        return rows[self.live[rows]]
+
+
+def empty_state() -> IVFState:
+    return IVFState([], np.zeros(0, dtype=bool), None)
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+    """Index of the most similar centroid for each row, computed in batches to bound memory"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        assignments[start:start + batch_size] = np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int = 10, sample_per_list: int = 64,
+                    seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of unit vectors"""
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > nlist * sample_per_list:
+        sample = vectors[rng.choice(len(vectors), nlist * sample_per_list, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_to_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=nlist)
+        # Empty lists are re-seeded from random sample points
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_vectors(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index mirroring the vectors of every course index.
+
+    Vectors are clustered into ``nlist`` lists by spherical k-means; a query
+    scores the ``nprobe`` closest centroids and then only the vectors in those
+    lists, trading recall for latency. The index follows the course indexes
+    incrementally: new documents are assigned to the existing centroids and
+    removed documents are tombstoned. Centroids are retrained once the index
+    has doubled since the last training or a quarter of it is tombstones;
+    retraining also drops the tombstoned rows. Until there are
+    ``min_train_size`` vectors, queries scan every vector.
+
+    Vectors are kept int8-quantized, so scores are approximate; callers
+    rescore the hits against full-precision vectors. The index is saved as
+    parts (see :class:`IVFPart`), each a directory of ``.npy`` files that is
+    written once and memory-mapped on load, plus a tombstone mask: a change
+    writes only the part it adds and the mask, and retraining merges every
+    part into one. Following the course indexes, retraining and saving
+    happen in :meth:`maintain`, which the background thread started by
+    :meth:`start` runs; worker processes take turns under a file lock, each
+    starting from the state the last one published. Queries never write:
+    they reload the published state when another worker has replaced it.
+    """
+
+    def __init__(self, path: str, nlist: int = 0, nprobe: int = 8, min_train_size: int = 2000,
+                 sync_interval: float = 300.0):
+        if nprobe < 1:
+            raise ValueError(f"nprobe must be at least 1, got {nprobe}")
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._maintain_lock = threading.Lock()
+        self._state = empty_state()
+        self._model = None
+        self._generations = {}
+        self._trained_on = 0
+        self._sequence = 0
+        self._meta_stamp = None
+        self._training = False
+        self._source = None
+        self._embedding_model = None
+        self._maintainer: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.refresh()
+
+    # Persistence
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.path, META_NAME)
+
+    def _stat_meta(self):
+        try:
+            stat = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def refresh(self) -> bool:
+        """Load the state last published by any worker if it is not the one in memory; returns True if it was"""
+        stamp = self._stat_meta()
+        if stamp is None or stamp == self._meta_stamp:
+            return False
+        with self._lock:
+            if stamp == self._meta_stamp:
+                return False
+            # A state can be replaced, and its files removed, between reading the metadata and loading it
+            for attempt in range(2):
+                try:
+                    with open(self.meta_path, 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+                    parts = [self._load_part(name) for name in meta['parts']]
+                    live = np.load(os.path.join(self.path, meta['live']))
+                    centroids = np.load(os.path.join(self.path, meta['centroids'])) if meta['centroids'] else None
+                    break
+                except FileNotFoundError:
+                    stamp = self._stat_meta()
+                except (OSError, ValueError, KeyError):
+                    # Saved in an older layout; the index is rebuilt from the course indexes
+                    self._meta_stamp = stamp
+                    return False
+            else:
+                return False
+            self._state = IVFState(parts, live, centroids)
+            self._model = meta.get('model')
+            self._generations = meta.get('generations', {})
+            self._trained_on = meta.get('trained_on', 0)
+            self._sequence = meta.get('sequence', 0)
+            self._meta_stamp = stamp
+        return True
+
+    def _load_part(self, name: str) -> IVFPart:
+        part_dir = os.path.join(self.path, name)
+        # Plain views of the mappings: slicing an np.memmap is several times slower
+        arrays = {array: np.load(os.path.join(part_dir, f"{array}.npy"), mmap_mode='r').view(np.ndarray)
+                  for array in PART_ARRAYS}
+        return IVFPart(**arrays, name=name)
+
+    @contextmanager
+    def _writer(self):
+        """Serialize maintenance across threads and worker processes"""
+        with self._maintain_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, LOCK_NAME), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self):
+        """Publish the current state as the next sequence number; called with the writer lock held.
+
+        Only parts added since the last save are written, each to its own
+        directory, along with the tombstones; the saved parts are then mapped
+        in place of their in-memory copies.
+        """
+        with self._lock:
+            state, model, generations = self._state, self._model, dict(self._generations)
+            trained_on = self._trained_on
+            sequence = self._sequence + 1
+        parts = []
+        for i, part in enumerate(state.parts):
+            if part.name is None:
+                name = f"part-{sequence:08d}-{i}"
+                part_dir = os.path.join(self.path, name)
+                # Left behind by a worker that died while saving
+                shutil.rmtree(part_dir, ignore_errors=True)
+                os.makedirs(part_dir)
+                for array, values in part.arrays().items():
+                    np.save(os.path.join(part_dir, f"{array}.npy"), values)
+                part = self._load_part(name)
+            parts.append(part)
+        live_name = f"live-{sequence:08d}.npy"
+        np.save(os.path.join(self.path, live_name), state.live)
+        centroids_name = None
+        if state.centroids is not None:
+            centroids_name = f"centroids-{sequence:08d}.npy"
+            np.save(os.path.join(self.path, centroids_name), state.centroids)
+        meta = {"parts": [part.name for part in parts], "live": live_name, "centroids": centroids_name,
+                "sequence": sequence, "model": model, "generations": generations, "trained_on": trained_on}
+        tmp_path = f"{self.meta_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        with self._lock:
+            if self._state is state:
+                self._state = IVFState(parts, state.live, state.centroids)
+            self._sequence = sequence
+            self._meta_stamp = self._stat_meta()
+        self._remove_unused(set(meta['parts']) | {live_name, centroids_name}, sequence)
+
+    def _remove_unused(self, used: set, sequence: int):
+        """Delete saved files no longer referenced, older than the published sequence"""
+        for name in os.listdir(self.path):
+            if name in used or not name.startswith(SAVED_PREFIXES):
+                continue
+            saved_at = name.split('-')[1].split('.')[0]
+            # Names from before sequence numbers count as older.
+            # Other processes may still map them; on POSIX their mappings outlive the files
+            if saved_at.isdigit() and int(saved_at) >= sequence:
+                continue
+            target = os.path.join(self.path, name)
+            if os.path.isdir(target):
+                shutil.rmtree(target, ignore_errors=True)
+            else:
+                try:
+                    os.remove(target)
+                except OSError:
+                    pass
+
+    # Maintenance
+
+    def start(self, source: Callable[[], Dict[str, VectorIndex]], embedding_model: Optional[str]):
+        """Keep the index in line with the course indexes ``source`` returns (course id -> index) in the background.
+
+        A round runs straight away, whenever :meth:`request_sync` is called
+        and every ``sync_interval`` seconds, so changes published by other
+        workers are picked up too.
+        """
+        self._source = source
+        self._embedding_model = embedding_model
+        if self._maintainer is None:
+            self._wake.set()
+            self._maintainer = threading.Thread(target=self._maintain_loop, name="ivf-maintain", daemon=True)
+            self._maintainer.start()
+
+    def request_sync(self):
+        """Ask the background thread for a maintenance round, after a course index changed"""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._maintainer is not None:
+            self._maintainer.join()
+            self._maintainer = None
+
+    def _maintain_loop(self):
+        while True:
+            self._wake.wait(self.sync_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.maintain()
+            except Exception:
+                logger.exception("IVF index maintenance failed")
+
+    def maintain(self) -> bool:
+        """Apply course index changes, retrain if due and publish the result; returns True if the index changed"""
+        if self._source is None:
+            return False
+        with self._writer():
+            # Start from whatever another worker published last
+            self.refresh()
+            changed = self.sync(self._source(), self._embedding_model)
+            changed = self._maybe_retrain() or self._compact() or changed
+            if changed:
+                self._save()
+        return changed
+
+    def sync(self, indexes: Dict[str, VectorIndex], embedding_model: Optional[str]) -> bool:
+        """Bring the in-memory index in line with the given course indexes (course id -> index).
+
+        Returns True if it changed. Nothing is saved; :meth:`maintain` does that.
+        """
+        state, generations = self._state, dict(self._generations)
+        trained_on = self._trained_on
+        changed = False
+        if embedding_model != self._model:
+            state = empty_state()
+            generations = {}
+            trained_on = 0
+            changed = True
+
+        live = state.live.copy()
+        additions = []
+        for course_id in [c for c in generations if c not in indexes]:
+            live &= ~state.in_course(course_id)
+            del generations[course_id]
+            changed = True
+
+        for course_id, index in indexes.items():
+            manifest = index.manifest()
+            generation = manifest.get('generation') if manifest else None
+            if generations.get(course_id) == generation:
+                continue
+            snapshot = index.snapshot()
+            have = state.documents(course_id, live)
+            wanted = snapshot.partitions if snapshot.has_vectors else {}
+            if have - set(wanted):
+                live &= ~state.document_rows(course_id, have - set(wanted))
+            for doc_id in set(wanted) - have:
+                start, end = wanted[doc_id]
+                if end > start:
+                    additions.append((course_id, doc_id, snapshot.document_vectors(doc_id)))
+            generations[course_id] = snapshot.generation
+            changed = True
+
+        if changed:
+            state = self._append(state, live, additions)
+            with self._lock:
+                self._state = state
+                self._model = embedding_model
+                self._generations = generations
+                self._trained_on = trained_on
+        return changed
+
+    def _append(self, state: IVFState, live: np.ndarray, additions: List[Tuple[str, str, np.ndarray]]) -> IVFState:
+        """The state with tombstones ``live`` and ``additions`` as a new part; existing parts are not copied"""
+        if not additions:
+            return IVFState(state.parts, live, state.centroids)
+        vectors = np.vstack([rows for _, _, rows in additions]).astype(np.float32)
+        codes, scales = quantize_vectors(vectors, "int8")
+        part = IVFPart(
+            codes, scales,
+            np.concatenate([np.full(len(rows), course_id, dtype='<U24') for course_id, _, rows in additions]),
+            np.concatenate([np.full(len(rows), doc_id, dtype='<U24') for _, doc_id, rows in additions]),
+            np.concatenate([np.arange(len(rows), dtype=np.int32) for _, _, rows in additions]),
+            (assign_to_centroids(vectors, state.centroids) if state.centroids is not None
+             else np.zeros(len(vectors), dtype=np.int32))
+        )
+        return IVFState(state.parts + [part], np.concatenate([live, np.ones(len(part), dtype=bool)]),
+                        state.centroids)
+
+    def _maybe_retrain(self) -> bool:
+        """Retrain the centroids if the index has outgrown them; returns True if it did.
+
+        Retraining merges every part into one and drops the tombstoned rows.
+        """
+        state = self._state
+        live_count = state.live_count
+        if live_count < self.min_train_size:
+            return False
+        grown = live_count >= 2 * max(self._trained_on, 1)
+        tombstoned = state.size - live_count > state.size // 4
+        if state.centroids is not None and not grown and not tombstoned:
+            return False
+        self._training = True
+        try:
+            keep = np.flatnonzero(state.live)
+            vectors = state.vectors(keep)
+            nlist = self.nlist or int(np.clip(np.sqrt(len(vectors)), 16, 4096))
+            centroids = train_centroids(vectors, nlist)
+            owners, local = state.locate(keep)
+            merged = merge_parts(state.parts, [local[owners == i] for i in range(len(state.parts))],
+                                 assign_to_centroids(vectors, centroids))
+            trained = IVFState([merged], np.ones(len(keep), dtype=bool), centroids)
+        except Exception as e:
+            logger.warning(f"Failed to train IVF index: {str(e)}")
+            return False
+        finally:
+            self._training = False
+        with self._lock:
+            self._state = trained
+            self._trained_on = len(vectors)
+        logger.info(f"Trained IVF index: {nlist} lists over {len(vectors)} vectors")
+        return True
+
+    def _compact(self) -> bool:
+        """Merge the newest parts while one is no larger than the part after it; returns True if any were.
+
+        The first part, the rows present at the last training, is left as
+        it is, so merging costs no more than the rows added since. Merging
+        equal neighbours keeps the number of parts, and the number of times
+        a row is rewritten, logarithmic in the rows added.
+        """
+        state = self._state
+        parts, live = list(state.parts), state.live
+        merged = False
+        while len(parts) > 2 and len(parts[-2]) <= len(parts[-1]):
+            tail = len(parts[-2]) + len(parts[-1])
+            tail_live = live[len(live) - tail:]
+            keep = [np.flatnonzero(tail_live[:len(parts[-2])]), np.flatnonzero(tail_live[len(parts[-2]):])]
+            parts[-2:] = [merge_parts(parts[-2:], keep)]
+            live = np.concatenate([live[:len(live) - tail], np.ones(len(parts[-1]), dtype=bool)])
+            merged = True
+        if merged:
+            with self._lock:
+                self._state = IVFState(parts, live, state.centroids)
+        return merged
+
+    # Queries
+
+    def current(self) -> IVFState:
+        """The state queries should use, reloaded first if another worker has published a newer one"""
+        self.refresh()
+        return self._state
+
+    def search(self, query_vector, k: int = 5, nprobe: Optional[int] = None,
+               state: Optional[IVFState] = None) -> List[Tuple[Tuple[str, str, int], float, np.ndarray]]:
+        """Return the ``k`` nearest live vectors as ((course id, doc id, chunk offset), score, vector)"""
+        if nprobe is None:
+            nprobe = self.nprobe
+        elif nprobe < 1:
+            raise ValueError(f"nprobe must be at least 1, got {nprobe}")
+        state = state or self.current()
+        if not state.size:
+            return []
+        query = normalize_vectors(query_vector)[0]
+        if state.centroids is None:
+            candidates = np.flatnonzero(state.live)
+        else:
+            nprobe = min(nprobe, len(state.centroids))
+            probe = np.argpartition(-(state.centroids @ query), nprobe - 1)[:nprobe]
+            candidates = state.candidates(probe)
+        return self._top_k(state, candidates, query, k)
+
+    def exact_search(self, query_vector, k: int = 5,
+                     state: Optional[IVFState] = None) -> List[Tuple[Tuple[str, str, int], float, np.ndarray]]:
+        """Brute-force search over every live vector, the reference for recall"""
+        state = state or self.current()
+        if not state.size:
+            return []
+        return self._top_k(state, np.flatnonzero(state.live), normalize_vectors(query_vector)[0], k)
+
+    @staticmethod
+    def _top_k(state: IVFState, candidates: np.ndarray, query: np.ndarray, k: int):
+        if not len(candidates):
+            return []
+        scores = state.scores(candidates, query)
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = candidates[top]
+        return [(key, float(score), vector) for key, score, vector in zip(state.keys(rows), scores[top], state.vectors(rows))]
+
+    def recall_report(self, k: int = 10, nprobes: Optional[List[int]] = None, queries: int = 100,
+                      noise: float = 0.05, seed: int = 0) -> Dict[str, Any]:
+        """Measure recall@k and latency of IVF search against exact search.
+
+        Queries are stored vectors with a little Gaussian noise, so they fall
+        where real questions about the corpus do without being exact copies.
+        """
+        state = self.current()
+        live_rows = np.flatnonzero(state.live)
+        if not len(live_rows):
+            return {"error": "The index is empty", **self.stats()}
+        rng = np.random.default_rng(seed)
+        picked = state.vectors(rng.choice(live_rows, min(queries, len(live_rows)), replace=False))
+        query_vectors = normalize_vectors(picked + rng.normal(0, noise, picked.shape).astype(np.float32))
+
+        started = time.perf_counter()
+        exact = [{key for key, _, _ in self.exact_search(q, k, state)} for q in query_vectors]
+        exact_ms = (time.perf_counter() - started) * 1000 / len(query_vectors)
+
+        results = []
+        for nprobe in nprobes or [1, 2, 4, 8, 16, 32]:
+            started = time.perf_counter()
+            found = [{key for key, _, _ in self.search(q, k, nprobe, state)} for q in query_vectors]
+            elapsed_ms = (time.perf_counter() - started) * 1000 / len(query_vectors)
+            recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact) if e])
+            results.append({"nprobe": nprobe, "recall_at_k": round(float(recall), 4), "mean_ms": round(elapsed_ms, 3)})
+
+        return {
+            "k": k,
+            "queries": len(query_vectors),
+            "exact_mean_ms": round(exact_ms, 3),
+            "results": results,
+            **self.stats()
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        state = self._state
+        return {
+            "vectors": state.size,
+            "live": state.live_count,
+            "tombstones": state.size - state.live_count,
+            "lists": len(state.centroids) if state.centroids is not None else 0,
+            "parts": len(state.parts),
+            "nprobe": self.nprobe,
+            "trained_on": self._trained_on,
+            "sequence": self._sequence,
+            "training": self._training,
+            "embedding_model": self._model,
+            "courses": len(self._generations)
+        }
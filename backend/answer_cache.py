@@ -0,0 +1,117 @@
+"""Cache of generated chat answers."""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]", re.UNICODE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize case, punctuation and spacing so trivial rephrasings share an entry"""
+    query = PUNCTUATION_PATTERN.sub(" ", query.lower())
+    return WHITESPACE_PATTERN.sub(" ", query).strip()
+
+
+class AnswerCache:
+    """LRU cache of answers with a time-to-live.
+
+    Entries are keyed by ``(corpus, corpus version, normalized query, prompt
+    version)``. Because the corpus version changes whenever its documents do,
+    answers computed against older content are never returned. When a
+    ``similarity_threshold`` is set, a query that misses exactly can reuse the
+    answer of a cached query for the same corpus and version whose embedding
+    is at least that similar.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600,
+                 similarity_threshold: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(corpus: str, version: Any, query: str, prompt_version: str) -> Tuple:
+        return (corpus, str(version), normalize_query(query), prompt_version)
+
+    def get(self, key: Tuple, query_vector=None) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry['value']
+            if entry is not None:
+                del self._entries[key]
+
+            if self.similarity_threshold is not None and query_vector is not None:
+                similar = self._find_similar(key, query_vector, now)
+                if similar is not None:
+                    self.similar_hits += 1
+                    return similar
+
+            self.misses += 1
+            return None
+
+    def _find_similar(self, key: Tuple, query_vector, now: float) -> Optional[Dict[str, Any]]:
+        corpus, version, _, prompt_version = key
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vector) or 1.0
+        best, best_score = None, self.similarity_threshold
+        for (e_corpus, e_version, _, e_prompt), entry in self._entries.items():
+            if (e_corpus, e_version, e_prompt) != (corpus, version, prompt_version):
+                continue
+            if entry['vector'] is None or entry['expires_at'] <= now:
+                continue
+            score = float(entry['vector'] @ query_vector) / query_norm
+            if score >= best_score:
+                best, best_score = entry, score
+        return best['value'] if best else None
+
+    def put(self, key: Tuple, value: Dict[str, Any], query_vector=None):
+        vector = None
+        if query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            self._entries[key] = {
+                "value": value,
+                "vector": vector,
+                "expires_at": time.time() + self.ttl_seconds
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, corpus: str) -> int:
+        """Drop every entry of a corpus, whatever its version"""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == corpus]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.similar_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "similarity_threshold": self.similarity_threshold,
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.similar_hits) / lookups if lookups else 0.0
+            }
@@ -0,0 +1,172 @@
+"""Content-addressed storage for extracted document bodies."""
+
+import logging
+import zlib
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+from bson import Binary, ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Records without a codec tag hold the text as a plain string
+CODECS = ("zlib", "zstd", "none")
+
+
+def compress_content(text: str, codec: str) -> Any:
+    """Encode a body for storage with ``codec``"""
+    data = text.encode('utf-8')
+    if codec == "zlib":
+        return Binary(zlib.compress(data, 6))
+    if codec == "zstd":
+        return Binary(zstandard.ZstdCompressor(level=9).compress(data))
+    return text
+
+
+def decode_record(record: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Replace a stored record's encoded ``content`` with its text, in place"""
+    if not record or 'content' not in record:
+        return record
+    codec = record.pop('codec', None)
+    if codec == "zlib":
+        record['content'] = zlib.decompress(record['content']).decode('utf-8')
+    elif codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed content")
+        record['content'] = zstandard.ZstdDecompressor().decompress(record['content']).decode('utf-8')
+    return record
+
+
+class ContentStore:
+    """Stores one record per distinct uploaded file, keyed by the file's hash.
+
+    Course documents and chatbot files only keep a ``content_id`` reference.
+    Every reference is listed in the record's ``owners``, so the same file
+    uploaded to many courses is extracted and stored once. A body is deleted
+    when its last owner releases it. Records written before bodies were shared
+    have no ``owners`` and belong to a single document.
+
+    Bodies are compressed, with the codec recorded next to them, and only
+    decoded by ``get`` and ``get_many``; every other read leaves the body out.
+    """
+
+    def __init__(self, contents_collection, codec: str = "zlib"):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown content codec: {codec}")
+        if codec == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed; compressing document bodies with zlib")
+            codec = "zlib"
+        self.contents = contents_collection
+        self.codec = codec
+        # Legacy records have no hash, hence sparse
+        self.contents.create_index("file_hash", unique=True, sparse=True)
+        self.contents.create_index("owners.course_id")
+
+    def acquire(self, file_hash: str, owner: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Add ``owner`` to the stored body of ``file_hash``, returning the record (without its text) or None"""
+        return self.contents.find_one_and_update(
+            {"file_hash": file_hash},
+            {"$addToSet": {"owners": owner}},
+            projection={"content": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def put(self, file_hash: str, content: str, page_offsets: Optional[List], owner: Dict[str, Any],
+            **fields) -> ObjectId:
+        """Store the body of ``file_hash`` for ``owner``; if another upload stored it first, share that one"""
+        for _ in range(2):
+            try:
+                record = self.contents.find_one_and_update(
+                    {"file_hash": file_hash},
+                    {
+                        "$setOnInsert": {
+                            "content": compress_content(content, self.codec),
+                            "codec": self.codec,
+                            "page_offsets": page_offsets or [],
+                            "created_at": datetime.utcnow(),
+                            **fields
+                        },
+                        "$addToSet": {"owners": owner}
+                    },
+                    projection={"_id": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                return record['_id']
+            except DuplicateKeyError:
+                # A concurrent upsert inserted the same hash; the retry matches it
+                continue
+        raise RuntimeError(f"Failed to store content for {file_hash}")
+
+    def exists(self, file_hash: str) -> bool:
+        return self.contents.find_one({"file_hash": file_hash}, {"_id": 1}) is not None
+
+    def get(self, content_id) -> Optional[Dict[str, Any]]:
+        return decode_record(self.contents.find_one({"_id": ObjectId(content_id)}))
+
+    def get_many(self, content_ids: List) -> Dict[ObjectId, Dict[str, Any]]:
+        """Fetch several bodies in one round-trip, keyed by content id"""
+        ids = [ObjectId(cid) for cid in content_ids if cid]
+        if not ids:
+            return {}
+        return {record['_id']: decode_record(record) for record in self.contents.find({"_id": {"$in": ids}})}
+
+    def compress_existing(self, batch_size: int = 100) -> int:
+        """Re-encode bodies stored as plain text with the store's codec; returns how many were converted"""
+        if self.codec == "none":
+            return 0
+        converted = 0
+        cursor = self.contents.find({"codec": {"$exists": False}}, {"content": 1}, batch_size=batch_size)
+        for record in cursor:
+            if not isinstance(record.get('content'), str):
+                continue
+            # Matching on the codec makes a concurrent or repeated run a no-op
+            result = self.contents.update_one(
+                {"_id": record['_id'], "codec": {"$exists": False}},
+                {"$set": {
+                    "content": compress_content(record['content'], self.codec),
+                    "codec": self.codec,
+                    "content_length": len(record['content'])
+                }}
+            )
+            converted += result.modified_count
+        return converted
+
+    def release(self, content_ids: List, **owner) -> List[str]:
+        """Drop ``owner`` from the given bodies; returns the hashes of bodies deleted as a result.
+
+        Only bodies this call actually deleted are reported, so callers can
+        drop files derived from them without racing a concurrent ``acquire``.
+        """
+        ids = [ObjectId(cid) for cid in content_ids if cid]
+        if not ids:
+            return []
+        self.contents.update_many({"_id": {"$in": ids}}, {"$pull": {"owners": owner}})
+        self.contents.delete_many({"_id": {"$in": ids}, "owners": {"$exists": False}})
+        return self._delete_orphans({"_id": {"$in": ids}})
+
+    def release_course(self, course_id) -> List[str]:
+        """Drop every reference held by a course; returns the hashes of bodies deleted as a result"""
+        course_id = ObjectId(course_id)
+        touched = [record['_id'] for record in self.contents.find({"owners.course_id": course_id}, {"_id": 1})]
+        self.contents.update_many({"_id": {"$in": touched}}, {"$pull": {"owners": {"course_id": course_id}}})
+        self.contents.delete_many({"course_id": course_id, "owners": {"$exists": False}})
+        return self._delete_orphans({"_id": {"$in": touched}}) if touched else []
+
+    def _delete_orphans(self, query: Dict[str, Any]) -> List[str]:
+        orphans = list(self.contents.find({**query, "owners": {"$size": 0}}, {"file_hash": 1}))
+        deleted = []
+        for record in orphans:
+            # Deleted one by one with the owner condition re-checked, so a body acquired in the
+            # meantime survives and its hash is not reported
+            result = self.contents.delete_one({"_id": record['_id'], "owners": {"$size": 0}})
+            if result.deleted_count and record.get('file_hash'):
+                deleted.append(record['file_hash'])
+        return deleted
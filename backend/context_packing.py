@@ -0,0 +1,141 @@
+"""Assembly of retrieved chunks into a token-budgeted prompt context."""
+
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+import numpy as np
+
+from search_index import tokenize
+
+# Rough characters per token for English prose; avoids a tokenizer round-trip per request
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def merge_adjacent(passages: List[Dict[str, Any]], max_chars: int = 3000) -> List[Dict[str, Any]]:
+    """Join chunks of the same document whose character ranges overlap or touch.
+
+    Each passage is a dict with ``text``, ``metadata``, ``score`` and an
+    optional unit ``vector``. Chunks are located by their ``start_index``
+    metadata, so the overlap the text splitter adds is only included once.
+    A merged passage stops growing at ``max_chars`` so a long run of hits
+    does not become one passage too large for the budget. Chunks without a
+    position are kept as they are.
+    """
+    groups = {}
+    merged = []
+    for passage in passages:
+        metadata = passage['metadata']
+        if metadata.get('start_index') is None:
+            merged.append(passage)
+            continue
+        key = metadata.get('doc_id') or metadata.get('source')
+        groups.setdefault(key, []).append(passage)
+
+    for group in groups.values():
+        group.sort(key=lambda p: p['metadata']['start_index'])
+        current = None
+        for passage in group:
+            start = passage['metadata']['start_index']
+            end = start + len(passage['text'])
+            if current is not None and start <= current['end'] and end - current['start'] <= max_chars:
+                overlap = current['end'] - start
+                current['text'] += passage['text'][overlap:]
+                current['end'] = max(current['end'], end)
+                current['score'] = max(current['score'], passage['score'])
+                current['vectors'].append(passage.get('vector'))
+                continue
+            if current is not None:
+                merged.append(_finish_merge(current))
+            current = {**passage, 'start': start, 'end': end, 'vectors': [passage.get('vector')]}
+        merged.append(_finish_merge(current))
+
+    merged.sort(key=lambda p: p['score'], reverse=True)
+    return merged
+
+
+def _finish_merge(passage: Dict[str, Any]) -> Dict[str, Any]:
+    vectors = passage.pop('vectors')
+    passage.pop('start')
+    passage.pop('end')
+    if len(vectors) > 1:
+        # A merged passage is represented by the normalized mean of its chunks
+        if all(v is not None for v in vectors):
+            mean = np.mean(np.asarray(vectors, dtype=np.float32), axis=0)
+            norm = np.linalg.norm(mean)
+            passage['vector'] = mean / norm if norm else mean
+        else:
+            passage['vector'] = None
+    return passage
+
+
+def _similarity(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+    if a.get('vector') is not None and b.get('vector') is not None:
+        return float(np.dot(a['vector'], b['vector']))
+    # Without vectors, redundancy is measured as word overlap
+    tokens_a = a.setdefault('_tokens', set(tokenize(a['text'])))
+    tokens_b = b.setdefault('_tokens', set(tokenize(b['text'])))
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+def mmr_order(passages: List[Dict[str, Any]], lambda_mult: float = 0.7) -> List[Dict[str, Any]]:
+    """Order passages by maximal marginal relevance.
+
+    Each step picks the passage maximizing
+    ``lambda * relevance - (1 - lambda) * max similarity to those already picked``,
+    so near-duplicates of an earlier pick sink to the end.
+    """
+    remaining = list(passages)
+    ordered = []
+    redundancy = [0.0] * len(remaining)
+    while remaining:
+        best = max(range(len(remaining)),
+                   key=lambda i: lambda_mult * remaining[i]['score'] - (1 - lambda_mult) * redundancy[i])
+        picked = remaining.pop(best)
+        redundancy.pop(best)
+        ordered.append(picked)
+        redundancy = [max(r, _similarity(p, picked)) for r, p in zip(redundancy, remaining)]
+    for passage in ordered:
+        passage.pop('_tokens', None)
+    return ordered
+
+
+def pack_context(passages: List[Dict[str, Any]], render: Callable[[Dict[str, Any]], str], token_budget: int,
+                 lambda_mult: float = 0.7, max_passage_chars: int = 3000) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Merge, diversify and pack retrieved passages into ``token_budget`` tokens.
+
+    ``render`` formats one passage as it will appear in the prompt, so its
+    citation header counts against the budget too. Returns the passages that
+    fit, most relevant first, and a report of the tokens used.
+    """
+    merged = merge_adjacent(passages, max_passage_chars)
+    selected = []
+    used = 0
+    for passage in mmr_order(merged, lambda_mult):
+        cost = estimate_tokens(render(passage))
+        if used + cost > token_budget:
+            if selected:
+                continue
+            # The best passage alone is over budget; keep as much of it as fits
+            excess = (cost - token_budget) * CHARS_PER_TOKEN
+            passage = {**passage, 'text': passage['text'][:max(len(passage['text']) - excess, 0)]}
+            cost = estimate_tokens(render(passage))
+        selected.append(passage)
+        used += cost
+
+    report = {
+        "candidates": len(passages),
+        "merged": len(merged),
+        "passages": len(selected),
+        "tokens": used,
+        "budget": token_budget
+    }
+    return selected, report
+
+
+def make_passage(text: str, metadata: Dict[str, Any], score: float, vector: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    return {"text": text, "metadata": metadata, "score": score, "vector": vector}
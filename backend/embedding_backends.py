@@ -0,0 +1,156 @@
+"""Embedding providers used by the embedding dispatcher."""
+
+import hashlib
+import math
+import random
+import time
+import zlib
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+
+from search_index import tokenize
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+
+class TransientEmbeddingError(Exception):
+    """A failure worth retrying, such as rate limiting or a timeout"""
+
+
+class EmbeddingBackend:
+    """Base class for embedding providers.
+
+    ``embed_batch`` sends one request's worth of texts. Splitting into batches,
+    concurrency and retries are handled by :class:`EmbeddingDispatcher`.
+    ``model`` identifies the vector space in caches and index manifests.
+    ``local`` backends compute vectors in-process and are not worth caching.
+    """
+
+    name = "base"
+    model = None
+    local = False
+    max_batch_size = 100
+    max_batch_chars = 200000
+
+    def embed_batch(self, texts: List[str], kind: str = "document") -> List[List[float]]:
+        raise NotImplementedError
+
+    def is_transient(self, error: Exception) -> bool:
+        return isinstance(error, (TransientEmbeddingError, ConnectionError, TimeoutError))
+
+
+class GoogleEmbeddingBackend(EmbeddingBackend):
+    """Gemini embeddings through the batchEmbedContents API"""
+
+    name = "google"
+    # batchEmbedContents accepts at most 100 texts per request
+    max_batch_size = 100
+
+    def __init__(self, model: str, api_key: str):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.genai = genai
+        self.model = model
+
+    def embed_batch(self, texts: List[str], kind: str = "document") -> List[List[float]]:
+        task_type = "retrieval_query" if kind == "query" else "retrieval_document"
+        result = self.genai.embed_content(model=self.model, content=texts, task_type=task_type)
+        return result['embedding']
+
+    def is_transient(self, error: Exception) -> bool:
+        if google_exceptions is not None and isinstance(error, (
+            google_exceptions.TooManyRequests,
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.InternalServerError
+        )):
+            return True
+        return super().is_transient(error)
+
+
+class SimulatedEmbeddingBackend(EmbeddingBackend):
+    """Offline stand-in with configurable latency and failure rate, for throughput benchmarks.
+
+    Vectors are derived from a hash of each text, so they are deterministic
+    but carry no meaning.
+    """
+
+    name = "simulated"
+
+    def __init__(self, dimensions: int = 768, latency: float = 0.2, per_text_latency: float = 0.002,
+                 failure_rate: float = 0.0, max_batch_size: int = 100, seed: Optional[int] = None):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.failure_rate = failure_rate
+        self.max_batch_size = max_batch_size
+        self.model = f"simulated-{dimensions}"
+        self._random = random.Random(seed)
+
+    def embed_batch(self, texts: List[str], kind: str = "document") -> List[List[float]]:
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise TransientEmbeddingError("Simulated rate limit")
+        return [self._vector(text) for text in texts]
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        return np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32).tolist()
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """In-process embeddings from hashed word and bigram counts.
+
+    Every unigram and bigram is hashed to one of ``dimensions`` buckets with a
+    pseudo-random sign, which is a sparse random projection of the bag of
+    n-grams. Counts are damped with ``1 + log(tf)`` and vectors are L2
+    normalized, so cosine similarity measures weighted term overlap. No model
+    files or network access are needed, and a query embeds in microseconds.
+    """
+
+    name = "hashing"
+    local = True
+    max_batch_size = 10000
+    max_batch_chars = 100000000
+    # Bigrams add word order without drowning out single-word matches
+    bigram_weight = 0.5
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+        self.model = f"hashing-{dimensions}-v1"
+
+    def embed_batch(self, texts: List[str], kind: str = "document") -> List[List[float]]:
+        return [self.embed_text(text) for text in texts]
+
+    def embed_text(self, text: str) -> List[float]:
+        tokens = tokenize(text)
+        weights = {token: 1.0 + math.log(count) for token, count in Counter(tokens).items()}
+        for bigram, count in Counter(f"{a} {b}" for a, b in zip(tokens, tokens[1:])).items():
+            weights[bigram] = self.bigram_weight * (1.0 + math.log(count))
+
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature, weight in weights.items():
+            # crc32 is stable across processes, unlike hash()
+            digest = zlib.crc32(feature.encode('utf-8'))
+            vector[digest % self.dimensions] += weight if digest & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+def create_embedding_backend(name: str, model: str, api_key: Optional[str] = None) -> EmbeddingBackend:
+    """Build the backend selected by name (``google``, ``hashing`` or ``simulated``)"""
+    if name == "google":
+        if not api_key:
+            raise ValueError("The google embedding backend requires an API key")
+        return GoogleEmbeddingBackend(model, api_key)
+    if name == "hashing":
+        return HashingEmbeddingBackend()
+    if name == "simulated":
+        return SimulatedEmbeddingBackend()
+    raise ValueError(f"Unknown embedding backend: {name}")
@@ -0,0 +1,231 @@
+"""Content-addressed cache of chunk embeddings."""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Number of inserts between two eviction passes
+EVICTION_INTERVAL = 1000
+# Seconds lookup counters and recency updates may stay in memory before they are written
+FLUSH_INTERVAL = 30.0
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Durable embedding store keyed by (model, kind, sha256 of the text).
+
+    Entries live in a local SQLite database so they survive restarts and are
+    shared by every worker process on the host. The least recently used
+    entries are evicted once the cache grows past ``max_entries``.
+
+    Lookups only read the database: hit and miss counters and the recency
+    of the entries found are gathered in memory and written along with the
+    next insert, before an eviction or statistics read, or at most every
+    ``flush_interval`` seconds.
+    """
+
+    def __init__(self, path: str, max_entries: int = 200000, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inserts_since_eviction = 0
+        self._pending_hits = 0
+        self._pending_misses = 0
+        self._pending_used = {}
+        self._last_flush = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(model: str, kind: str, text: str) -> str:
+        return f"{model}:{kind}:{text_hash(text)}"
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Return the cached vectors for the keys that are present"""
+        if not keys:
+            return {}
+        conn = self._connection()
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # Stay below SQLite's bound parameter limit
+        for start in range(0, len(unique_keys), 500):
+            batch = unique_keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+        hits = sum(1 for key in keys if key in found)
+        self._count(hits, len(keys) - hits, found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        conn = self._connection()
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+        )
+        # The insert commits anyway, so pending counters ride along
+        self._write_pending(conn)
+        conn.commit()
+
+        with self._lock:
+            self._inserts_since_eviction += len(items)
+            evict = self._inserts_since_eviction >= EVICTION_INTERVAL
+            if evict:
+                self._inserts_since_eviction = 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drop the least recently used entries beyond ``max_entries``"""
+        # Recency gathered in memory has to reach the table before it decides what goes
+        self.flush()
+        conn = self._connection()
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (excess,)
+        )
+        conn.commit()
+        logger.info(f"Evicted {excess} entries from the embedding cache")
+        return excess
+
+    def _count(self, hits: int, misses: int, found: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self._pending_hits += hits
+            self._pending_misses += misses
+            for key in found:
+                self._pending_used[key] = now
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def _take_pending(self):
+        with self._lock:
+            pending = self._pending_hits, self._pending_misses, self._pending_used
+            self._pending_hits = self._pending_misses = 0
+            self._pending_used = {}
+            self._last_flush = time.monotonic()
+        return pending
+
+    def _write_pending(self, conn: sqlite3.Connection):
+        """Apply the pending counters and recency updates on ``conn``; the caller commits"""
+        hits, misses, used = self._take_pending()
+        if hits or misses:
+            conn.executemany(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                [("hits", hits), ("misses", misses)]
+            )
+        if used:
+            conn.executemany(
+                "UPDATE embeddings SET last_used = MAX(last_used, ?) WHERE key = ?",
+                [(last_used, key) for key, last_used in used.items()]
+            )
+
+    def flush(self):
+        """Write the lookup counters and recency updates gathered in memory"""
+        conn = self._connection()
+        self._write_pending(conn)
+        conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        self.flush()
+        conn = self._connection()
+        entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        totals = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        total_hits = totals.get('hits', 0)
+        total_lookups = total_hits + totals.get('misses', 0)
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": total_hits,
+            "misses": totals.get('misses', 0),
+            "hit_rate": total_hits / total_lookups if total_lookups else 0.0,
+            "process_hits": self.hits,
+            "process_misses": self.misses
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only calls the underlying model for unseen texts"""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache.make_key(self.model, 'document', text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Identical chunks within one batch are embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            cached.update(computed)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.cache.make_key(self.model, 'query', text)
+        cached = self.cache.get_many([key])
+        if key in cached:
+            return cached[key]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many({key: vector})
+        return vector
+
@@ -0,0 +1,124 @@
+"""Batched, concurrency-limited embedding requests with retries."""
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from langchain.schema.embeddings import Embeddings
+
+from embedding_backends import EmbeddingBackend
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingDispatcher(Embeddings):
+    """Embeds texts through a backend in bounded, concurrent batches.
+
+    Texts are grouped into batches as large as the backend accepts, limited by
+    both text count and characters. At most ``max_concurrency`` requests are in
+    flight at once across all callers. Further batches wait for a free slot, so
+    several ingestion jobs slow each other down rather than tripping provider
+    rate limits. Transient errors are retried with exponential backoff and
+    full jitter.
+    """
+
+    def __init__(self, backend: EmbeddingBackend, batch_size: Optional[int] = None, max_concurrency: int = 4,
+                 max_retries: int = 5, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.backend = backend
+        self.model = backend.model
+        self.batch_size = max(1, min(batch_size or backend.max_batch_size, backend.max_batch_size))
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed")
+        self._lock = threading.Lock()
+        self._texts = 0
+        self._batches_sent = 0
+        self._retries = 0
+        self._failures = 0
+        self._seconds = 0.0
+        self._last_run = None
+
+    def _batches(self, texts: List[str]) -> Iterator[Tuple[int, int]]:
+        """Yield (start, end) ranges of ``texts`` that fit in one request"""
+        start, chars = 0, 0
+        for position, text in enumerate(texts):
+            if position > start and (position - start >= self.batch_size
+                                     or chars + len(text) > self.backend.max_batch_chars):
+                yield start, position
+                start, chars = position, 0
+            chars += len(text)
+        if start < len(texts):
+            yield start, len(texts)
+
+    def _embed_with_retry(self, texts: List[str], kind: str) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._slots:
+                    return self.backend.embed_batch(texts, kind)
+            except Exception as e:
+                if attempt == self.max_retries or not self.backend.is_transient(e):
+                    with self._lock:
+                        self._failures += 1
+                    raise
+                # The slot is released while waiting so other batches can use it
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                logger.warning(f"Embedding batch of {len(texts)} failed ({str(e)}); retrying in {delay:.2f}s")
+                with self._lock:
+                    self._retries += 1
+                time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        started = time.perf_counter()
+        ranges = list(self._batches(texts))
+        if len(ranges) == 1:
+            vectors = self._embed_with_retry(texts, "document")
+        else:
+            futures = [self._executor.submit(self._embed_with_retry, texts[start:end], "document")
+                       for start, end in ranges]
+            try:
+                vectors = [vector for future in futures for vector in future.result()]
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._texts += len(texts)
+            self._batches_sent += len(ranges)
+            self._seconds += elapsed
+            self._last_run = {
+                "texts": len(texts),
+                "batches": len(ranges),
+                "seconds": round(elapsed, 3),
+                "chunks_per_second": round(len(texts) / elapsed, 1) if elapsed else None
+            }
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_with_retry([text], "query")[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "model": self.model,
+                "batch_size": self.batch_size,
+                "max_concurrency": self.max_concurrency,
+                "texts": self._texts,
+                "batches": self._batches_sent,
+                "retries": self._retries,
+                "failures": self._failures,
+                "seconds": round(self._seconds, 3),
+                "chunks_per_second": round(self._texts / self._seconds, 1) if self._seconds else None,
+                "last_run": self._last_run
+            }
@@ -0,0 +1,154 @@
+"""Text extraction for uploaded PDF, DOCX and TXT files."""
+
+import bisect
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple, Union
+
+import PyPDF2
+from docx import Document
+
+logger = logging.getLogger(__name__)
+
+# PDFs with fewer pages than this are extracted in-process
+PARALLEL_PDF_MIN_PAGES = int(os.getenv("PARALLEL_PDF_MIN_PAGES", 32))
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", os.cpu_count() or 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ExtractedText:
+    """Extracted document text plus the offset at which each PDF page starts"""
+
+    def __init__(self, text: str, page_offsets: Optional[List[Tuple[int, int]]] = None):
+        self.text = text
+        self.page_offsets = page_offsets or []
+
+
+def page_for_offset(page_offsets: List[Tuple[int, int]], offset: int) -> Optional[int]:
+    """Return the page number containing a character offset of the extracted text"""
+    if not page_offsets:
+        return None
+    starts = [start for _, start in page_offsets]
+    position = bisect.bisect_right(starts, offset) - 1
+    return page_offsets[max(position, 0)][0]
+
+
+def _ready() -> bool:
+    return True
+
+
+def start_pool() -> Optional[ProcessPoolExecutor]:
+    """Fork the PDF extraction workers; call before the process opens connections or starts threads.
+
+    Forked workers begin as a copy of the process at this point. Unlike
+    spawned workers, they do not re-import ``__main__``, which would re-run
+    the app's startup when it is launched as a script, and they hold none of
+    the clients or threads created afterwards. Where fork is unavailable, or
+    the pool was not started, PDFs are extracted in-process.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None and PDF_EXTRACTION_WORKERS > 1 and "fork" in multiprocessing.get_all_start_methods():
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context("fork")
+            )
+            # A fork pool launches every worker on its first task, so they start now rather than mid-request
+            _pool.submit(_ready).result()
+        return _pool
+
+
+def _open_pdf(source: Union[bytes, str]) -> PyPDF2.PdfReader:
+    if isinstance(source, bytes):
+        return PyPDF2.PdfReader(io.BytesIO(source))
+    return PyPDF2.PdfReader(source)
+
+
+def _extract_page_range(source: Union[bytes, str], start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract pages ``start`` to ``end`` (exclusive); runs inside a worker process"""
+    pdf_reader = _open_pdf(source)
+    pages = []
+    for page_num in range(start, end):
+        try:
+            page_text = pdf_reader.pages[page_num].extract_text()
+            if page_text:
+                pages.append((page_num + 1, page_text))
+        except Exception as e:
+            logger.warning(f"Failed to extract text from page {page_num + 1}: {str(e)}")
+    return pages
+
+
+def _assemble_pages(pages: List[Tuple[int, str]]) -> ExtractedText:
+    """Join page texts in linear time, recording where each page starts"""
+    parts = []
+    page_offsets = []
+    length = 0
+    for page_number, page_text in pages:
+        header = f"\n--- Page {page_number} ---\n"
+        page_offsets.append((page_number, length))
+        parts.append(header)
+        parts.append(page_text)
+        length += len(header) + len(page_text)
+
+    text = "".join(parts)
+    leading = len(text) - len(text.lstrip())
+    return ExtractedText(text.strip(), [(page, max(start - leading, 0)) for page, start in page_offsets])
+
+
+def extract_pdf(source: Union[bytes, str]) -> ExtractedText:
+    """Extract a PDF, spreading large documents across the worker pool"""
+    page_count = len(_open_pdf(source).pages)
+    pool = _pool if page_count >= PARALLEL_PDF_MIN_PAGES else None
+    if pool is None:
+        return _assemble_pages(_extract_page_range(source, 0, page_count))
+
+    # One contiguous range per worker keeps the number of source copies bounded
+    workers = min(PDF_EXTRACTION_WORKERS, page_count)
+    step = (page_count + workers - 1) // workers
+    try:
+        futures = [
+            pool.submit(_extract_page_range, source, start, min(start + step, page_count))
+            for start in range(0, page_count, step)
+        ]
+        pages = [page for future in futures for page in future.result()]
+    except BrokenProcessPool:
+        # Workers are not re-forked from a process that now runs threads
+        logger.warning("PDF extraction workers have exited; extracting in-process")
+        return _assemble_pages(_extract_page_range(source, 0, page_count))
+    return _assemble_pages(pages)
+
+
+def extract_docx(source) -> ExtractedText:
+    doc = Document(source)
+    parts = []
+    for para in doc.paragraphs:
+        if para.text.strip():
+            parts.append(para.text + "\n")
+
+    # Extract text from tables
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                if cell.text.strip():
+                    parts.append(cell.text + " ")
+            parts.append("\n")
+
+    return ExtractedText("".join(parts).strip())
+
+
+def extract_txt(source) -> ExtractedText:
+    if hasattr(source, 'read'):
+        content = source.read()
+    else:
+        with open(source, 'rb') as f:
+            content = f.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='ignore')
+    return ExtractedText(content.strip())
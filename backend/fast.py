@@ -0,0 +1,1072 @@
+"""Async (ASGI) implementation of the Collexa API.
+
+Serves the same routes as ``flask_app.py`` with FastAPI. MongoDB is reached
+through motor and Gemini through its async client, so a single process can
+keep many chat requests in flight while they wait on the network. Vector
+index maintenance, ingestion jobs and scoring are shared with the Flask app
+through ``services`` and run in worker threads, off the event loop.
+
+Run with: uvicorn fast:app --host 0.0.0.0 --port 8000
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+from bson import ObjectId
+from fastapi import FastAPI, Request, UploadFile, File
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from starlette.concurrency import run_in_threadpool
+
+import services
+from services import (
+    MONGODB_URI, MONGODB_DATABASE, ANSWER_CACHE_VERSION, RETRIEVAL_MODE, RETRIEVAL_MODES,
+    COURSE_METADATA_PROJECTION, COURSE_COUNT_FIELDS, COLLECTION_SORT_FIELDS, SEARCH_COURSE_PROJECTION,
+    STATS_ID, CHATBOT_CORPUS_ID, NO_DOCUMENTS_ANSWER, CONTEXT_CANDIDATES,
+    json_default, secure_filename, is_valid_objectid, is_valid_item_ref, allowed_file, document_body, discard_unreferenced_upload,
+    resolve_subject_id, resolve_document_id,
+    encode_list_cursor, decode_list_cursor, open_vector_index, get_course_index, refresh_course_index, refresh_chatbot_index,
+    course_scope_query, scope_courses, parse_chat_filters, filtered_version,
+    vector_search_courses, keyword_search_courses, fuse_passages,
+    build_course_prompt, find_title_matches, search_documents, prepare_chatbot_chat, detect_video_links,
+    ingest_course_document, ingest_chatbot_file, release_contents, release_course_contents,
+    extractive_answer, sse_event, stream_full_answer
+)
+from content_store import decode_record
+from upload_store import FileTooLargeError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ingestion jobs, index maintenance and the embedding and Gemini clients; the names below exist from then on
+services.init()
+from services import model, embeddings, embedding_cache, embedding_dispatcher, job_queue, answer_cache, upload_store, ann_index
+
+
+class MongoJSONResponse(JSONResponse):
+    """JSON response that serializes ObjectIds and datetimes the same way as the Flask app"""
+    def render(self, content: Any) -> bytes:
+        return json.dumps(content, default=json_default).encode('utf-8')
+
+
+app = FastAPI(title="Collexa API")
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+# Async MongoDB client; the synchronous client in services is only used by ingestion jobs and index syncs
+mongo_client = AsyncIOMotorClient(MONGODB_URI)
+db = mongo_client[MONGODB_DATABASE]
+collection = db.syllabus_collections
+jobs_collection = db.ingestion_jobs
+stats_collection = db.stats
+contents_collection = db.document_contents
+chatbot_collection = db.chatbot_files
+
+# Helper function to build a JSON response, bypassing FastAPI's encoder so ObjectIds are handled
+def json_response(content: Any, status_code: int = 200) -> MongoJSONResponse:
+    return MongoJSONResponse(content, status_code=status_code)
+
+# Error handler
+def handle_error(error_msg, status_code=500):
+    logger.error(error_msg)
+    return json_response({"error": error_msg, "timestamp": datetime.utcnow().isoformat()}, status_code)
+
+# Helper function to read a JSON body, returning None when there is none
+async def read_json(request: Request) -> Optional[Dict[str, Any]]:
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+# Helper function to keep the global counters in step with a write
+async def bump_stats(collections=0, subjects=0, documents=0):
+    try:
+        await stats_collection.update_one(
+            {"_id": STATS_ID},
+            {
+                "$inc": {"collections": collections, "subjects": subjects, "documents": documents},
+                "$set": {"updated_at": datetime.utcnow()}
+            }
+        )
+    except Exception as e:
+        logger.warning(f"Failed to update statistics counters: {str(e)}")
+
+# Helper function to recompute the global counters from the courses themselves
+async def reconcile_stats() -> Dict[str, Any]:
+    totals = await collection.aggregate([
+        {"$project": COURSE_COUNT_FIELDS},
+        {"$group": {
+            "_id": None,
+            "collections": {"$sum": 1},
+            "subjects": {"$sum": "$subject_count"},
+            "documents": {"$sum": "$document_count"}
+        }}
+    ]).to_list(None)
+    counters = {
+        "collections": totals[0]['collections'] if totals else 0,
+        "subjects": totals[0]['subjects'] if totals else 0,
+        "documents": totals[0]['documents'] if totals else 0,
+        "updated_at": datetime.utcnow(),
+        "reconciled_at": datetime.utcnow()
+    }
+    await stats_collection.update_one({"_id": STATS_ID}, {"$set": counters}, upsert=True)
+    return counters
+
+# Helper function to record a change to the chatbot files
+async def bump_chatbot_version():
+    await stats_collection.update_one({"_id": CHATBOT_CORPUS_ID}, {"$inc": {"content_version": 1}}, upsert=True)
+    await run_in_threadpool(refresh_chatbot_index)
+
+# Helper function to get the current version of the chatbot files
+async def chatbot_content_version() -> int:
+    record = await stats_collection.find_one({"_id": CHATBOT_CORPUS_ID})
+    return (record or {}).get('content_version', 0)
+
+# Helper function to load the bodies of course documents in one round-trip
+async def load_document_contents(documents: List[Dict[str, Any]]) -> Dict[ObjectId, Dict[str, Any]]:
+    ids = [doc['content_id'] for doc in documents if 'content' not in doc and doc.get('content_id')]
+    if not ids:
+        return {}
+    return {record['_id']: decode_record(record) async for record in contents_collection.find({"_id": {"$in": ids}})}
+
+# Health check endpoint
+@app.get('/api/health')
+async def health_check():
+    try:
+        # Test MongoDB connection
+        await mongo_client.admin.command('ping')
+        mongo_status = "connected"
+    except Exception:
+        mongo_status = "disconnected"
+
+    return json_response({
+        "status": "healthy",
+        "mongodb": mongo_status,
+        "ai": "enabled" if model else "disabled",
+        "timestamp": datetime.utcnow().isoformat()
+    })
+
+# Get statistics
+@app.get('/api/stats')
+async def get_stats(reconcile: str = 'false'):
+    try:
+        # Counters are maintained by the write endpoints; reconcile=true recounts from scratch
+        stats = await stats_collection.find_one({"_id": STATS_ID})
+        if stats is None or reconcile.lower() == 'true':
+            stats = await reconcile_stats()
+
+        return json_response({
+            "total_collections": stats.get('collections', 0),
+            "total_subjects": stats.get('subjects', 0),
+            "total_documents": stats.get('documents', 0),
+            "reconciled_at": stats['reconciled_at'].isoformat() if stats.get('reconciled_at') else None,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+    except Exception as e:
+        return handle_error(f"Failed to get statistics: {str(e)}")
+
+# Embedding cache statistics
+@app.get('/api/embeddings/cache')
+async def get_embedding_cache_stats():
+    if not embedding_cache:
+        return handle_error("Embedding cache is not available", 503)
+
+    try:
+        stats = await run_in_threadpool(embedding_cache.stats)
+        stats["timestamp"] = datetime.utcnow().isoformat()
+        return json_response(stats)
+    except Exception as e:
+        return handle_error(f"Failed to get embedding cache statistics: {str(e)}")
+
+# Embedding request throughput and retry statistics
+@app.get('/api/embeddings/stats')
+async def get_embedding_stats():
+    if not embedding_dispatcher:
+        return handle_error("Embedding service is not available", 503)
+
+    stats = embedding_dispatcher.stats()
+    stats["timestamp"] = datetime.utcnow().isoformat()
+    return json_response(stats)
+
+# Recall and latency of the approximate "all courses" index against exact search
+@app.get('/api/ann/report')
+async def get_ann_report(k: int = 10, queries: int = 100, nprobe: str = '1,2,4,8,16,32'):
+    if ann_index is None:
+        return handle_error("Approximate search is disabled (ALL_COURSES_SEARCH=exact)", 400)
+    if not embeddings:
+        return handle_error("Embedding service is not available", 503)
+
+    try:
+        nprobes = [int(n) for n in nprobe.split(',') if n.strip()]
+        if k < 1 or queries < 1 or not nprobes or min(nprobes) < 1:
+            return handle_error("k, queries and nprobe must be positive", 400)
+
+        report = await run_in_threadpool(ann_index.recall_report, k, nprobes, min(queries, 1000))
+        report["timestamp"] = datetime.utcnow().isoformat()
+        return json_response(report)
+
+    except ValueError:
+        return handle_error("nprobe must be a comma-separated list of integers", 400)
+    except Exception as e:
+        return handle_error(f"Failed to build recall report: {str(e)}")
+
+# Get the status of a background ingestion job
+@app.get('/api/jobs/{job_id}')
+async def get_job(job_id: str):
+    if not is_valid_objectid(job_id):
+        return handle_error("Invalid job ID", 400)
+
+    try:
+        job = await jobs_collection.find_one({"_id": ObjectId(job_id)})
+        if not job:
+            return handle_error("Job not found", 404)
+        return json_response(job)
+    except Exception as e:
+        return handle_error(f"Failed to fetch job: {str(e)}")
+
+# Answer cache statistics
+@app.get('/api/chat/cache')
+async def get_answer_cache_stats():
+    stats = answer_cache.stats()
+    stats["timestamp"] = datetime.utcnow().isoformat()
+    return json_response(stats)
+
+# Create a course (collection)
+@app.post('/api/collections')
+async def create_collection(request: Request):
+    try:
+        data = await read_json(request)
+        if not data:
+            return handle_error("No data provided", 400)
+
+        name = data.get('name', '').strip()
+        if not name:
+            return handle_error("Course name is required", 400)
+
+        # Check if collection with same name exists
+        existing = await collection.find_one({"name": {"$regex": f"^{re.escape(name)}$", "$options": "i"}})
+        if existing:
+            return handle_error("A course with this name already exists", 409)
+
+        course = {
+            "name": name,
+            "subjects": [],
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow(),
+            "description": data.get('description', ''),
+            "tags": data.get('tags', []),
+            "content_version": 0
+        }
+
+        result = await collection.insert_one(course)
+        course['_id'] = str(result.inserted_id)
+        await bump_stats(collections=1)
+
+        logger.info(f"Created new course: {name}")
+        return json_response(course, 201)
+
+    except Exception as e:
+        return handle_error(f"Failed to create course: {str(e)}")
+
+# Get all courses (collections) with filtering and sorting
+@app.get('/api/collections')
+async def get_collections(search: str = '', sort_by: str = 'created_at', sort_order: str = 'desc',
+                          page: int = 1, limit: int = 50, cursor: str = '', view: str = 'full'):
+    try:
+        search = search.strip()
+        cursor = cursor.strip()
+        if sort_by not in COLLECTION_SORT_FIELDS:
+            return handle_error(f"Invalid sort field. Use one of: {', '.join(sorted(COLLECTION_SORT_FIELDS))}", 400)
+        if limit < 1 or page < 1:
+            return handle_error("Page and limit must be positive", 400)
+
+        # Build query
+        query = {}
+        if search:
+            query["name"] = {"$regex": search, "$options": "i"}
+
+        # Build sort; _id breaks ties so keyset pages never overlap
+        sort_direction = -1 if sort_order == 'desc' else 1
+        page_query = query
+        if cursor:
+            try:
+                page_query = {"$and": [query, decode_list_cursor(cursor, sort_by, sort_direction)]}
+            except Exception:
+                return handle_error("Invalid cursor", 400)
+
+        pipeline = [
+            {"$match": page_query},
+            {"$sort": {sort_by: sort_direction, "_id": sort_direction}}
+        ]
+        if not cursor:
+            pipeline.append({"$skip": (page - 1) * limit})
+        pipeline.extend([
+            {"$limit": limit},
+            {"$addFields": COURSE_COUNT_FIELDS},
+            {"$project": {"subjects": 0} if view == 'summary' else COURSE_METADATA_PROJECTION}
+        ])
+        courses = await collection.aggregate(pipeline).to_list(None)
+
+        next_cursor = encode_list_cursor(courses[-1], sort_by) if len(courses) == limit else None
+        total_count = await collection.count_documents(query) if query else await collection.estimated_document_count()
+
+        return json_response({
+            "collections": courses,
+            "pagination": {
+                "page": None if cursor else page,
+                "limit": limit,
+                "total": total_count,
+                "pages": (total_count + limit - 1) // limit,
+                "next_cursor": next_cursor
+            }
+        })
+
+    except Exception as e:
+        return handle_error(f"Failed to fetch courses: {str(e)}")
+
+# Get single course by ID
+@app.get('/api/collections/{collection_id}')
+async def get_collection(collection_id: str, include_content: str = 'false'):
+    if not is_valid_objectid(collection_id):
+        return handle_error("Invalid course ID", 400)
+
+    try:
+        course = await collection.find_one({"_id": ObjectId(collection_id)}, COURSE_METADATA_PROJECTION)
+        if not course:
+            return handle_error("Course not found", 404)
+
+        # Document bodies are only loaded when explicitly requested
+        if include_content.lower() == 'true':
+            documents = [doc for subject in course.get('subjects', []) for doc in subject.get('documents', [])]
+            records = await load_document_contents(documents)
+            for doc in documents:
+                doc['content'] = document_body(doc, records)['content']
+
+        return json_response(course)
+
+    except Exception as e:
+        return handle_error(f"Failed to fetch course: {str(e)}")
+
+# Update a course
+@app.put('/api/collections/{collection_id}')
+async def update_collection(collection_id: str, request: Request):
+    if not is_valid_objectid(collection_id):
+        return handle_error("Invalid course ID", 400)
+
+    try:
+        data = await read_json(request)
+        if not data:
+            return handle_error("No data provided", 400)
+
+        update_fields = {}
+        if 'name' in data and data['name'].strip():
+            update_fields['name'] = data['name'].strip()
+        if 'description' in data:
+            update_fields['description'] = data['description']
+        if 'tags' in data:
+            update_fields['tags'] = data['tags']
+
+        update_fields['updated_at'] = datetime.utcnow()
+
+        # Renaming changes the source labels stored in the vector index
+        update = {"$set": update_fields}
+        if 'name' in update_fields:
+            update["$inc"] = {"content_version": 1}
+
+        result = await collection.update_one({"_id": ObjectId(collection_id)}, update)
+        if result.matched_count == 0:
+            return handle_error("Course not found", 404)
+
+        if 'name' in update_fields:
+            await run_in_threadpool(refresh_course_index, collection_id)
+
+        return json_response({"message": "Course updated successfully"})
+
+    except Exception as e:
+        return handle_error(f"Failed to update course: {str(e)}")
+
+# Delete a course (collection)
+@app.delete('/api/collections/{collection_id}')
+async def delete_collection(collection_id: str):
+    if not is_valid_objectid(collection_id):
+        return handle_error("Invalid course ID", 400)
+
+    try:
+        deleted = await collection.find_one_and_delete(
+            {"_id": ObjectId(collection_id)},
+            projection={"subjects.documents._id": 1}
+        )
+        if deleted is None:
+            return handle_error("Course not found", 404)
+
+        subjects = deleted.get('subjects', [])
+        await bump_stats(
+            collections=-1,
+            subjects=-len(subjects),
+            documents=-sum(len(subject.get('documents', [])) for subject in subjects)
+        )
+        await run_in_threadpool(release_course_contents, collection_id)
+        await run_in_threadpool(open_vector_index(f"course_{collection_id}").drop)
+        if ann_index is not None:
+            ann_index.request_sync()
+        answer_cache.invalidate(f"course:{collection_id}")
+        answer_cache.invalidate("course:all")
+
+        logger.info(f"Deleted course with ID: {collection_id}")
+        return json_response({"message": "Course deleted successfully"})
+
+    except Exception as e:
+        return handle_error(f"Failed to delete course: {str(e)}")
+
+# Add a topic (subject) to a course
+@app.post('/api/collections/{collection_id}/subjects')
+async def add_subject(collection_id: str, request: Request):
+    if not is_valid_objectid(collection_id):
+        return handle_error("Invalid course ID", 400)
+
+    try:
+        data = await read_json(request)
+        if not data:
+            return handle_error("No data provided", 400)
+
+        name = data.get('name', '').strip()
+        if not name:
+            return handle_error("Topic name is required", 400)
+
+        subject = {
+            "_id": ObjectId(),
+            "name": name,
+            "description": data.get('description', ''),
+            "documents": [],
+            "created_at": datetime.utcnow()
+        }
+
+        result = await collection.update_one(
+            {"_id": ObjectId(collection_id)},
+            {
+                "$push": {"subjects": subject},
+                "$set": {"updated_at": datetime.utcnow()}
+            }
+        )
+        if result.matched_count == 0:
+            return handle_error("Course not found", 404)
+
+        await bump_stats(subjects=1)
+        logger.info(f"Added subject '{name}' to course {collection_id}")
+        return json_response({"message": "Topic added successfully", "subject": subject}, 201)
+
+    except Exception as e:
+        return handle_error(f"Failed to add topic: {str(e)}")
+
+# Update a subject
+@app.put('/api/collections/{collection_id}/subjects/{subject_ref}')
+async def update_subject(collection_id: str, subject_ref: str, request: Request):
+    if not is_valid_objectid(collection_id):
+        return handle_error("Invalid course ID", 400)
+
+    if not is_valid_item_ref(subject_ref):
+        return handle_error("Invalid topic ID", 400)
+
+    try:
+        data = await read_json(request)
+        if not data:
+            return handle_error("No data provided", 400)
+
+        subject_id = await run_in_threadpool(resolve_subject_id, collection_id, subject_ref)
+        if subject_id is None:
+            return handle_error("Course or topic not found", 404)
+
+        update_fields = {}
+        if 'name' in data and data['name'].strip():
+            update_fields['subjects.$.name'] = data['name'].strip()
+        if 'description' in data:
+            update_fields['subjects.$.description'] = data['description']
+
+        update_fields['updated_at'] = datetime.utcnow()
+
+        renamed = 'subjects.$.name' in update_fields
+        update = {"$set": update_fields}
+        if renamed:
+            update["$inc"] = {"content_version": 1}
+
+        result = await collection.update_one(
+            {"_id": ObjectId(collection_id), "subjects._id": subject_id},
+            update
+        )
+        if result.matched_count == 0:
+            return handle_error("Course or topic not found", 404)
+
+        if renamed:
+            await run_in_threadpool(refresh_course_index, collection_id)
+
+        return json_response({"message": "Topic updated successfully"})
+
+    except Exception as e:
+        return handle_error(f"Failed to update topic: {str(e)}")
+
+# Delete a topic (subject) from a course
+@app.delete('/api/collections/{collection_id}/subjects/{subject_ref}')
+async def delete_subject(collection_id: str, subject_ref: str):
+    if not is_valid_objectid(collection_id):
+        return handle_error("Invalid course ID", 400)
+
+    if not is_valid_item_ref(subject_ref):
+        return handle_error("Invalid topic ID", 400)
+
+    try:
+        subject_id = await run_in_threadpool(resolve_subject_id, collection_id, subject_ref)
+        if subject_id is None:
+            return handle_error("Course or topic not found", 404)
+
+        deleted = await collection.find_one_and_update(
+            {"_id": ObjectId(collection_id), "subjects._id": subject_id},
+            {
+                "$pull": {"subjects": {"_id": subject_id}},
+                "$set": {"updated_at": datetime.utcnow()},
+                "$inc": {"content_version": 1}
+            },
+            projection={"subjects": {"$elemMatch": {"_id": subject_id}}},
+            return_document=ReturnDocument.BEFORE
+        )
+        if deleted is None:
+            return handle_error("Course or topic not found", 404)
+
+        deleted_subject = deleted['subjects'][0]
+        for doc in deleted_subject.get('documents', []):
+            if doc.get('content_id'):
+                await run_in_threadpool(release_contents, [doc['content_id']],
+                                        course_id=ObjectId(collection_id), document_id=doc.get('_id'))
+        await bump_stats(subjects=-1, documents=-len(deleted_subject.get('documents', [])))
+        await run_in_threadpool(refresh_course_index, collection_id)
+
+        logger.info(f"Deleted subject {subject_id} from course {collection_id}")
+        return json_response({"message": "Topic deleted successfully"})
+
+    except Exception as e:
+        return handle_error(f"Failed to delete topic: {str(e)}")
+
+# Helper function to validate an uploaded file and stream it to the upload store;
+# returns (filename, file hash, file size, error response)
+async def save_upload(file: Optional[UploadFile]):
+    if file is None:
+        return None, None, None, handle_error("No file provided", 400)
+    if not file.filename:
+        return None, None, None, handle_error("No file selected", 400)
+
+    filename = secure_filename(file.filename)
+    if not allowed_file(filename):
+        return None, None, None, handle_error("File type not allowed. Only PDF, DOCX, DOC, and TXT files are supported", 400)
+
+    # Starlette spools the upload to a temporary file; it is copied in chunks, never read whole
+    try:
+        file_hash, file_size = await run_in_threadpool(upload_store.save, file.file)
+    except FileTooLargeError as e:
+        return None, None, None, handle_error(str(e), 400)
+    return filename, file_hash, file_size, None
+
+# Upload syllabus file (document) to a topic
+@app.post('/api/collections/{collection_id}/subjects/{subject_ref}/documents')
+async def upload_document(collection_id: str, subject_ref: str, file: Optional[UploadFile] = File(None)):
+    if not is_valid_objectid(collection_id):
+        return handle_error("Invalid course ID", 400)
+
+    if not is_valid_item_ref(subject_ref):
+        return handle_error("Invalid topic ID", 400)
+
+    try:
+        subject_id = await run_in_threadpool(resolve_subject_id, collection_id, subject_ref)
+        course = subject_id and await collection.find_one(
+            {"_id": ObjectId(collection_id), "subjects._id": subject_id},
+            {"_id": 1}
+        )
+        if not course:
+            return handle_error("Course or topic not found", 404)
+
+        filename, file_hash, file_size, error = await save_upload(file)
+        if error:
+            return error
+
+        # Extraction and indexing run on the shared ingestion workers
+        job_id = await run_in_threadpool(
+            job_queue.submit,
+            "course_document",
+            ingest_course_document,
+            collection_id, str(subject_id), filename, file_size, file_hash,
+            collection_id=collection_id,
+            subject_id=str(subject_id),
+            filename=filename,
+            file_hash=file_hash
+        )
+
+        logger.info(f"Queued document '{filename}' for course {collection_id}, subject {subject_id} (job {job_id})")
+        return json_response({
+            "message": "Document accepted for processing",
+            "job_id": job_id,
+            "subject_id": str(subject_id),
+            "status_url": f"/api/jobs/{job_id}",
+            "filename": filename,
+            "file_size": file_size
+        }, 202)
+
+    except Exception as e:
+        return handle_error(f"Failed to upload document: {str(e)}")
+
+# Delete a syllabus file (document) from a topic
+@app.delete('/api/collections/{collection_id}/subjects/{subject_ref}/documents/{document_ref}')
+async def delete_document(collection_id: str, subject_ref: str, document_ref: str):
+    if not is_valid_objectid(collection_id):
+        return handle_error("Invalid course ID", 400)
+
+    if not is_valid_item_ref(subject_ref) or not is_valid_item_ref(document_ref):
+        return handle_error("Invalid topic or document ID", 400)
+
+    try:
+        subject_id = await run_in_threadpool(resolve_subject_id, collection_id, subject_ref)
+        document_id = subject_id and await run_in_threadpool(resolve_document_id, collection_id, subject_id, document_ref)
+        if document_id is None:
+            return handle_error("Document not found", 404)
+
+        deleted = await collection.find_one_and_update(
+            {"_id": ObjectId(collection_id), "subjects": {"$elemMatch": {"_id": subject_id, "documents._id": document_id}}},
+            {
+                "$pull": {"subjects.$.documents": {"_id": document_id}},
+                "$set": {"updated_at": datetime.utcnow()},
+                "$inc": {"content_version": 1}
+            },
+            projection={"subjects": {"$elemMatch": {"_id": subject_id}}},
+            return_document=ReturnDocument.BEFORE
+        )
+        if deleted is None:
+            return handle_error("Document not found", 404)
+
+        deleted_doc = next(doc for doc in deleted['subjects'][0].get('documents', []) if doc.get('_id') == document_id)
+        if deleted_doc.get('content_id'):
+            await run_in_threadpool(release_contents, [deleted_doc['content_id']],
+                                    course_id=ObjectId(collection_id), document_id=document_id)
+        await bump_stats(documents=-1)
+        await run_in_threadpool(refresh_course_index, collection_id)
+
+        logger.info(f"Deleted document '{deleted_doc.get('filename', 'unknown')}' from course {collection_id}")
+        return json_response({"message": "Document deleted successfully"})
+
+    except Exception as e:
+        return handle_error(f"Failed to delete document: {str(e)}")
+
+async def search_collection_chunks(collection_id: Optional[str], query: str, filters: Optional[Dict[str, Any]] = None,
+                                   k: int = CONTEXT_CANDIDATES, mode: str = RETRIEVAL_MODE) -> List[Dict[str, Any]]:
+    """Retrieve context passages for a question from the course index(es), with vector, keyword or hybrid search"""
+    filters = filters or {}
+    courses = await collection.find(*course_scope_query(collection_id, filters)).to_list(None)
+    # Opening an index reads its manifest from disk
+    scoped = await run_in_threadpool(lambda: [
+        (str(course['_id']), get_course_index(course), doc_ids) for course, doc_ids in scope_courses(courses, filters)
+    ])
+    scoped = [(course_id, index, doc_ids) for course_id, index, doc_ids in scoped if index is not None and index.size()]
+    if not scoped:
+        return []
+    use_ann = not collection_id and not filters and ann_index is not None
+
+    async def vector_leg():
+        query_vector = await embeddings.aembed_query(query)
+        return await run_in_threadpool(vector_search_courses, scoped, query_vector, k, use_ann)
+
+    if mode == "keyword" or not embeddings:
+        return await run_in_threadpool(keyword_search_courses, scoped, query, k)
+    if mode == "vector":
+        return await vector_leg()
+    # Both legs run at once: BM25 in a worker thread while the query is embedded
+    vector, keyword = await asyncio.gather(vector_leg(), run_in_threadpool(keyword_search_courses, scoped, query, k))
+    return await run_in_threadpool(fuse_passages, vector, keyword, k)
+
+# Helper function to validate a course chat request; returns (query, collection_id, filters, error response)
+def read_course_chat_request(data):
+    if not data:
+        return None, None, None, handle_error("No data provided", 400)
+
+    query = data.get('query', '').strip()
+    collection_id = data.get('collection_id', '').strip()
+
+    if not query:
+        return None, None, None, handle_error("Query is required", 400)
+
+    if collection_id == 'all':
+        collection_id = ''
+    if collection_id and not is_valid_objectid(collection_id):
+        return None, None, None, handle_error("Invalid course ID", 400)
+
+    filters, error = parse_chat_filters(data, collection_id)
+    if error:
+        return None, None, None, handle_error(error, 400)
+
+    return query, collection_id, filters, None
+
+async def course_chat_corpus(collection_id: str, filters: Optional[Dict[str, Any]] = None):
+    """Identify the corpus a course chat runs against as (cache corpus key, content version)"""
+    if collection_id:
+        course = await collection.find_one({"_id": ObjectId(collection_id)}, {"content_version": 1})
+        return f"course:{collection_id}", filtered_version(course.get('content_version', 0) if course else None, filters)
+    versions = sorted([
+        (str(course['_id']), course.get('content_version', 0))
+        async for course in collection.find({}, {"content_version": 1})
+    ])
+    return "course:all", filtered_version(hashlib.md5(json.dumps(versions).encode('utf-8')).hexdigest(), filters)
+
+async def lookup_cached_answer(corpus: str, version: Any, query: str):
+    """Return (cache key, query vector, cached answer or None) for a chat question"""
+    key = answer_cache.make_key(corpus, version, query, ANSWER_CACHE_VERSION)
+    query_vector = None
+    if answer_cache.similarity_threshold is not None and embeddings:
+        query_vector = await embeddings.aembed_query(query)
+    return key, query_vector, answer_cache.get(key, query_vector)
+
+# Helper function to read the parameters of a streaming endpoint from the body (POST) or query string (GET)
+async def read_stream_request(request: Request):
+    if request.method == 'POST':
+        return await read_json(request)
+    return dict(request.query_params)
+
+# Helper function to wrap an event generator in a streaming response
+def sse_response(events):
+    return StreamingResponse(
+        events,
+        media_type='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def stream_answer(prompt: str, opening: Dict[str, Any], closing=None):
+    """Yield SSE events for a Gemini answer, awaiting each streamed chunk"""
+    yield sse_event("sources", opening)
+    parts = []
+    try:
+        response = await model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            text = chunk.text
+            if text:
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+    except Exception as e:
+        logger.error(f"Streaming chat error: {str(e)}")
+        yield sse_event("error", {"error": f"Failed to generate answer: {str(e)}"})
+        return
+
+    answer = "".join(parts)
+    yield sse_event("done", closing(answer) if closing else {})
+
+# Enhanced chat endpoint using Gemini directly
+@app.post('/api/chat')
+async def chat(request: Request):
+    if not embeddings:
+        return handle_error("AI service is not available", 503)
+
+    try:
+        query, collection_id, filters, error = read_course_chat_request(await read_json(request))
+        if error:
+            return error
+
+        corpus, version = await course_chat_corpus(collection_id, filters)
+        cache_key, query_vector, cached = await lookup_cached_answer(corpus, version, query)
+        if cached:
+            return json_response({**cached, "cached": True})
+
+        prepared = build_course_prompt(query, await search_collection_chunks(collection_id or None, query, filters))
+        if not prepared["prompt"]:
+            return json_response({
+                "answer": NO_DOCUMENTS_ANSWER,
+                "sources": []
+            })
+
+        # Generate response using Gemini without holding a worker, or quote the passages
+        if model:
+            answer = (await model.generate_content_async(prepared["prompt"])).text
+        else:
+            answer = extractive_answer(prepared["documents"])
+
+        result = {
+            "answer": answer,
+            "sources": prepared["sources"]
+        }
+        answer_cache.put(cache_key, result, query_vector)
+        return json_response({**result, "context": prepared["context"]})
+
+    except Exception as e:
+        logger.error(f"Chat error: {str(e)}")
+        return handle_error(f"Failed to process chat request: {str(e)}")
+
+# Streaming chat endpoint; GET with query parameters supports EventSource clients
+@app.api_route('/api/chat/stream', methods=['GET', 'POST'])
+async def chat_stream(request: Request):
+    if not embeddings:
+        return handle_error("AI service is not available", 503)
+
+    try:
+        query, collection_id, filters, error = read_course_chat_request(await read_stream_request(request))
+        if error:
+            return error
+
+        corpus, version = await course_chat_corpus(collection_id, filters)
+        cache_key, query_vector, cached = await lookup_cached_answer(corpus, version, query)
+        if cached:
+            return sse_response(stream_full_answer({"sources": cached["sources"], "cached": True}, cached["answer"], {}))
+
+        prepared = build_course_prompt(query, await search_collection_chunks(collection_id or None, query, filters))
+        if not prepared["prompt"]:
+            return sse_response(iter([
+                sse_event("sources", {"sources": []}),
+                sse_event("token", {"text": NO_DOCUMENTS_ANSWER}),
+                sse_event("done", {})
+            ]))
+
+        def closing(answer):
+            answer_cache.put(cache_key, {"answer": answer, "sources": prepared["sources"]}, query_vector)
+            return {}
+
+        if not model:
+            answer = extractive_answer(prepared["documents"])
+            return sse_response(stream_full_answer({"sources": prepared["sources"], "context": prepared["context"]}, answer, closing(answer)))
+        return sse_response(stream_answer(prepared["prompt"], {"sources": prepared["sources"], "context": prepared["context"]}, closing))
+
+    except Exception as e:
+        logger.error(f"Chat stream error: {str(e)}")
+        return handle_error(f"Failed to process chat request: {str(e)}")
+
+# Search endpoint for cross-course content search
+@app.post('/api/search')
+async def search_content(request: Request):
+    try:
+        data = await read_json(request)
+        if not data:
+            return handle_error("No data provided", 400)
+
+        query = data.get('query', '').strip()
+        collection_ids = data.get('collection_ids', [])
+        page = int(data.get('page', 1))
+        limit = int(data.get('limit', 20))
+
+        if not query:
+            return handle_error("Search query is required", 400)
+        if page < 1 or limit < 1:
+            return handle_error("Page and limit must be positive", 400)
+        mode = data.get('mode', RETRIEVAL_MODE)
+        if mode not in RETRIEVAL_MODES:
+            return handle_error(f"Search mode must be one of: {', '.join(RETRIEVAL_MODES)}", 400)
+
+        search_query = {}
+        if collection_ids:
+            valid_ids = [ObjectId(cid) for cid in collection_ids if is_valid_objectid(cid)]
+            if valid_ids:
+                search_query["_id"] = {"$in": valid_ids}
+
+        courses = await collection.find(search_query, SEARCH_COURSE_PROJECTION).to_list(None)
+
+        title_matches = find_title_matches(courses, query)
+        # Scoring is CPU-bound, so it runs in a worker thread
+        results, total_results, total_courses = await run_in_threadpool(search_documents, courses, query, page, limit,
+                                                                        mode)
+
+        return json_response({
+            "query": query,
+            "mode": mode,
+            "results": results,
+            "title_matches": title_matches,
+            "total_results": total_results,
+            "total_courses": total_courses,
+            "pagination": {
+                "page": page,
+                "limit": limit,
+                "pages": (total_results + limit - 1) // limit
+            },
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except Exception as e:
+        return handle_error(f"Failed to search content: {str(e)}")
+
+# Chatbot endpoints for "other" collection
+@app.post('/api/chatbot/upload')
+async def upload_chatbot_file(file: Optional[UploadFile] = File(None)):
+    """Upload files to the chatbot collection for RAG"""
+    try:
+        filename, file_hash, file_size, error = await save_upload(file)
+        if error:
+            return error
+
+        existing_file = await chatbot_collection.find_one({"file_hash": file_hash}, {"_id": 1})
+        if existing_file:
+            await run_in_threadpool(discard_unreferenced_upload, file_hash)
+            return handle_error("File already exists", 409)
+
+        job_id = await run_in_threadpool(
+            job_queue.submit,
+            "chatbot_file",
+            ingest_chatbot_file,
+            filename, file_size, file_hash,
+            filename=filename,
+            file_hash=file_hash
+        )
+
+        logger.info(f"Queued chatbot file: {filename} (job {job_id})")
+        return json_response({
+            "message": "File accepted for processing",
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "filename": filename,
+            "file_size": file_size
+        }, 202)
+
+    except Exception as e:
+        return handle_error(f"Failed to upload file: {str(e)}")
+
+@app.get('/api/chatbot/files')
+async def get_chatbot_files():
+    """Get all uploaded chatbot files"""
+    try:
+        # Full content is left out of the list view
+        files = await chatbot_collection.find({}, {"content": 0, "page_offsets": 0}).sort("uploaded_at", -1).to_list(None)
+        return json_response({
+            "files": files,
+            "total": len(files)
+        })
+    except Exception as e:
+        return handle_error(f"Failed to get files: {str(e)}")
+
+@app.delete('/api/chatbot/files/{file_id}')
+async def delete_chatbot_file(file_id: str):
+    """Delete a chatbot file"""
+    if not is_valid_objectid(file_id):
+        return handle_error("Invalid file ID", 400)
+
+    try:
+        deleted = await chatbot_collection.find_one_and_delete({"_id": ObjectId(file_id)}, projection={"content_id": 1})
+        if deleted is None:
+            return handle_error("File not found", 404)
+
+        await run_in_threadpool(release_contents, [deleted.get('content_id')], chatbot_file_id=deleted['_id'])
+        await bump_chatbot_version()
+        logger.info(f"Deleted chatbot file: {file_id}")
+        return json_response({"message": "File deleted successfully"})
+
+    except Exception as e:
+        return handle_error(f"Failed to delete file: {str(e)}")
+
+# Helper function to read and validate a chatbot question; returns (query, error response)
+def read_chatbot_request(data):
+    if not data:
+        return None, handle_error("No data provided", 400)
+    query = data.get('query', '').strip()
+    if not query:
+        return None, handle_error("Query is required", 400)
+    return query, None
+
+@app.post('/api/chatbot/chat')
+async def chatbot_chat(request: Request):
+    """RNS Reply chatbot that uses uploaded files (95%) and general AI knowledge (5%)"""
+    if not model and not embeddings:
+        return handle_error("AI service is not available", 503)
+
+    try:
+        query, error = read_chatbot_request(await read_json(request))
+        if error:
+            return error
+
+        cache_key, query_vector, cached = await lookup_cached_answer("chatbot", await chatbot_content_version(), query)
+        if cached:
+            return json_response({
+                **cached,
+                "cached": True,
+                "chatbot_name": "RNS Reply",
+                "timestamp": datetime.utcnow().isoformat()
+            })
+
+        # Retrieval over the chatbot files is shared with the Flask app and runs in a worker thread
+        prepared = await run_in_threadpool(prepare_chatbot_chat, query)
+        if not model and not prepared["has_file_context"]:
+            return handle_error("AI service is not available", 503)
+
+        if model:
+            answer = (await model.generate_content_async(prepared["prompt"])).text
+        else:
+            answer = extractive_answer(prepared["documents"])
+
+        result = {
+            "answer": answer,
+            "sources": prepared["sources"],
+            "video_links": detect_video_links(answer),
+            "has_file_context": prepared["has_file_context"]
+        }
+        answer_cache.put(cache_key, result, query_vector)
+
+        return json_response({
+            **result,
+            "context": prepared["context"],
+            "chatbot_name": "RNS Reply",
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except Exception as e:
+        logger.error(f"RNS Reply chatbot error: {str(e)}")
+        return handle_error(f"Failed to process chat request: {str(e)}")
+
+# Streaming variant of the RNS Reply chatbot; video links are detected once the answer is complete
+@app.api_route('/api/chatbot/chat/stream', methods=['GET', 'POST'])
+async def chatbot_chat_stream(request: Request):
+    if not model and not embeddings:
+        return handle_error("AI service is not available", 503)
+
+    try:
+        query, error = read_chatbot_request(await read_stream_request(request))
+        if error:
+            return error
+
+        cache_key, query_vector, cached = await lookup_cached_answer("chatbot", await chatbot_content_version(), query)
+        if cached:
+            return sse_response(stream_full_answer(
+                {"sources": cached["sources"], "has_file_context": cached["has_file_context"], "cached": True},
+                cached["answer"],
+                {
+                    "video_links": cached["video_links"],
+                    "chatbot_name": "RNS Reply",
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+            ))
+
+        prepared = await run_in_threadpool(prepare_chatbot_chat, query)
+        if not model and not prepared["has_file_context"]:
+            return handle_error("AI service is not available", 503)
+
+        def closing(answer):
+            video_links = detect_video_links(answer)
+            answer_cache.put(cache_key, {
+                "answer": answer,
+                "sources": prepared["sources"],
+                "video_links": video_links,
+                "has_file_context": prepared["has_file_context"]
+            }, query_vector)
+            return {
+                "video_links": video_links,
+                "chatbot_name": "RNS Reply",
+                "timestamp": datetime.utcnow().isoformat()
+            }
+
+        opening = {
+            "sources": prepared["sources"],
+            "has_file_context": prepared["has_file_context"],
+            "context": prepared["context"]
+        }
+        if not model:
+            answer = extractive_answer(prepared["documents"])
+            return sse_response(stream_full_answer(opening, answer, closing(answer)))
+        return sse_response(stream_answer(prepared["prompt"], opening, closing))
+
+    except Exception as e:
+        logger.error(f"RNS Reply chatbot stream error: {str(e)}")
+        return handle_error(f"Failed to process chat request: {str(e)}")
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=8000)
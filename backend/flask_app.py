@@ -1,179 +1,58 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from pymongo import MongoClient
-from dotenv import load_dotenv
-import os
-import PyPDF2
-from docx import Document
-import google.generativeai as genai
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import Document as LangchainDocument
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from pymongo import ReturnDocument
+from embedding_backends import create_embedding_backend, SimulatedEmbeddingBackend
+from embedding_dispatcher import EmbeddingDispatcher
+from upload_store import FileTooLargeError
+import services
+from services import (
+    GEMINI_API_KEY, EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, EMBEDDING_CONCURRENCY,
+    RETRIEVAL_MODE, RETRIEVAL_MODES, ANSWER_CACHE_VERSION, STATS_ID, NO_DOCUMENTS_ANSWER,
+    COURSE_METADATA_PROJECTION, COURSE_COUNT_FIELDS, COLLECTION_SORT_FIELDS, SEARCH_COURSE_PROJECTION,
+    is_valid_objectid, is_valid_item_ref, allowed_file, content_preview, document_body, load_document_contents,
+    bump_stats, reconcile_stats, bump_chatbot_version, chatbot_content_version, ensure_ids,
+    resolve_subject_id, resolve_document_id, encode_list_cursor, decode_list_cursor,
+    release_contents, release_course_contents, discard_unreferenced_upload,
+    ingest_course_document, ingest_chatbot_file,
+    open_vector_index, sync_course_index, sync_chatbot_index, refresh_course_index, parse_chat_filters, filtered_version,
+    prepare_course_chat, prepare_chatbot_chat,
+    find_title_matches, search_documents, detect_video_links,
+    extractive_answer, sse_event, stream_full_answer
+)
 
 from bson import ObjectId
-import io
+import click
 import re
 import logging
 from datetime import datetime
 import hashlib
 import json
-from typing import List, Dict, Any, Optional
+from typing import Dict, Any, Optional
 from werkzeug.utils import secure_filename
 
-# Disable Chroma telemetry
-os.environ['ANONYMIZED_TELEMETRY'] = 'False'
+class MongoJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes MongoDB ObjectIds as strings"""
+    @staticmethod
+    def default(o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        return DefaultJSONProvider.default(o)
 
 app = Flask(__name__)
+app.json = MongoJSONProvider(app)
 CORS(app)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
-MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "syllabus_db")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "uploads")
-MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB max file size
-
-# Ensure upload directory exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-# MongoDB setup
-try:
-    client = MongoClient(MONGODB_URI)
-    db = client[MONGODB_DATABASE]
-    collection = db.syllabus_collections
-    # Test connection
-    client.admin.command('ping')
-    logger.info("Successfully connected to MongoDB")
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {str(e)}")
-    raise
-
-# Initialize AI components
-if GEMINI_API_KEY:
-    try:        # Configure Gemini
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=GEMINI_API_KEY)
-        
-        # Configure text splitting
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
-        
-        chat_prompt = """You are an AI assistant specializing in analyzing and answering questions about academic syllabi and course materials. 
-        Given the following context from course documents and this question, provide a clear, accurate, and helpful response.
-        If the answer cannot be found in the context, say so clearly and suggest what additional information might be helpful.
-
-        Context:
-        {context}
-
-        Question:
-        {question}
-
-        Answer the question based on the context provided. Be clear and concise, and cite specific sources when relevant.
-        """
-        
-        logger.info("Successfully configured Gemini AI and components")
-    except Exception as e:
-        logger.error(f"Failed to configure AI components: {str(e)}")
-        model = None
-        embeddings = None
-else:
-    logger.warning("GEMINI_API_KEY not found. AI features will be disabled.")
-    model = None
-    embeddings = None
-
-# Helper function to validate ObjectId
-def is_valid_objectid(oid):
-    if not oid or oid == 'undefined':
-        return False
-    return bool(re.match(r'^[0-9a-fA-F]{24}$', oid))
-
-# Helper function to validate file
-def allowed_file(filename):
-    ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc', 'txt'}
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-# Helper function to get file hash
-def get_file_hash(file_content):
-    return hashlib.md5(file_content).hexdigest()
-
-# Helper function to extract text from PDF
-def extract_pdf_text(file):
-    try:
-        file.seek(0)
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page_num, page in enumerate(pdf_reader.pages):
-            try:
-                page_text = page.extract_text()
-                if page_text:
-                    text += f"\n--- Page {page_num + 1} ---\n{page_text}"
-            except Exception as e:
-                logger.warning(f"Failed to extract text from page {page_num + 1}: {str(e)}")
-                continue
-        return text.strip()
-    except Exception as e:
-        logger.error(f"Failed to extract PDF text: {str(e)}")
-        return f"Error extracting PDF: {str(e)}"
-
-# Helper function to extract text from DOCX
-def extract_docx_text(file):
-    try:
-        file.seek(0)
-        doc = Document(file)
-        text = ""
-        for para_num, para in enumerate(doc.paragraphs):
-            if para.text.strip():
-                text += para.text + "\n"
-        
-        # Extract text from tables
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    if cell.text.strip():
-                        text += cell.text + " "
-                text += "\n"
-        
-        return text.strip()
-    except Exception as e:
-        logger.error(f"Failed to extract DOCX text: {str(e)}")
-        return f"Error extracting DOCX: {str(e)}"
-
-# Helper function to extract text from TXT
-def extract_txt_text(file):
-    try:
-        file.seek(0)
-        content = file.read()
-        if isinstance(content, bytes):
-            content = content.decode('utf-8', errors='ignore')
-        return content.strip()
-    except Exception as e:
-        logger.error(f"Failed to extract TXT text: {str(e)}")
-        return f"Error extracting TXT: {str(e)}"
-
-# Helper function to extract text based on file type
-def extract_file_text(file, filename):
-    file_ext = filename.rsplit('.', 1)[1].lower()
-    
-    if file_ext == 'pdf':
-        return extract_pdf_text(file)
-    elif file_ext in ['docx', 'doc']:
-        return extract_docx_text(file)
-    elif file_ext == 'txt':
-        return extract_txt_text(file)
-    else:
-        return "Unsupported file format"
+# Connect to MongoDB and start the shared workers before serving; the names below exist from then on
+services.init()
+from services import (
+    client, db, collection, stats_collection, content_store, upload_store, job_queue, answer_cache, ann_index,
+    embeddings, embedding_cache, embedding_dispatcher, model
+)
 
 # Error handler
 def handle_error(error_msg, status_code=500):
@@ -203,25 +82,92 @@ def health_check():
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     try:
-        total_collections = collection.count_documents({})
-        total_subjects = 0
-        total_documents = 0
-        
-        for coll in collection.find():
-            subjects = coll.get('subjects', [])
-            total_subjects += len(subjects)
-            for subject in subjects:
-                total_documents += len(subject.get('documents', []))
+        # Counters are maintained by the write endpoints; reconcile=true recounts from scratch
+        stats = stats_collection.find_one({"_id": STATS_ID})
+        if stats is None or request.args.get('reconcile', 'false').lower() == 'true':
+            stats = reconcile_stats()
         
         return jsonify({
-            "total_collections": total_collections,
-            "total_subjects": total_subjects,
-            "total_documents": total_documents,
+            "total_collections": stats.get('collections', 0),
+            "total_subjects": stats.get('subjects', 0),
+            "total_documents": stats.get('documents', 0),
+            "reconciled_at": stats['reconciled_at'].isoformat() if stats.get('reconciled_at') else None,
             "timestamp": datetime.utcnow().isoformat()
         }), 200
     except Exception as e:
         return handle_error(f"Failed to get statistics: {str(e)}")
 
+# Embedding cache statistics
+@app.route('/api/embeddings/cache', methods=['GET'])
+def get_embedding_cache_stats():
+    if not embedding_cache:
+        return handle_error("Embedding cache is not available", 503)
+    
+    try:
+        stats = embedding_cache.stats()
+        stats["timestamp"] = datetime.utcnow().isoformat()
+        return jsonify(stats), 200
+    except Exception as e:
+        return handle_error(f"Failed to get embedding cache statistics: {str(e)}")
+
+# Embedding request throughput and retry statistics
+@app.route('/api/embeddings/stats', methods=['GET'])
+def get_embedding_stats():
+    if not embedding_dispatcher:
+        return handle_error("Embedding service is not available", 503)
+    
+    stats = embedding_dispatcher.stats()
+    stats["timestamp"] = datetime.utcnow().isoformat()
+    return jsonify(stats), 200
+
+# Recall and latency of the approximate "all courses" index against exact search
+@app.route('/api/ann/report', methods=['GET'])
+def get_ann_report():
+    if ann_index is None:
+        return handle_error("Approximate search is disabled (ALL_COURSES_SEARCH=exact)", 400)
+    if not embeddings:
+        return handle_error("Embedding service is not available", 503)
+    
+    try:
+        k = request.args.get('k', 10, type=int)
+        queries = request.args.get('queries', 100, type=int)
+        nprobes = [int(n) for n in request.args.get('nprobe', '1,2,4,8,16,32').split(',') if n.strip()]
+        if k < 1 or queries < 1 or not nprobes or min(nprobes) < 1:
+            return handle_error("k, queries and nprobe must be positive", 400)
+        
+        report = ann_index.recall_report(k=k, nprobes=nprobes, queries=min(queries, 1000))
+        report["timestamp"] = datetime.utcnow().isoformat()
+        return jsonify(report), 200
+        
+    except ValueError:
+        return handle_error("nprobe must be a comma-separated list of integers", 400)
+    except Exception as e:
+        return handle_error(f"Failed to build recall report: {str(e)}")
+
+# Get the status of a background ingestion job
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    if not is_valid_objectid(job_id):
+        return handle_error("Invalid job ID", 400)
+    
+    try:
+        job = job_queue.get(job_id)
+        if not job:
+            return handle_error("Job not found", 404)
+        
+        job['_id'] = str(job['_id'])
+        return jsonify(job), 200
+        
+    except Exception as e:
+        return handle_error(f"Failed to fetch job: {str(e)}")
+
+# Answer cache statistics
+@app.route('/api/chat/cache', methods=['GET'])
+def get_answer_cache_stats():
+    stats = answer_cache.stats()
+    stats["timestamp"] = datetime.utcnow().isoformat()
+    return jsonify(stats), 200
+
 # Create a course (collection)
 @app.route('/api/collections', methods=['POST'])
 def create_collection():
@@ -245,11 +191,13 @@ def create_collection():
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow(),
             "description": data.get('description', ''),
-            "tags": data.get('tags', [])
+            "tags": data.get('tags', []),
+            "content_version": 0
         }
         
         result = collection.insert_one(course)
         course['_id'] = str(result.inserted_id)
+        bump_stats(collections=1)
         
         logger.info(f"Created new course: {name}")
         return jsonify(course), 201
@@ -267,37 +215,58 @@ def get_collections():
         sort_order = request.args.get('sort_order', 'desc')
         page = int(request.args.get('page', 1))
         limit = int(request.args.get('limit', 50))
+        cursor = request.args.get('cursor', '').strip()
+        view = request.args.get('view', 'full')
+        
+        if sort_by not in COLLECTION_SORT_FIELDS:
+            return handle_error(f"Invalid sort field. Use one of: {', '.join(sorted(COLLECTION_SORT_FIELDS))}", 400)
+        if limit < 1 or page < 1:
+            return handle_error("Page and limit must be positive", 400)
         
         # Build query
         query = {}
         if search:
             query["name"] = {"$regex": search, "$options": "i"}
         
-        # Build sort
+        # Build sort; _id breaks ties so keyset pages never overlap
         sort_direction = -1 if sort_order == 'desc' else 1
-        sort_query = [(sort_by, sort_direction)]
-        
-        # Execute query with pagination
-        skip = (page - 1) * limit
-        courses = list(collection.find(query).sort(sort_query).skip(skip).limit(limit))
+        page_query = query
+        if cursor:
+            try:
+                page_query = {"$and": [query, decode_list_cursor(cursor, sort_by, sort_direction)]}
+            except Exception:
+                return handle_error("Invalid cursor", 400)
+        
+        pipeline = [
+            {"$match": page_query},
+            {"$sort": {sort_by: sort_direction, "_id": sort_direction}}
+        ]
+        if not cursor:
+            pipeline.append({"$skip": (page - 1) * limit})
+        pipeline.extend([
+            {"$limit": limit},
+            # Counts are computed by the server so document metadata never has to be shipped for them
+            {"$addFields": COURSE_COUNT_FIELDS},
+            {"$project": {"subjects": 0} if view == 'summary' else COURSE_METADATA_PROJECTION}
+        ])
+        courses = list(collection.aggregate(pipeline))
         
-        # Convert ObjectId to string and add metadata
+        # Convert ObjectId to string
+        next_cursor = encode_list_cursor(courses[-1], sort_by) if len(courses) == limit else None
         for course in courses:
             course['_id'] = str(course['_id'])
-            # Add subject and document counts
-            course['subject_count'] = len(course.get('subjects', []))
-            course['document_count'] = sum(len(s.get('documents', [])) for s in course.get('subjects', []))
         
         # Get total count for pagination
-        total_count = collection.count_documents(query)
+        total_count = collection.count_documents(query) if query else collection.estimated_document_count()
         
         return jsonify({
             "collections": courses,
             "pagination": {
-                "page": page,
+                "page": None if cursor else page,
                 "limit": limit,
                 "total": total_count,
-                "pages": (total_count + limit - 1) // limit
+                "pages": (total_count + limit - 1) // limit,
+                "next_cursor": next_cursor
             }
         }), 200
         
@@ -311,10 +280,17 @@ def get_collection(collection_id):
         return handle_error("Invalid course ID", 400)
     
     try:
-        course = collection.find_one({"_id": ObjectId(collection_id)})
+        course = collection.find_one({"_id": ObjectId(collection_id)}, COURSE_METADATA_PROJECTION)
         if not course:
             return handle_error("Course not found", 404)
         
+        # Document bodies are only loaded when explicitly requested
+        if request.args.get('include_content', 'false').lower() == 'true':
+            documents = [doc for subject in course.get('subjects', []) for doc in subject.get('documents', [])]
+            records = load_document_contents(documents)
+            for doc in documents:
+                doc['content'] = document_body(doc, records)['content']
+        
         course['_id'] = str(course['_id'])
         return jsonify(course), 200
         
@@ -342,14 +318,19 @@ def update_collection(collection_id):
         
         update_fields['updated_at'] = datetime.utcnow()
         
-        result = collection.update_one(
-            {"_id": ObjectId(collection_id)},
-            {"$set": update_fields}
-        )
+        # Renaming changes the source labels stored in the vector index
+        update = {"$set": update_fields}
+        if 'name' in update_fields:
+            update["$inc"] = {"content_version": 1}
+        
+        result = collection.update_one({"_id": ObjectId(collection_id)}, update)
         
         if result.matched_count == 0:
             return handle_error("Course not found", 404)
         
+        if 'name' in update_fields:
+            refresh_course_index(collection_id)
+        
         return jsonify({"message": "Course updated successfully"}), 200
         
     except Exception as e:
@@ -362,10 +343,26 @@ def delete_collection(collection_id):
         return handle_error("Invalid course ID", 400)
     
     try:
-        result = collection.delete_one({"_id": ObjectId(collection_id)})
-        if result.deleted_count == 0:
+        deleted = collection.find_one_and_delete(
+            {"_id": ObjectId(collection_id)},
+            projection={"subjects.documents._id": 1}
+        )
+        if deleted is None:
             return handle_error("Course not found", 404)
         
+        subjects = deleted.get('subjects', [])
+        bump_stats(
+            collections=-1,
+            subjects=-len(subjects),
+            documents=-sum(len(subject.get('documents', [])) for subject in subjects)
+        )
+        release_course_contents(collection_id)
+        open_vector_index(f"course_{collection_id}").drop()
+        if ann_index is not None:
+            ann_index.request_sync()
+        answer_cache.invalidate(f"course:{collection_id}")
+        answer_cache.invalidate("course:all")
+        
         logger.info(f"Deleted course with ID: {collection_id}")
         return jsonify({"message": "Course deleted successfully"}), 200
         
@@ -388,6 +385,7 @@ def add_subject(collection_id):
             return handle_error("Topic name is required", 400)
         
         subject = {
+            "_id": ObjectId(),
             "name": name,
             "description": data.get('description', ''),
             "documents": [],
@@ -405,6 +403,7 @@ def add_subject(collection_id):
         if result.matched_count == 0:
             return handle_error("Course not found", 404)
         
+        bump_stats(subjects=1)
         logger.info(f"Added subject '{name}' to course {collection_id}")
         return jsonify({"message": "Topic added successfully", "subject": subject}), 201
         
@@ -412,89 +411,102 @@ def add_subject(collection_id):
         return handle_error(f"Failed to add topic: {str(e)}")
 
 # Update a subject
-@app.route('/api/collections/<collection_id>/subjects/<int:subject_index>', methods=['PUT'])
-def update_subject(collection_id, subject_index):
+@app.route('/api/collections/<collection_id>/subjects/<subject_ref>', methods=['PUT'])
+def update_subject(collection_id, subject_ref):
     if not is_valid_objectid(collection_id):
         return handle_error("Invalid course ID", 400)
     
-    if subject_index < 0:
-        return handle_error("Invalid topic index", 400)
+    if not is_valid_item_ref(subject_ref):
+        return handle_error("Invalid topic ID", 400)
     
     try:
         data = request.json
         if not data:
             return handle_error("No data provided", 400)
         
+        subject_id = resolve_subject_id(collection_id, subject_ref)
+        if subject_id is None:
+            return handle_error("Course or topic not found", 404)
+        
+        # The positional operator updates only the matched topic
         update_fields = {}
         if 'name' in data and data['name'].strip():
-            update_fields[f'subjects.{subject_index}.name'] = data['name'].strip()
+            update_fields['subjects.$.name'] = data['name'].strip()
         if 'description' in data:
-            update_fields[f'subjects.{subject_index}.description'] = data['description']
+            update_fields['subjects.$.description'] = data['description']
         
         update_fields['updated_at'] = datetime.utcnow()
         
+        renamed = 'subjects.$.name' in update_fields
+        update = {"$set": update_fields}
+        if renamed:
+            update["$inc"] = {"content_version": 1}
+        
         result = collection.update_one(
-            {"_id": ObjectId(collection_id), f"subjects.{subject_index}": {"$exists": True}},
-            {"$set": update_fields}
+            {"_id": ObjectId(collection_id), "subjects._id": subject_id},
+            update
         )
         
         if result.matched_count == 0:
             return handle_error("Course or topic not found", 404)
         
+        if renamed:
+            refresh_course_index(collection_id)
+        
         return jsonify({"message": "Topic updated successfully"}), 200
         
     except Exception as e:
         return handle_error(f"Failed to update topic: {str(e)}")
 
 # Delete a topic (subject) from a course
-@app.route('/api/collections/<collection_id>/subjects/<int:subject_index>', methods=['DELETE'])
-def delete_subject(collection_id, subject_index):
+@app.route('/api/collections/<collection_id>/subjects/<subject_ref>', methods=['DELETE'])
+def delete_subject(collection_id, subject_ref):
     if not is_valid_objectid(collection_id):
         return handle_error("Invalid course ID", 400)
     
-    if subject_index < 0:
-        return handle_error("Invalid topic index", 400)
+    if not is_valid_item_ref(subject_ref):
+        return handle_error("Invalid topic ID", 400)
     
     try:
-        # First, get the course to check if subject exists
-        course = collection.find_one({"_id": ObjectId(collection_id)})
-        if not course:
-            return handle_error("Course not found", 404)
-        
-        subjects = course.get('subjects', [])
-        if subject_index >= len(subjects):
-            return handle_error("Topic not found at the specified index", 404)
-        
-        # Remove the subject at the specified index
-        subjects.pop(subject_index)
+        subject_id = resolve_subject_id(collection_id, subject_ref)
+        if subject_id is None:
+            return handle_error("Course or topic not found", 404)
         
-        result = collection.update_one(
-            {"_id": ObjectId(collection_id)},
+        # Pull just this topic; the returned copy says which documents went with it
+        deleted = collection.find_one_and_update(
+            {"_id": ObjectId(collection_id), "subjects._id": subject_id},
             {
-                "$set": {
-                    "subjects": subjects,
-                    "updated_at": datetime.utcnow()
-                }
-            }
+                "$pull": {"subjects": {"_id": subject_id}},
+                "$set": {"updated_at": datetime.utcnow()},
+                "$inc": {"content_version": 1}
+            },
+            projection={"subjects": {"$elemMatch": {"_id": subject_id}}},
+            return_document=ReturnDocument.BEFORE
         )
         
-        if result.matched_count == 0:
-            return handle_error("Course not found", 404)
+        if deleted is None:
+            return handle_error("Course or topic not found", 404)
+        
+        deleted_subject = deleted['subjects'][0]
+        for doc in deleted_subject.get('documents', []):
+            release_contents([doc.get('content_id')], course_id=ObjectId(collection_id), document_id=doc.get('_id'))
+        bump_stats(subjects=-1, documents=-len(deleted_subject.get('documents', [])))
+        refresh_course_index(collection_id)
         
-        logger.info(f"Deleted subject at index {subject_index} from course {collection_id}")
+        logger.info(f"Deleted subject {subject_id} from course {collection_id}")
         return jsonify({"message": "Topic deleted successfully"}), 200
         
     except Exception as e:
         return handle_error(f"Failed to delete topic: {str(e)}")
 
 # Upload syllabus file (document) to a topic
-@app.route('/api/collections/<collection_id>/subjects/<int:subject_index>/documents', methods=['POST'])
-def upload_document(collection_id, subject_index):
+@app.route('/api/collections/<collection_id>/subjects/<subject_ref>/documents', methods=['POST'])
+def upload_document(collection_id, subject_ref):
     if not is_valid_objectid(collection_id):
         return handle_error("Invalid course ID", 400)
     
-    if subject_index < 0:
-        return handle_error("Invalid topic index", 400)
+    if not is_valid_item_ref(subject_ref):
+        return handle_error("Invalid topic ID", 400)
     
     try:
         if 'file' not in request.files:
@@ -508,93 +520,78 @@ def upload_document(collection_id, subject_index):
         if not allowed_file(filename):
             return handle_error("File type not allowed. Only PDF, DOCX, DOC, and TXT files are supported", 400)
         
-        # Check file size
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        if file_size > MAX_FILE_SIZE:
-            return handle_error(f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB", 400)
-        file.seek(0)
-        
-        # Extract text from the file
-        text_content = extract_file_text(file, filename)
-        
-        # Get file hash for deduplication
-        file.seek(0)
-        file_content = file.read()
-        file_hash = get_file_hash(file_content)
-        
-        # Create document object
-        document = {
-            "filename": filename,
-            "content": text_content,
-            "file_size": file_size,
-            "file_hash": file_hash,
-            "uploaded_at": datetime.utcnow(),
-            "content_preview": text_content[:500] + "..." if len(text_content) > 500 else text_content
-        }
-        
-        # Check if subject exists and add document
-        result = collection.update_one(
-            {"_id": ObjectId(collection_id), f"subjects.{subject_index}": {"$exists": True}},
-            {
-                "$push": {f"subjects.{subject_index}.documents": document},
-                "$set": {"updated_at": datetime.utcnow()}
-            }
+        subject_id = resolve_subject_id(collection_id, subject_ref)
+        course = subject_id and collection.find_one(
+            {"_id": ObjectId(collection_id), "subjects._id": subject_id},
+            {"_id": 1}
         )
-        
-        if result.matched_count == 0:
+        if not course:
             return handle_error("Course or topic not found", 404)
         
-        logger.info(f"Uploaded document '{filename}' to course {collection_id}, subject {subject_index}")
+        # Stream the upload to disk, hashing it and checking its size on the way;
+        # extraction and indexing happen in the background
+        try:
+            file_hash, file_size = upload_store.save(file.stream)
+        except FileTooLargeError as e:
+            return handle_error(str(e), 400)
+        
+        job_id = job_queue.submit(
+            "course_document",
+            ingest_course_document,
+            collection_id, str(subject_id), filename, file_size, file_hash,
+            collection_id=collection_id,
+            subject_id=str(subject_id),
+            filename=filename,
+            file_hash=file_hash
+        )
+        
+        logger.info(f"Queued document '{filename}' for course {collection_id}, subject {subject_id} (job {job_id})")
         return jsonify({
-            "message": "Document uploaded successfully",
+            "message": "Document accepted for processing",
+            "job_id": job_id,
+            "subject_id": str(subject_id),
+            "status_url": f"/api/jobs/{job_id}",
             "filename": filename,
-            "file_size": file_size,
-            "content_length": len(text_content)
-        }), 201
+            "file_size": file_size
+        }), 202
         
     except Exception as e:
         return handle_error(f"Failed to upload document: {str(e)}")
 
 # Delete a syllabus file (document) from a topic
-@app.route('/api/collections/<collection_id>/subjects/<int:subject_index>/documents/<int:document_index>', methods=['DELETE'])
-def delete_document(collection_id, subject_index, document_index):
+@app.route('/api/collections/<collection_id>/subjects/<subject_ref>/documents/<document_ref>', methods=['DELETE'])
+def delete_document(collection_id, subject_ref, document_ref):
     if not is_valid_objectid(collection_id):
         return handle_error("Invalid course ID", 400)
     
-    if subject_index < 0 or document_index < 0:
-        return handle_error("Invalid topic or document index", 400)
+    if not is_valid_item_ref(subject_ref) or not is_valid_item_ref(document_ref):
+        return handle_error("Invalid topic or document ID", 400)
     
     try:
-        # First, get the course to check if document exists
-        course = collection.find_one({"_id": ObjectId(collection_id)})
-        if not course:
-            return handle_error("Course not found", 404)
-        
-        subjects = course.get('subjects', [])
-        if subject_index >= len(subjects):
-            return handle_error("Topic not found", 404)
-        
-        documents = subjects[subject_index].get('documents', [])
-        if document_index >= len(documents):
+        subject_id = resolve_subject_id(collection_id, subject_ref)
+        document_id = subject_id and resolve_document_id(collection_id, subject_id, document_ref)
+        if document_id is None:
             return handle_error("Document not found", 404)
         
-        # Remove the document at the specified index
-        deleted_doc = documents.pop(document_index)
-        subjects[subject_index]['documents'] = documents
-        
-        result = collection.update_one(
-            {"_id": ObjectId(collection_id)},
+        # Pull just this document from its topic; the returned copy of the topic still holds it
+        deleted = collection.find_one_and_update(
+            {"_id": ObjectId(collection_id), "subjects": {"$elemMatch": {"_id": subject_id, "documents._id": document_id}}},
             {
-                "$set": {
-                    "subjects": subjects,
-                    "updated_at": datetime.utcnow()
-                }
-            }
+                "$pull": {"subjects.$.documents": {"_id": document_id}},
+                "$set": {"updated_at": datetime.utcnow()},
+                "$inc": {"content_version": 1}
+            },
+            projection={"subjects": {"$elemMatch": {"_id": subject_id}}},
+            return_document=ReturnDocument.BEFORE
         )
         
-        if result.matched_count == 0:
-            return handle_error("Course not found", 404)
+        if deleted is None:
+            return handle_error("Document not found", 404)
+        
+        deleted_doc = next(doc for doc in deleted['subjects'][0].get('documents', []) if doc.get('_id') == document_id)
+        release_contents([deleted_doc.get('content_id')], course_id=ObjectId(collection_id), document_id=document_id)
+        bump_stats(documents=-1)
+        refresh_course_index(collection_id)
         
         logger.info(f"Deleted document '{deleted_doc.get('filename', 'unknown')}' from course {collection_id}")
         return jsonify({"message": "Document deleted successfully"}), 200
@@ -602,98 +599,155 @@ def delete_document(collection_id, subject_index, document_index):
     except Exception as e:
         return handle_error(f"Failed to delete document: {str(e)}")
 
-def process_document_for_rag(document_text: str, metadata: Dict[str, Any]) -> List[LangchainDocument]:
-    """Process document text into chunks for RAG"""
-    chunks = text_splitter.split_text(document_text)
-    return [LangchainDocument(page_content=chunk, metadata=metadata) for chunk in chunks]
-
-def get_collection_documents(collection_id: str = None) -> List[LangchainDocument]:
-    """Retrieve and process all documents from specified collection(s)"""
-    query = {"_id": ObjectId(collection_id)} if collection_id else {}
+# Helper function to validate a course chat request; returns (query, collection_id, filters, error response)
+def read_course_chat_request(data):
+    if not data:
+        return None, None, None, handle_error("No data provided", 400)
     
-    all_docs = []
-    courses = collection.find(query)
+    query = data.get('query', '').strip()
+    collection_id = data.get('collection_id', '').strip()
     
-    for course in courses:
-        course_name = course.get('name', 'Unknown Course')
-        for subject in course.get('subjects', []):
-            subject_name = subject.get('name', 'Unknown Subject')
-            for doc in subject.get('documents', []):
-                metadata = {
-                    'course_name': course_name,
-                    'subject_name': subject_name,
-                    'filename': doc.get('filename', 'Unknown File'),
-                    'source': f"{course_name} > {subject_name} > {doc.get('filename', 'Unknown File')}"
-                }
-                all_docs.extend(process_document_for_rag(doc.get('content', ''), metadata))
+    if not query:
+        return None, None, None, handle_error("Query is required", 400)
+    
+    if collection_id == 'all':
+        collection_id = ''
+    if collection_id and not is_valid_objectid(collection_id):
+        return None, None, None, handle_error("Invalid course ID", 400)
     
-    return all_docs
+    filters, error = parse_chat_filters(data, collection_id)
+    if error:
+        return None, None, None, handle_error(error, 400)
+    
+    return query, collection_id, filters, None
+
+def course_chat_corpus(collection_id: str, filters: Optional[Dict[str, Any]] = None):
+    """Identify the corpus a course chat runs against as (cache corpus key, content version)"""
+    if collection_id:
+        course = collection.find_one({"_id": ObjectId(collection_id)}, {"content_version": 1})
+        return f"course:{collection_id}", filtered_version(course.get('content_version', 0) if course else None, filters)
+    versions = sorted(
+        (str(course['_id']), course.get('content_version', 0))
+        for course in collection.find({}, {"content_version": 1})
+    )
+    return "course:all", filtered_version(hashlib.md5(json.dumps(versions).encode('utf-8')).hexdigest(), filters)
+
+def lookup_cached_answer(corpus: str, version: Any, query: str):
+    """Return (cache key, query vector, cached answer or None) for a chat question"""
+    key = answer_cache.make_key(corpus, version, query, ANSWER_CACHE_VERSION)
+    query_vector = None
+    if answer_cache.similarity_threshold is not None and embeddings:
+        query_vector = embeddings.embed_query(query)
+    return key, query_vector, answer_cache.get(key, query_vector)
 
+# Helper function to wrap an event generator in a streaming response
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
+def stream_answer(prompt: str, opening: Dict[str, Any], closing=None):
+    """Yield SSE events for a Gemini answer.
+
+    ``opening`` (e.g. the sources) is sent before generation starts, each
+    streamed text chunk is sent as a ``token`` event, and ``closing(answer)``
+    supplies the payload of the final ``done`` event.
+    """
+    yield sse_event("sources", opening)
+    parts = []
+    try:
+        for chunk in model.generate_content(prompt, stream=True):
+            text = chunk.text
+            if text:
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+    except Exception as e:
+        logger.error(f"Streaming chat error: {str(e)}")
+        yield sse_event("error", {"error": f"Failed to generate answer: {str(e)}"})
+        return
+    
+    answer = "".join(parts)
+    yield sse_event("done", closing(answer) if closing else {})
 
 # Enhanced chat endpoint using Gemini directly
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    if not model or not embeddings:
+    if not embeddings:
         return handle_error("AI service is not available", 503)
     
     try:
-        data = request.json
-        if not data:
-            return handle_error("No data provided", 400)
-        
-        query = data.get('query', '').strip()
-        collection_id = data.get('collection_id', '').strip()
+        query, collection_id, filters, error = read_course_chat_request(request.json)
+        if error:
+            return error
         
-        if not query:
-            return handle_error("Query is required", 400)
-            
-        # Get documents based on collection_id
-        docs = get_collection_documents(collection_id if collection_id != 'all' else None)
+        corpus, version = course_chat_corpus(collection_id, filters)
+        cache_key, query_vector, cached = lookup_cached_answer(corpus, version, query)
+        if cached:
+            return jsonify({**cached, "cached": True}), 200
         
-        if not docs:
+        prepared = prepare_course_chat(query, collection_id, filters)
+        if not prepared["prompt"]:
             return jsonify({
-                "answer": "I don't have any documents to work with. Please add some documents first.",
+                "answer": NO_DOCUMENTS_ANSWER,
                 "sources": []
             }), 200
         
-        # Create vector store and get relevant documents
-        vectorstore = Chroma.from_documents(docs, embeddings)
-        relevant_docs = vectorstore.similarity_search(query, k=5)
-        
-        # Prepare context from relevant documents
-        context = "\n\n".join([
-            f"From {doc.metadata.get('source', 'Unknown Source')}:\n{doc.page_content}"
-            for doc in relevant_docs
-        ])
-        
-        # Prepare prompt
-        prompt = chat_prompt.format(
-            context=context,
-            question=query
-        )
-        
-        # Generate response using Gemini
-        response = model.generate_content(prompt)
-        
-        # Extract sources
-        sources = []
-        seen_sources = set()
-        for doc in relevant_docs:
-            source = doc.metadata.get("source")
-            if source and source not in seen_sources:
-                seen_sources.add(source)
-                sources.append(source)
+        # Generate response using Gemini, or quote the passages when it is not configured
+        if model:
+            answer = model.generate_content(prepared["prompt"]).text
+        else:
+            answer = extractive_answer(prepared["documents"])
         
-        return jsonify({
-            "answer": response.text,
-            "sources": sources
-        }), 200
+        result = {
+            "answer": answer,
+            "sources": prepared["sources"]
+        }
+        answer_cache.put(cache_key, result, query_vector)
+        return jsonify({**result, "context": prepared["context"]}), 200
         
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
         return handle_error(f"Failed to process chat request: {str(e)}")
 
+# Streaming chat endpoint; GET with query parameters supports EventSource clients
+@app.route('/api/chat/stream', methods=['GET', 'POST'])
+def chat_stream():
+    if not embeddings:
+        return handle_error("AI service is not available", 503)
+    
+    try:
+        data = request.json if request.method == 'POST' else request.args
+        query, collection_id, filters, error = read_course_chat_request(data)
+        if error:
+            return error
+        
+        corpus, version = course_chat_corpus(collection_id, filters)
+        cache_key, query_vector, cached = lookup_cached_answer(corpus, version, query)
+        if cached:
+            return sse_response(stream_full_answer({"sources": cached["sources"], "cached": True}, cached["answer"], {}))
+        
+        prepared = prepare_course_chat(query, collection_id, filters)
+        if not prepared["prompt"]:
+            return sse_response(iter([
+                sse_event("sources", {"sources": []}),
+                sse_event("token", {"text": NO_DOCUMENTS_ANSWER}),
+                sse_event("done", {})
+            ]))
+        
+        def closing(answer):
+            answer_cache.put(cache_key, {"answer": answer, "sources": prepared["sources"]}, query_vector)
+            return {}
+        
+        if not model:
+            answer = extractive_answer(prepared["documents"])
+            return sse_response(stream_full_answer({"sources": prepared["sources"], "context": prepared["context"]}, answer, closing(answer)))
+        return sse_response(stream_answer(prepared["prompt"], {"sources": prepared["sources"], "context": prepared["context"]}, closing))
+        
+    except Exception as e:
+        logger.error(f"Chat stream error: {str(e)}")
+        return handle_error(f"Failed to process chat request: {str(e)}")
 
 # Search endpoint for cross-course content search
 @app.route('/api/search', methods=['POST'])
@@ -705,9 +759,16 @@ def search_content():
         
         query = data.get('query', '').strip()
         collection_ids = data.get('collection_ids', [])
+        page = int(data.get('page', 1))
+        limit = int(data.get('limit', 20))
         
         if not query:
             return handle_error("Search query is required", 400)
+        if page < 1 or limit < 1:
+            return handle_error("Page and limit must be positive", 400)
+        mode = data.get('mode', RETRIEVAL_MODE)
+        if mode not in RETRIEVAL_MODES:
+            return handle_error(f"Search mode must be one of: {', '.join(RETRIEVAL_MODES)}", 400)
         
         # Build MongoDB query
         search_query = {}
@@ -716,66 +777,24 @@ def search_content():
             if valid_ids:
                 search_query["_id"] = {"$in": valid_ids}
         
-        # Search in collection names, subject names, and document content
-        courses = list(collection.find(search_query))
-        results = []
+        # Only names and document ids are needed; text is served from the keyword index
+        courses = list(collection.find(search_query, SEARCH_COURSE_PROJECTION))
         
-        for course in courses:
-            course_matches = []
-            
-            # Search in course name
-            if query.lower() in course.get('name', '').lower():
-                course_matches.append({
-                    "type": "course_name",
-                    "content": course.get('name', ''),
-                    "match_type": "title"
-                })
-            
-            # Search in subjects and documents
-            for subject_idx, subject in enumerate(course.get('subjects', [])):
-                # Search in subject name
-                if query.lower() in subject.get('name', '').lower():
-                    course_matches.append({
-                        "type": "subject_name",
-                        "content": subject.get('name', ''),
-                        "subject_index": subject_idx,
-                        "match_type": "title"
-                    })
-                
-                # Search in document content
-                for doc_idx, doc in enumerate(subject.get('documents', [])):
-                    doc_content = doc.get('content', '')
-                    if query.lower() in doc_content.lower():
-                        # Find the context around the match
-                        content_lower = doc_content.lower()
-                        query_lower = query.lower()
-                        match_start = content_lower.find(query_lower)
-                        
-                        # Extract context (100 chars before and after)
-                        context_start = max(0, match_start - 100)
-                        context_end = min(len(doc_content), match_start + len(query) + 100)
-                        context = doc_content[context_start:context_end]
-                        
-                        course_matches.append({
-                            "type": "document_content",
-                            "filename": doc.get('filename', 'Unknown'),
-                            "content": context,
-                            "subject_index": subject_idx,
-                            "document_index": doc_idx,
-                            "match_type": "content"
-                        })
-            
-            if course_matches:
-                results.append({
-                    "course_id": str(course['_id']),
-                    "course_name": course.get('name', 'Unknown'),
-                    "matches": course_matches[:10]  # Limit matches per course
-                })
+        title_matches = find_title_matches(courses, query)
+        results, total_results, total_courses = search_documents(courses, query, page, limit, mode)
         
         return jsonify({
             "query": query,
+            "mode": mode,
             "results": results,
-            "total_courses": len(results),
+            "title_matches": title_matches,
+            "total_results": total_results,
+            "total_courses": total_courses,
+            "pagination": {
+                "page": page,
+                "limit": limit,
+                "pages": (total_results + limit - 1) // limit
+            },
             "timestamp": datetime.utcnow().isoformat()
         }), 200
         
@@ -798,45 +817,35 @@ def upload_chatbot_file():
         if not allowed_file(filename):
             return handle_error("File type not allowed. Only PDF, DOCX, DOC, and TXT files are supported", 400)
         
-        # Check file size
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        if file_size > MAX_FILE_SIZE:
-            return handle_error(f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB", 400)
-        file.seek(0)
-        
-        # Extract text from the file
-        text_content = extract_file_text(file, filename)
-        
-        # Get file hash for deduplication
-        file.seek(0)
-        file_content = file.read()
-        file_hash = get_file_hash(file_content)
+        # Stream the upload to disk, hashing it for deduplication on the way
+        try:
+            file_hash, file_size = upload_store.save(file.stream)
+        except FileTooLargeError as e:
+            return handle_error(str(e), 400)
         
         # Check if file already exists
         chatbot_collection = db.chatbot_files
-        existing_file = chatbot_collection.find_one({"file_hash": file_hash})
+        existing_file = chatbot_collection.find_one({"file_hash": file_hash}, {"_id": 1})
         if existing_file:
+            discard_unreferenced_upload(file_hash)
             return handle_error("File already exists", 409)
         
-        # Create document object
-        document = {
-            "filename": filename,
-            "content": text_content,
-            "file_size": file_size,
-            "file_hash": file_hash,
-            "uploaded_at": datetime.utcnow(),
-            "content_preview": text_content[:200] + "..." if len(text_content) > 200 else text_content
-        }
-        
-        result = chatbot_collection.insert_one(document)
-        document['_id'] = str(result.inserted_id)
+        job_id = job_queue.submit(
+            "chatbot_file",
+            ingest_chatbot_file,
+            filename, file_size, file_hash,
+            filename=filename,
+            file_hash=file_hash
+        )
         
-        logger.info(f"Uploaded chatbot file: {filename}")
+        logger.info(f"Queued chatbot file: {filename} (job {job_id})")
         return jsonify({
-            "message": "File uploaded successfully",
-            "file": document
-        }), 201
+            "message": "File accepted for processing",
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "filename": filename,
+            "file_size": file_size
+        }), 202
         
     except Exception as e:
         return handle_error(f"Failed to upload file: {str(e)}")
@@ -846,12 +855,11 @@ def get_chatbot_files():
     """Get all uploaded chatbot files"""
     try:
         chatbot_collection = db.chatbot_files
-        files = list(chatbot_collection.find().sort("uploaded_at", -1))
+        # Full content is left out of the list view
+        files = list(chatbot_collection.find({}, {"content": 0, "page_offsets": 0}).sort("uploaded_at", -1))
         
         for file in files:
             file['_id'] = str(file['_id'])
-            # Remove full content for list view
-            file.pop('content', None)
         
         return jsonify({
             "files": files,
@@ -869,37 +877,23 @@ def delete_chatbot_file(file_id):
     
     try:
         chatbot_collection = db.chatbot_files
-        result = chatbot_collection.delete_one({"_id": ObjectId(file_id)})
+        deleted = chatbot_collection.find_one_and_delete({"_id": ObjectId(file_id)}, projection={"content_id": 1})
         
-        if result.deleted_count == 0:
+        if deleted is None:
             return handle_error("File not found", 404)
         
+        release_contents([deleted.get('content_id')], chatbot_file_id=deleted['_id'])
+        bump_chatbot_version()
         logger.info(f"Deleted chatbot file: {file_id}")
         return jsonify({"message": "File deleted successfully"}), 200
         
     except Exception as e:
         return handle_error(f"Failed to delete file: {str(e)}")
 
-def detect_video_links(text):
-    """Detect and extract video links from text"""
-    video_patterns = [
-        r'https?://(?:www\.)?youtube\.com/watch\?v=[\w-]+',
-        r'https?://youtu\.be/[\w-]+',
-        r'https?://(?:www\.)?vimeo\.com/\d+',
-        r'https?://.*\.(?:mp4|avi|mov|wmv|flv|webm)'
-    ]
-    
-    links = []
-    for pattern in video_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        links.extend(matches)
-    
-    return links
-
 @app.route('/api/chatbot/chat', methods=['POST'])
 def chatbot_chat():
     """Enhanced RNS Reply chatbot that uses uploaded files (95%) and general AI knowledge (5%)"""
-    if not model:
+    if not model and not embeddings:
         return handle_error("AI service is not available", 503)
     
     try:
@@ -911,104 +905,39 @@ def chatbot_chat():
         if not query:
             return handle_error("Query is required", 400)
         
-        # Get uploaded files for context
-        chatbot_collection = db.chatbot_files
-        uploaded_files = list(chatbot_collection.find())
+        cache_key, query_vector, cached = lookup_cached_answer("chatbot", chatbot_content_version(), query)
+        if cached:
+            return jsonify({
+                **cached,
+                "cached": True,
+                "chatbot_name": "RNS Reply",
+                "timestamp": datetime.utcnow().isoformat()
+            }), 200
         
-        context_from_files = ""
-        relevant_docs = []
-        if uploaded_files and embeddings:
-            try:
-                # Process uploaded files for RAG
-                docs = []
-                for file_doc in uploaded_files:
-                    metadata = {
-                        'filename': file_doc.get('filename', 'Unknown'),
-                        'source': f"Uploaded file: {file_doc.get('filename', 'Unknown')}"
-                    }
-                    docs.extend(process_document_for_rag(file_doc.get('content', ''), metadata))
-                
-                if docs:
-                    # Create vector store and get relevant documents
-                    vectorstore = Chroma.from_documents(docs, embeddings)
-                    relevant_docs = vectorstore.similarity_search(query, k=5)  # Get more relevant docs
-                    
-                    context_from_files = "\n\n".join([
-                        f"From {doc.metadata.get('source', 'uploaded file')}:\n{doc.page_content}"
-                        for doc in relevant_docs
-                    ])
-            except Exception as e:
-                logger.warning(f"Failed to process uploaded files for context: {str(e)}")
-          # Create enhanced prompt for RNS Reply with emphasis on uploaded files
-        if context_from_files:
-            prompt = f"""You are RNS Reply, an advanced AI assistant. Your primary goal is to answer questions using the uploaded documents as your main source of information.
-
-CRITICAL INSTRUCTIONS:
-1. **BASE YOUR ANSWER PRIMARILY ON THE UPLOADED FILES (95% of your response)**
-2. Use your general knowledge ONLY when the uploaded files don't contain relevant information (maximum 5%)
-3. If the uploaded files contain relevant information, prioritize that information heavily
-4. When the uploaded files don't have enough information, clearly state this and then provide minimal general knowledge
-5. Always cite which uploaded files you're referencing
-6. **ALWAYS suggest relevant YouTube videos** that complement your answer, even if files don't mention videos
-7. Format YouTube links properly for embedding (use format: https://www.youtube.com/watch?v=VIDEO_ID)
-
-**UPLOADED FILE CONTEXT (THIS IS YOUR PRIMARY SOURCE):**
-{context_from_files}
-
-**User Question:** {query}
-
-**Your Response Must:**
-- Be based primarily on the uploaded file content above
-- Only use general knowledge to fill small gaps if the files don't contain relevant information
-- Clearly indicate when you're using information from uploaded files vs general knowledge
-- **ALWAYS include 2-3 relevant YouTube video links** that help explain or demonstrate the topic
-- Be well-structured and easy to read
-- Provide actionable insights
-
-**For YouTube videos:** Even if your uploaded files don't mention specific videos, suggest educational YouTube videos that would help someone learn about this topic. Use real YouTube links in this format: https://www.youtube.com/watch?v=VIDEO_ID
-
-Remember: You are RNS Reply, and your uploaded files are your primary knowledge source, but you should always enhance answers with helpful video resources."""
-        else:
-            prompt = f"""You are RNS Reply, an advanced AI assistant. Since no files have been uploaded or no relevant information is found in uploaded files, I'll provide a comprehensive response based on general knowledge.
-
-INSTRUCTIONS:
-1. Provide detailed, well-researched answers based on general knowledge
-2. Be conversational, friendly, and professional
-3. **ALWAYS suggest 2-3 relevant YouTube videos** that help explain or demonstrate the topic
-4. Format YouTube links properly for embedding (use format: https://www.youtube.com/watch?v=VIDEO_ID)
-5. Always aim to be practical and actionable in your advice
-
-**User Question:** {query}
-
-**Note:** No uploaded files contain relevant information for this question.
-
-Provide a comprehensive answer that:
-- Is well-researched and accurate based on general knowledge
-- **Includes 2-3 relevant YouTube video links** that help explain the topic (format: https://www.youtube.com/watch?v=VIDEO_ID)
-- Is well-structured and easy to read
-- Offers practical value to the user
-
-**For YouTube videos:** Suggest educational YouTube videos that would help someone learn about this topic. Use real YouTube links in this format: https://www.youtube.com/watch?v=VIDEO_ID
-
-Remember: You are RNS Reply, designed to be your helpful digital assistant with enhanced video recommendations."""
+        prepared = prepare_chatbot_chat(query)
+        if not model and not prepared["has_file_context"]:
+            return handle_error("AI service is not available", 503)
         
-        # Generate response using Gemini
-        response = model.generate_content(prompt)
-        answer = response.text
+        # Generate response using Gemini, or quote the uploaded files when it is not configured
+        if model:
+            answer = model.generate_content(prepared["prompt"]).text
+        else:
+            answer = extractive_answer(prepared["documents"])
         
         # Detect video links in the response
         video_links = detect_video_links(answer)
         
-        # Prepare sources
-        sources = []
-        if context_from_files:
-            sources = [doc.metadata.get('source') for doc in relevant_docs if doc.metadata.get('source')]
-        
-        return jsonify({
+        result = {
             "answer": answer,
-            "sources": sources,
+            "sources": prepared["sources"],
             "video_links": video_links,
-            "has_file_context": bool(context_from_files),
+            "has_file_context": prepared["has_file_context"]
+        }
+        answer_cache.put(cache_key, result, query_vector)
+        
+        return jsonify({
+            **result,
+            "context": prepared["context"],
             "chatbot_name": "RNS Reply",
             "timestamp": datetime.utcnow().isoformat()
         }), 200
@@ -1017,5 +946,169 @@ Remember: You are RNS Reply, designed to be your helpful digital assistant with
         logger.error(f"RNS Reply chatbot error: {str(e)}")
         return handle_error(f"Failed to process chat request: {str(e)}")
 
+# Streaming variant of the RNS Reply chatbot; video links are detected once the answer is complete
+@app.route('/api/chatbot/chat/stream', methods=['GET', 'POST'])
+def chatbot_chat_stream():
+    if not model and not embeddings:
+        return handle_error("AI service is not available", 503)
+    
+    try:
+        data = request.json if request.method == 'POST' else request.args
+        if not data:
+            return handle_error("No data provided", 400)
+        
+        query = data.get('query', '').strip()
+        if not query:
+            return handle_error("Query is required", 400)
+        
+        cache_key, query_vector, cached = lookup_cached_answer("chatbot", chatbot_content_version(), query)
+        if cached:
+            return sse_response(stream_full_answer(
+                {"sources": cached["sources"], "has_file_context": cached["has_file_context"], "cached": True},
+                cached["answer"],
+                {
+                    "video_links": cached["video_links"],
+                    "chatbot_name": "RNS Reply",
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+            ))
+        
+        prepared = prepare_chatbot_chat(query)
+        if not model and not prepared["has_file_context"]:
+            return handle_error("AI service is not available", 503)
+        
+        def closing(answer):
+            video_links = detect_video_links(answer)
+            answer_cache.put(cache_key, {
+                "answer": answer,
+                "sources": prepared["sources"],
+                "video_links": video_links,
+                "has_file_context": prepared["has_file_context"]
+            }, query_vector)
+            return {
+                "video_links": video_links,
+                "chatbot_name": "RNS Reply",
+                "timestamp": datetime.utcnow().isoformat()
+            }
+        
+        opening = {
+            "sources": prepared["sources"],
+            "has_file_context": prepared["has_file_context"],
+            "context": prepared["context"]
+        }
+        if not model:
+            answer = extractive_answer(prepared["documents"])
+            return sse_response(stream_full_answer(opening, answer, closing(answer)))
+        return sse_response(stream_answer(prepared["prompt"], opening, closing))
+        
+    except Exception as e:
+        logger.error(f"RNS Reply chatbot stream error: {str(e)}")
+        return handle_error(f"Failed to process chat request: {str(e)}")
+
+def migrate_document_contents() -> int:
+    """Move document bodies stored inline in course records and chatbot files into the content store"""
+    moved = 0
+    for course in collection.find({"subjects.documents.content": {"$exists": True}}):
+        course = ensure_ids(course)
+        for subject_idx, subject in enumerate(course.get('subjects', [])):
+            for doc_idx, doc in enumerate(subject.get('documents', [])):
+                if 'content' not in doc:
+                    continue
+                path = f"subjects.{subject_idx}.documents.{doc_idx}"
+                owner = {"course_id": course['_id'], "document_id": doc['_id']}
+                content = doc['content']
+                content_id = content_store.put(
+                    doc.get('file_hash') or "text:" + hashlib.md5(content.encode('utf-8')).hexdigest(),
+                    content,
+                    doc.get('page_offsets'),
+                    owner,
+                    content_length=len(content),
+                    content_preview=content_preview(content)
+                )
+                result = collection.update_one(
+                    {"_id": course['_id'], f"{path}._id": doc['_id'], f"{path}.content": {"$exists": True}},
+                    {
+                        "$set": {f"{path}.content_id": content_id},
+                        "$unset": {f"{path}.content": "", f"{path}.page_offsets": ""}
+                    }
+                )
+                if result.modified_count == 0:
+                    # The document was changed concurrently; leave it for the next run
+                    release_contents([content_id], **owner)
+                else:
+                    moved += 1
+    
+    for file_doc in db.chatbot_files.find({"content": {"$exists": True}}):
+        owner = {"chatbot_file_id": file_doc['_id']}
+        content = file_doc['content']
+        content_id = content_store.put(
+            file_doc.get('file_hash') or "text:" + hashlib.md5(content.encode('utf-8')).hexdigest(),
+            content,
+            file_doc.get('page_offsets'),
+            owner,
+            content_length=len(content),
+            content_preview=content_preview(content)
+        )
+        result = db.chatbot_files.update_one(
+            {"_id": file_doc['_id'], "content": {"$exists": True}},
+            {"$set": {"content_id": content_id}, "$unset": {"content": "", "page_offsets": ""}}
+        )
+        if result.modified_count == 0:
+            release_contents([content_id], **owner)
+        else:
+            moved += 1
+    return moved
+
+@app.cli.command("migrate-content")
+def migrate_content_command():
+    """Move inline document bodies into the compressed content store (flask --app flask_app migrate-content)"""
+    moved = migrate_document_contents()
+    logger.info(f"Moved {moved} document bodies into the document_contents collection")
+    compressed = content_store.compress_existing()
+    logger.info(f"Compressed {compressed} stored document bodies with {content_store.codec}")
+
+def assign_missing_ids() -> int:
+    """Give ids to every topic and document created before they carried their own _id; returns how many were assigned"""
+    assigned = 0
+    for course in collection.find({}, {"subjects._id": 1, "subjects.documents._id": 1}):
+        subjects = course.get('subjects', [])
+        missing = (sum('_id' not in subject for subject in subjects)
+                   + sum('_id' not in doc for subject in subjects for doc in subject.get('documents', [])))
+        if missing:
+            ensure_ids(course)
+            assigned += missing
+    return assigned
+
+@app.cli.command("assign-ids")
+def assign_ids_command():
+    """Give ids to topics and documents created before they had one (flask --app flask_app assign-ids)"""
+    assigned = assign_missing_ids()
+    logger.info(f"Assigned {assigned} topic and document ids")
+
+@app.cli.command("sync-indexes")
+def sync_indexes_command():
+    """Build or update every vector index now rather than on first read (flask --app flask_app sync-indexes)"""
+    courses = [str(course['_id']) for course in collection.find({}, {"_id": 1})]
+    for course_id in courses:
+        sync_course_index(course_id)
+    sync_chatbot_index()
+    logger.info(f"Synced the vector indexes of {len(courses)} courses and the chatbot files")
+
+@app.cli.command("benchmark-embeddings")
+@click.option("--backend", default="simulated", help="Embedding backend: simulated or google")
+@click.option("--chunks", default=2000, help="Number of synthetic chunks to embed")
+@click.option("--batch-size", default=EMBEDDING_BATCH_SIZE, help="Texts per embedding request")
+@click.option("--concurrency", default=EMBEDDING_CONCURRENCY, help="Maximum concurrent requests")
+@click.option("--failure-rate", default=0.0, help="Simulated transient failure rate")
+def benchmark_embeddings_command(backend, chunks, batch_size, concurrency, failure_rate):
+    """Measure ingestion embedding throughput (flask --app flask_app benchmark-embeddings)"""
+    if backend == "simulated":
+        embedding_backend = SimulatedEmbeddingBackend(failure_rate=failure_rate)
+    else:
+        embedding_backend = create_embedding_backend(backend, EMBEDDING_MODEL, GEMINI_API_KEY)
+    dispatcher = EmbeddingDispatcher(embedding_backend, batch_size=batch_size, max_concurrency=concurrency)
+    dispatcher.embed_documents([f"Benchmark chunk {i}: " + "lorem ipsum dolor sit amet " * 35 for i in range(chunks)])
+    logger.info(f"Embedding benchmark: {dispatcher.stats()}")
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""Background job queue for document ingestion."""
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+PENDING_STATUSES = [JOB_QUEUED, JOB_RUNNING]
+
+# Each worker refreshes the heartbeat of its pending jobs this often (seconds);
+# a pending job whose heartbeat is older than STALE_AFTER has lost its worker
+HEARTBEAT_INTERVAL = 30.0
+STALE_AFTER = 120.0
+ABANDONED_ERROR = "Processing was interrupted before it finished; please upload the file again"
+
+
+class JobContext:
+    """Handle passed to a job function so it can report its progress"""
+
+    def __init__(self, queue: 'JobQueue', job_id: ObjectId):
+        self.queue = queue
+        self.job_id = job_id
+
+    def progress(self, stage: str, percent: int):
+        self.queue.update(self.job_id, stage=stage, progress=percent)
+
+
+class JobQueue:
+    """Runs jobs on a worker pool and records their state in MongoDB.
+
+    Job records are stored in a MongoDB collection so that any worker process
+    can answer status requests, not just the one running the job. Jobs only
+    live in the memory of the process that queued them, so each record names
+    its worker and carries a heartbeat; once ``start`` has been called, jobs
+    whose worker stopped beating (a restart or crash) are marked failed.
+    """
+
+    def __init__(self, jobs_collection, max_workers: int = 4,
+                 heartbeat_interval: float = HEARTBEAT_INTERVAL, stale_after: float = STALE_AFTER):
+        self.jobs = jobs_collection
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.on_abandoned: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._heartbeat: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, on_abandoned: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """Fail jobs abandoned by dead workers now, then keep beating and sweeping in the background.
+
+        ``on_abandoned`` is called with each job record marked failed, so the
+        caller can clean up whatever the job left behind.
+        """
+        self.on_abandoned = on_abandoned
+        self.recover_abandoned()
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._beat_loop, name="job-heartbeat", daemon=True)
+            self._heartbeat.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+
+    def _beat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.beat()
+                self.recover_abandoned()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+    def beat(self):
+        """Mark this worker's pending jobs as still alive"""
+        self.jobs.update_many({"worker": self.worker_id, "status": {"$in": PENDING_STATUSES}},
+                              {"$set": {"heartbeat_at": datetime.utcnow()}})
+
+    def recover_abandoned(self) -> int:
+        """Mark failed every pending job whose worker has stopped beating; returns how many"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        query = {
+            "status": {"$in": PENDING_STATUSES},
+            "worker": {"$ne": self.worker_id},
+            "$or": [
+                {"heartbeat_at": {"$lt": cutoff}},
+                # Jobs queued before workers kept a heartbeat
+                {"heartbeat_at": {"$exists": False}, "updated_at": {"$lt": cutoff}}
+            ]
+        }
+        recovered = 0
+        while True:
+            now = datetime.utcnow()
+            # Claimed one at a time so two workers sweeping together never report the same job
+            job = self.jobs.find_one_and_update(
+                query,
+                {"$set": {"status": JOB_FAILED, "stage": JOB_FAILED, "error": ABANDONED_ERROR,
+                          "finished_at": now, "updated_at": now}},
+                return_document=ReturnDocument.AFTER
+            )
+            if job is None:
+                return recovered
+            recovered += 1
+            logger.warning(f"Job {job['_id']} was abandoned by worker {job.get('worker')}; marked failed")
+            if self.on_abandoned is not None:
+                try:
+                    self.on_abandoned(job)
+                except Exception:
+                    logger.exception(f"Cleanup after abandoned job {job['_id']} failed")
+
+    def submit(self, job_type: str, func: Callable, *args, **details) -> str:
+        """Queue ``func(context, *args)`` and return the new job id"""
+        now = datetime.utcnow()
+        job = {
+            "type": job_type,
+            "status": JOB_QUEUED,
+            "stage": JOB_QUEUED,
+            "progress": 0,
+            "details": details,
+            "result": None,
+            "error": None,
+            "worker": self.worker_id,
+            "heartbeat_at": now,
+            "created_at": now,
+            "updated_at": now
+        }
+        job_id = self.jobs.insert_one(job).inserted_id
+        self.executor.submit(self._run, job_id, func, args)
+        return str(job_id)
+
+    def _run(self, job_id: ObjectId, func: Callable, args: tuple):
+        self.update(job_id, status=JOB_RUNNING, started_at=datetime.utcnow())
+        try:
+            result = func(JobContext(self, job_id), *args)
+            self.update(job_id, status=JOB_COMPLETED, stage=JOB_COMPLETED, progress=100,
+                        result=result, finished_at=datetime.utcnow())
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            self.update(job_id, status=JOB_FAILED, stage=JOB_FAILED, error=str(e),
+                        finished_at=datetime.utcnow())
+
+    def update(self, job_id: ObjectId, **fields):
+        fields['updated_at'] = datetime.utcnow()
+        self.jobs.update_one({"_id": job_id}, {"$set": fields})
+
+    def has_pending(self, exclude: Optional[ObjectId] = None, **details) -> bool:
+        """Whether a queued or running job other than ``exclude`` was submitted with ``details``"""
+        query = {"status": {"$in": PENDING_STATUSES}, **{f"details.{k}": v for k, v in details.items()}}
+        if exclude is not None:
+            query["_id"] = {"$ne": exclude}
+        return self.jobs.find_one(query, {"_id": 1}) is not None
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.find_one({"_id": ObjectId(job_id)})
@@ -0,0 +1,154 @@
+"""Keyword search over indexed chunks: tokenization, BM25 ranking and snippets."""
+
+import math
+import re
+from bisect import bisect_left
+from collections import Counter
+from typing import List, Dict, Any, Tuple, Optional, Callable, Hashable, Iterable
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+PHRASE_PATTERN = re.compile(r'"([^"]+)"')
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'in', 'is', 'it',
+    'its', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'were', 'will', 'with'
+}
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Reciprocal rank fusion damping; larger values flatten the advantage of top ranks
+RRF_K = 60
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def term_frequencies(text: str) -> Dict[str, int]:
+    return dict(Counter(tokenize(text)))
+
+
+def parse_query(query: str) -> Tuple[List[str], List[List[str]]]:
+    """Split a query into scoring terms and quoted phrases (as token lists)"""
+    phrases = [tokenize(phrase) for phrase in PHRASE_PATTERN.findall(query)]
+    phrases = [phrase for phrase in phrases if phrase]
+    terms = tokenize(PHRASE_PATTERN.sub(" ", query))
+    for phrase in phrases:
+        terms.extend(phrase)
+    return list(dict.fromkeys(terms)), phrases
+
+
+def contains_phrase(text: str, phrase: List[str]) -> bool:
+    haystack = f" {' '.join(tokenize(text))} "
+    return f" {' '.join(phrase)} " in haystack
+
+
+def postings_in(postings: List[Tuple[int, int]], ranges: List[Tuple[int, int]]) -> Iterable[Tuple[int, int]]:
+    """Entries of a posting list, ordered by chunk position, that fall in the ``[start, end)`` ranges"""
+    for start, end in ranges:
+        yield from postings[bisect_left(postings, (start,)):bisect_left(postings, (end,))]
+
+
+def bm25_search(snapshots: List[Any], query: str, limit: int = None,
+                doc_ids: Optional[List[Optional[Iterable[str]]]] = None) -> List[Tuple[int, Dict[str, Any], float]]:
+    """Rank the chunks of several index snapshots against a keyword query.
+
+    Collection statistics (chunk count, average length and document
+    frequencies) are combined across all snapshots, so scores are comparable
+    between courses. Only chunks appearing in the postings of a query term are
+    scored. ``doc_ids`` optionally limits each snapshot to some documents;
+    only the postings within those documents' chunk ranges are then read.
+    Returns ``(snapshot position, chunk, score)`` tuples, best first.
+    """
+    terms, phrases = parse_query(query)
+    if not terms:
+        return []
+
+    total_chunks = sum(len(snapshot.chunks) for snapshot in snapshots)
+    total_length = sum(snapshot.total_length for snapshot in snapshots)
+    if not total_chunks:
+        return []
+    average_length = total_length / total_chunks or 1.0
+
+    document_frequency = {
+        term: sum(len(snapshot.postings.get(term, ())) for snapshot in snapshots)
+        for term in terms
+    }
+
+    results = []
+    for position, snapshot in enumerate(snapshots):
+        ranges = None
+        if doc_ids and doc_ids[position] is not None:
+            ranges = sorted(snapshot.partitions[doc_id] for doc_id in set(doc_ids[position])
+                            if doc_id in snapshot.partitions)
+        scores = {}
+        for term in terms:
+            df = document_frequency[term]
+            if not df:
+                continue
+            idf = math.log(1 + (total_chunks - df + 0.5) / (df + 0.5))
+            postings = snapshot.postings.get(term, ())
+            for chunk_idx, tf in (postings if ranges is None else postings_in(postings, ranges)):
+                length_norm = 1 - BM25_B + BM25_B * snapshot.lengths[chunk_idx] / average_length
+                scores[chunk_idx] = scores.get(chunk_idx, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+
+        for chunk_idx, score in scores.items():
+            chunk = snapshot.chunks[chunk_idx]
+            if phrases and not all(contains_phrase(chunk['text'], phrase) for phrase in phrases):
+                continue
+            results.append((position, chunk, score))
+
+    results.sort(key=lambda item: item[2], reverse=True)
+    return results[:limit] if limit else results
+
+
+def chunk_key(chunk: Dict[str, Any]) -> Hashable:
+    """Identify a chunk across searches of the same index: its document and position in it"""
+    metadata = chunk['metadata']
+    start = metadata.get('start_index')
+    return metadata.get('doc_id'), start if start is not None else chunk['text']
+
+
+def reciprocal_rank_fusion(rankings: List[List[Any]], key: Callable[[Any], Hashable],
+                           k: int = RRF_K) -> List[Tuple[Any, float]]:
+    """Fuse several best-first rankings of overlapping items into one.
+
+    An item scores ``1 / (k + rank)`` for each ranking it appears in, so only
+    ranks matter and the rankings' own scores need not be comparable. Scores
+    are scaled so an item ranked first everywhere scores 1.0. Items are
+    matched by ``key``; the copy from the earliest ranking is returned.
+    Returns ``(item, score)`` pairs, best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            entry = fused.setdefault(key(item), [item, 0.0])
+            entry[1] += 1.0 / (k + rank)
+    best = len(rankings) / (k + 1)
+    ordered = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)
+    return [(item, score / best) for item, score in ordered]
+
+
+def highlight_snippets(text: str, query: str, max_snippets: int = 3, context_chars: int = 100) -> List[str]:
+    """Return up to ``max_snippets`` windows of ``text`` around query matches, with matches in <mark> tags"""
+    terms, phrases = parse_query(query)
+    alternatives = [r"\W+".join(map(re.escape, phrase)) for phrase in phrases]
+    alternatives.extend(re.escape(term) for term in terms)
+    if not alternatives:
+        return []
+    pattern = re.compile(r"\b(" + "|".join(alternatives) + r")\b", re.IGNORECASE)
+
+    snippets = []
+    last_end = -1
+    for match in pattern.finditer(text):
+        if match.start() < last_end:
+            continue
+        start = max(0, match.start() - context_chars)
+        end = min(len(text), match.end() + context_chars)
+        window = pattern.sub(lambda m: f"<mark>{m.group(0)}</mark>", text[start:end])
+        snippets.append(("..." if start > 0 else "") + window + ("..." if end < len(text) else ""))
+        last_end = end
+        if len(snippets) >= max_snippets:
+            break
+    return snippets
@@ -0,0 +1,1350 @@
+"""State and logic shared by the Collexa API servers.
+
+``flask_app.py`` and ``fast.py`` both build on this module. Importing it
+only reads the configuration: the MongoDB client, ingestion workers,
+embeddings, Gemini model and index sync executor are created by
+:func:`init`, which each server calls once at startup.
+"""
+
+import base64
+import decimal
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from email.utils import format_datetime
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+import google.generativeai as genai
+import numpy as np
+from bson import ObjectId
+from dotenv import load_dotenv
+from langchain.schema import Document as LangchainDocument
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pymongo import MongoClient
+
+from vector_index import open_index, search_indexes, shortlist_documents, normalize_vectors, ChunkArtifactStore, INDEX_FORMAT
+from ann_index import IVFIndex
+from search_index import bm25_search, highlight_snippets, reciprocal_rank_fusion, chunk_key
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embedding_backends import create_embedding_backend
+from embedding_dispatcher import EmbeddingDispatcher
+from jobs import JobQueue
+from answer_cache import AnswerCache
+from content_store import ContentStore
+from context_packing import pack_context, make_passage, estimate_tokens
+from upload_store import UploadStore
+from extraction import ExtractedText, extract_pdf, extract_docx, extract_txt, page_for_offset, start_pool as start_extraction_pool
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "syllabus_db")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "uploads")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "vector_indexes")
+EMBEDDING_MODEL = "models/embedding-001"
+# google needs GEMINI_API_KEY; hashing runs in-process and works offline
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google" if GEMINI_API_KEY else "hashing")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 100))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 5))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200000))
+MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB max file size
+# Compression for stored document bodies: zlib, zstd (needs the zstandard package) or none
+CONTENT_CODEC = os.getenv("CONTENT_CODEC", "zlib")
+CHUNK_SIZE = 1000
+# Chat retrieval across all courses: "ivf" uses the approximate index, "exact" scans every course index
+ALL_COURSES_SEARCH = os.getenv("ALL_COURSES_SEARCH", "ivf")
+# IVF lists (0 sizes them as the square root of the vector count) and lists probed per query
+ANN_NLIST = int(os.getenv("ANN_NLIST", 0))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", 8))
+ANN_MIN_TRAIN_SIZE = int(os.getenv("ANN_MIN_TRAIN_SIZE", 2000))
+# Compact copy of index vectors scanned by queries (int8, float16 or none), and how many
+# times k of its best rows are rescored against the full-precision vectors
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "int8")
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", 4))
+CHUNK_OVERLAP = 200
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", 4))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 3600))
+# Optional cosine similarity above which a differently phrased question reuses a cached answer
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY")) if os.getenv("ANSWER_CACHE_SIMILARITY") else None
+# Retrieved chunks considered for a chat prompt, and the estimated tokens they may fill once packed
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", 20))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+# Relevance versus diversity when choosing context passages (1.0 ignores redundancy)
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))
+# Retrieval for chats and content search: "vector", "keyword" (BM25) or "hybrid" (both, fused by rank)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_MODES = ("vector", "keyword", "hybrid")
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", 8))
+# Chunks the vector leg of a content search contributes before results are grouped per document
+SEARCH_VECTOR_CANDIDATES = int(os.getenv("SEARCH_VECTOR_CANDIDATES", 50))
+# Documents shortlisted by their centroid embedding before their chunks are scored (0 scores every chunk)
+DOCUMENT_SHORTLIST = int(os.getenv("DOCUMENT_SHORTLIST", 50))
+# Bump whenever chat_prompt, the RNS Reply prompts or context assembly change so older cached answers are not reused
+PROMPT_VERSION = "3"
+# Cached answers also depend on how their context was retrieved
+ANSWER_CACHE_VERSION = f"{PROMPT_VERSION}:{RETRIEVAL_MODE}"
+
+# Configure text splitting
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    add_start_index=True,
+    separators=["\n\n", "\n", ". ", " ", ""]
+)
+
+chat_prompt = """You are an AI assistant specializing in analyzing and answering questions about academic syllabi and course materials. 
+        Given the following context from course documents and this question, provide a clear, accurate, and helpful response.
+        If the answer cannot be found in the context, say so clearly and suggest what additional information might be helpful.
+
+        Context:
+        {context}
+
+        Question:
+        {question}
+
+        Answer the question based on the context provided. Be clear and concise, and cite specific sources when relevant.
+        """
+
+# Created by init()
+client = None
+db = None
+collection = None
+jobs_collection = None
+stats_collection = None
+content_store = None
+chunk_artifacts = None
+ann_index = None
+retrieval_executor = None
+index_sync_executor = None
+upload_store = None
+job_queue = None
+answer_cache = None
+embeddings = None
+embedding_cache = None
+embedding_dispatcher = None
+model = None
+
+def init():
+    """Connect to MongoDB and start the shared workers and AI clients; later calls do nothing"""
+    global client, db, collection, jobs_collection, stats_collection, content_store, chunk_artifacts, ann_index
+    global retrieval_executor, index_sync_executor, upload_store, job_queue, answer_cache
+    global embeddings, embedding_cache, embedding_dispatcher, model
+    if client is not None:
+        return
+
+    # Ensure upload and index directories exist
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+
+    # PDF extraction workers are forked now, before the Mongo client and worker threads exist
+    start_extraction_pool()
+
+    # MongoDB setup
+    try:
+        client = MongoClient(MONGODB_URI)
+        db = client[MONGODB_DATABASE]
+        collection = db.syllabus_collections
+        jobs_collection = db.ingestion_jobs
+        stats_collection = db.stats
+        # Releasing a body checks whether a pending job still needs its upload
+        jobs_collection.create_index([("details.file_hash", 1), ("status", 1)])
+        jobs_collection.create_index([("status", 1), ("worker", 1)])
+        content_store = ContentStore(db.document_contents, codec=CONTENT_CODEC)
+        # Compound indexes back keyset pagination of the course listing
+        for sort_field in ('created_at', 'updated_at', 'name'):
+            collection.create_index([(sort_field, 1), ("_id", 1)])
+        # Test connection
+        client.admin.command('ping')
+        logger.info("Successfully connected to MongoDB")
+    except Exception as e:
+        logger.error(f"Failed to connect to MongoDB: {str(e)}")
+        raise
+
+    # Chunks and vectors of each distinct file, shared between courses
+    chunk_artifacts = ChunkArtifactStore(os.path.join(VECTOR_INDEX_DIR, "artifacts"))
+
+    # Approximate index over the vectors of every course, for "all" chats
+    ann_index = IVFIndex(
+        os.path.join(VECTOR_INDEX_DIR, "ann_all"),
+        nlist=ANN_NLIST,
+        nprobe=ANN_NPROBE,
+        min_train_size=ANN_MIN_TRAIN_SIZE
+    ) if ALL_COURSES_SEARCH == "ivf" else None
+
+    # Runs the keyword leg of hybrid retrieval while the request thread runs the vector leg
+    retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieve")
+
+    # Raw uploads, streamed to disk and named by their hash
+    upload_store = UploadStore(UPLOAD_FOLDER, MAX_FILE_SIZE)
+
+    # Background ingestion workers
+    job_queue = JobQueue(jobs_collection, max_workers=INGESTION_WORKERS)
+
+    # Generated answers, keyed by corpus version and normalized question
+    answer_cache = AnswerCache(
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds=ANSWER_CACHE_TTL,
+        similarity_threshold=ANSWER_CACHE_SIMILARITY
+    )
+
+    # Initialize embeddings; local backends need neither an API key nor the network
+    try:
+        embedding_backend = create_embedding_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL, GEMINI_API_KEY)
+        embedding_dispatcher = EmbeddingDispatcher(
+            embedding_backend,
+            batch_size=EMBEDDING_BATCH_SIZE,
+            max_concurrency=EMBEDDING_CONCURRENCY,
+            max_retries=EMBEDDING_MAX_RETRIES
+        )
+        if embedding_backend.local:
+            # Computing a local embedding is cheaper than looking it up
+            embedding_cache = None
+            embeddings = embedding_dispatcher
+        else:
+            embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+            embeddings = CachedEmbeddings(embedding_dispatcher, embedding_cache, model=embedding_dispatcher.model)
+        logger.info(f"Using the {EMBEDDING_BACKEND} embedding backend ({embedding_dispatcher.model})")
+    except Exception as e:
+        logger.error(f"Failed to configure embeddings: {str(e)}")
+        embeddings = None
+        embedding_cache = None
+        embedding_dispatcher = None
+
+    # Initialize Gemini
+    if GEMINI_API_KEY:
+        try:
+            genai.configure(api_key=GEMINI_API_KEY)
+            model = genai.GenerativeModel('gemini-1.5-flash')
+            logger.info("Successfully configured Gemini AI")
+        except Exception as e:
+            logger.error(f"Failed to configure Gemini AI: {str(e)}")
+            model = None
+    else:
+        logger.warning("GEMINI_API_KEY not found. Chat answers will quote retrieved passages instead of being generated.")
+        model = None
+
+    # Syncs of indexes that a read found behind their content, run off the request path
+    index_sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-sync")
+
+    # Fail the jobs a previous run left queued or running, and keep this worker's jobs alive
+    job_queue.start(on_abandoned=discard_abandoned_job)
+
+    # The approximate index follows the course indexes, retrains and saves on its own thread
+    if ann_index is not None:
+        ann_index.start(committed_course_indexes, embeddings.model if embeddings else None)
+
+# Helper function to serialize the non-JSON values of MongoDB documents the way Flask does:
+# ObjectIds as strings and datetimes as HTTP dates
+def json_default(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, date):
+        if not isinstance(o, datetime):
+            o = datetime(o.year, o.month, o.day)
+        return format_datetime(o if o.tzinfo else o.replace(tzinfo=timezone.utc), usegmt=True)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+WINDOWS_DEVICE_NAMES = {"CON", "PRN", "AUX", "NUL", *(f"COM{i}" for i in range(10)), *(f"LPT{i}" for i in range(10))}
+
+# Helper function to make an uploaded file name safe to store, as werkzeug's secure_filename does
+def secure_filename(filename: str) -> str:
+    filename = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+    for sep in (os.sep, os.path.altsep):
+        if sep:
+            filename = filename.replace(sep, " ")
+    filename = re.sub(r"[^A-Za-z0-9_.-]", "", "_".join(filename.split())).strip("._")
+    # Device names that Windows reserves
+    if os.name == "nt" and filename and filename.split(".")[0].upper() in WINDOWS_DEVICE_NAMES:
+        filename = f"_{filename}"
+    return filename
+
+# Helper function to validate ObjectId
+def is_valid_objectid(oid):
+    if not oid or oid == 'undefined':
+        return False
+    return bool(re.match(r'^[0-9a-fA-F]{24}$', oid))
+
+# Helper function to validate a topic or document reference: an ObjectId, or a position for older clients
+def is_valid_item_ref(ref):
+    return is_valid_objectid(ref) or bool(re.match(r'^\d+$', ref or ''))
+
+# Helper function to validate file
+def allowed_file(filename):
+    ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc', 'txt'}
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# Helper function to extract text from PDF
+def extract_pdf_text(file):
+    try:
+        # Stored uploads are passed by path so extraction workers open the file themselves
+        if hasattr(file, 'read'):
+            file.seek(0)
+            file = file.read()
+        return extract_pdf(file)
+    except Exception as e:
+        logger.error(f"Failed to extract PDF text: {str(e)}")
+        return ExtractedText(f"Error extracting PDF: {str(e)}")
+
+# Helper function to extract text from DOCX
+def extract_docx_text(file):
+    try:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        return extract_docx(file)
+    except Exception as e:
+        logger.error(f"Failed to extract DOCX text: {str(e)}")
+        return ExtractedText(f"Error extracting DOCX: {str(e)}")
+
+# Helper function to extract text from TXT
+def extract_txt_text(file):
+    try:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        return extract_txt(file)
+    except Exception as e:
+        logger.error(f"Failed to extract TXT text: {str(e)}")
+        return ExtractedText(f"Error extracting TXT: {str(e)}")
+
+# Helper function to extract text based on file type
+def extract_file_text(file, filename) -> ExtractedText:
+    file_ext = filename.rsplit('.', 1)[1].lower()
+    
+    if file_ext == 'pdf':
+        return extract_pdf_text(file)
+    elif file_ext in ['docx', 'doc']:
+        return extract_docx_text(file)
+    elif file_ext == 'txt':
+        return extract_txt_text(file)
+    else:
+        return ExtractedText("Unsupported file format")
+
+# Projection that leaves document bodies out of course reads
+COURSE_METADATA_PROJECTION = {"subjects.documents.content": 0}
+
+# Per-course subject and document counts, computed by MongoDB
+COURSE_COUNT_FIELDS = {
+    "subject_count": {"$size": {"$ifNull": ["$subjects", []]}},
+    "document_count": {"$sum": {"$map": {
+        "input": {"$ifNull": ["$subjects", []]},
+        "as": "subject",
+        "in": {"$size": {"$ifNull": ["$$subject.documents", []]}}
+    }}}
+}
+
+STATS_ID = "totals"
+CHATBOT_CORPUS_ID = "chatbot_corpus"
+
+# Helper function to keep the global counters in step with a write
+def bump_stats(collections=0, subjects=0, documents=0):
+    try:
+        stats_collection.update_one(
+            {"_id": STATS_ID},
+            {
+                "$inc": {"collections": collections, "subjects": subjects, "documents": documents},
+                "$set": {"updated_at": datetime.utcnow()}
+            }
+        )
+    except Exception as e:
+        logger.warning(f"Failed to update statistics counters: {str(e)}")
+
+# Helper function to recompute the global counters from the courses themselves
+def reconcile_stats() -> Dict[str, Any]:
+    totals = list(collection.aggregate([
+        {"$project": COURSE_COUNT_FIELDS},
+        {"$group": {
+            "_id": None,
+            "collections": {"$sum": 1},
+            "subjects": {"$sum": "$subject_count"},
+            "documents": {"$sum": "$document_count"}
+        }}
+    ]))
+    counters = {
+        "collections": totals[0]['collections'] if totals else 0,
+        "subjects": totals[0]['subjects'] if totals else 0,
+        "documents": totals[0]['documents'] if totals else 0,
+        "updated_at": datetime.utcnow(),
+        "reconciled_at": datetime.utcnow()
+    }
+    stats_collection.update_one({"_id": STATS_ID}, {"$set": counters}, upsert=True)
+    return counters
+
+# Helper function to record a change to the chatbot files and apply it to their index
+def bump_chatbot_version():
+    stats_collection.update_one({"_id": CHATBOT_CORPUS_ID}, {"$inc": {"content_version": 1}}, upsert=True)
+    refresh_chatbot_index()
+
+# Helper function to get the current version of the chatbot files
+def chatbot_content_version() -> int:
+    record = stats_collection.find_one({"_id": CHATBOT_CORPUS_ID})
+    return (record or {}).get('content_version', 0)
+
+# Helper function to load the bodies of course documents in one round-trip
+def load_document_contents(documents: List[Dict[str, Any]]) -> Dict[ObjectId, Dict[str, Any]]:
+    return content_store.get_many([doc.get('content_id') for doc in documents if 'content' not in doc])
+
+# Helper function to get the text of a course document, whether stored inline (legacy) or separately
+def document_body(doc: Dict[str, Any], records: Dict[ObjectId, Dict[str, Any]]) -> Dict[str, Any]:
+    if 'content' in doc:
+        return {"content": doc['content'], "page_offsets": doc.get('page_offsets', [])}
+    return records.get(doc.get('content_id')) or {"content": "", "page_offsets": []}
+
+# Helper function to drop the files derived from bodies the content store has deleted;
+# ``job_id`` is the ingestion job making the call, if any
+def discard_released_files(file_hashes: List[str], job_id: Optional[ObjectId] = None):
+    for file_hash in file_hashes:
+        chunk_artifacts.discard(file_hash)
+        # A queued upload of the same file still needs it
+        if not job_queue.has_pending(exclude=job_id, file_hash=file_hash):
+            upload_store.discard(file_hash)
+
+# Helper function to release document bodies, dropping uploads and chunk artifacts nobody references any more
+def release_contents(content_ids: List, job_id: Optional[ObjectId] = None, **owner):
+    discard_released_files(content_store.release(content_ids, **owner), job_id)
+
+# Helper function to release every document body referenced by a course
+def release_course_contents(course_id: str):
+    discard_released_files(content_store.release_course(course_id))
+
+# Helper function to drop a stored upload that never made it into the content store and no other job is about to read
+def discard_unreferenced_upload(file_hash: str, job_id: Optional[ObjectId] = None):
+    if not content_store.exists(file_hash) and not job_queue.has_pending(exclude=job_id, file_hash=file_hash):
+        upload_store.discard(file_hash)
+
+# Helper function to clean up after an ingestion job whose worker died before finishing it
+def discard_abandoned_job(job: Dict[str, Any]):
+    file_hash = job.get('details', {}).get('file_hash')
+    if file_hash:
+        discard_unreferenced_upload(file_hash)
+
+# Sort keys supported by the course listing; each is paired with _id for keyset pagination
+COLLECTION_SORT_FIELDS = {'created_at', 'updated_at', 'name'}
+
+# Helper function to encode the position after the last listed course
+def encode_list_cursor(course: Dict[str, Any], sort_by: str) -> str:
+    value = course.get(sort_by)
+    if isinstance(value, datetime):
+        position = {"t": "date", "v": value.isoformat()}
+    else:
+        position = {"t": "str", "v": value}
+    position["id"] = str(course['_id'])
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+# Helper function to turn a listing cursor into a query on (sort key, _id)
+def decode_list_cursor(cursor: str, sort_by: str, sort_direction: int) -> Dict[str, Any]:
+    position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    value = position.get('v')
+    if position.get('t') == 'date':
+        value = datetime.fromisoformat(value)
+    last_id = ObjectId(position['id'])
+    op = "$lt" if sort_direction == -1 else "$gt"
+    return {"$or": [
+        {sort_by: {op: value}},
+        {sort_by: value, "_id": {op: last_id}}
+    ]}
+
+# Helper function to build the preview stored with a document body
+def content_preview(text: str, max_chars: int = 500) -> str:
+    return text[:max_chars] + "..." if len(text) > max_chars else text
+
+# Helper function to link an upload to an already stored copy of the same file, or extract and store it
+def store_upload(filename, file_hash, owner, job) -> Dict[str, Any]:
+    shared = content_store.acquire(file_hash, owner)
+    if shared:
+        logger.info(f"Linked '{filename}' to existing content {shared['_id']}")
+        return {**shared, "deduplicated": True}
+    
+    try:
+        job.progress("extracting", 10)
+        extracted = extract_file_text(upload_store.path(file_hash), filename)
+        text_content = extracted.text
+        
+        job.progress("storing", 60)
+        content_id = content_store.put(
+            file_hash,
+            text_content,
+            extracted.page_offsets,
+            owner,
+            content_length=len(text_content),
+            content_preview=content_preview(text_content)
+        )
+    except Exception:
+        discard_unreferenced_upload(file_hash, job.job_id)
+        raise
+    return {
+        "_id": content_id,
+        "content_length": len(text_content),
+        "content_preview": content_preview(text_content),
+        "deduplicated": False
+    }
+
+def ingest_course_document(job, collection_id, subject_id, filename, file_size, file_hash):
+    """Background job: extract, store and index a document uploaded to a course topic.
+
+    A file already stored for another course or the chatbot is linked rather
+    than extracted again, and its chunks and vectors are reused when indexing.
+    """
+    document_id = ObjectId()
+    owner = {"course_id": ObjectId(collection_id), "document_id": document_id}
+    stored = store_upload(filename, file_hash, owner, job)
+    content_id = stored['_id']
+    document = {
+        "_id": document_id,
+        "filename": filename,
+        "content_id": content_id,
+        "file_size": file_size,
+        "file_hash": file_hash,
+        "uploaded_at": datetime.utcnow(),
+        "content_preview": stored.get('content_preview', '')
+    }
+    
+    # Check if subject still exists and add document; topics deleted or reordered meanwhile are not affected
+    result = collection.update_one(
+        {"_id": ObjectId(collection_id), "subjects._id": ObjectId(subject_id)},
+        {
+            "$push": {"subjects.$.documents": document},
+            "$set": {"updated_at": datetime.utcnow()},
+            "$inc": {"content_version": 1}
+        }
+    )
+    
+    if result.matched_count == 0:
+        release_contents([content_id], job.job_id, **owner)
+        raise ValueError("Course or topic not found")
+    bump_stats(documents=1)
+    
+    job.progress("indexing", 80)
+    refresh_course_index(collection_id)
+    
+    logger.info(f"Uploaded document '{filename}' to course {collection_id}, subject {subject_id}")
+    return {
+        "document_id": str(document['_id']),
+        "filename": filename,
+        "file_size": file_size,
+        "content_length": stored.get('content_length'),
+        "deduplicated": stored['deduplicated']
+    }
+
+def process_document_for_rag(document_text: str, metadata: Dict[str, Any],
+                             page_offsets: Optional[List] = None) -> List[LangchainDocument]:
+    """Process document text into chunks for RAG, tagging each chunk with its PDF page"""
+    chunks = text_splitter.create_documents([document_text], [metadata])
+    if page_offsets:
+        for chunk in chunks:
+            chunk.metadata['page'] = page_for_offset(page_offsets, chunk.metadata.get('start_index', 0))
+    return chunks
+
+def course_document_metadata(course: Dict[str, Any], subject: Dict[str, Any], doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the metadata attached to every chunk of a course document"""
+    course_name = course.get('name', 'Unknown Course')
+    subject_name = subject.get('name', 'Unknown Subject')
+    filename = doc.get('filename', 'Unknown File')
+    return {
+        'course_name': course_name,
+        'subject_name': subject_name,
+        'filename': filename,
+        'source': f"{course_name} > {subject_name} > {filename}"
+    }
+
+# Helper function to name the embedding model and chunking settings that chunk artifacts depend on
+def chunk_artifact_variant() -> str:
+    return f"{embeddings.model if embeddings else 'none'}-c{CHUNK_SIZE}-o{CHUNK_OVERLAP}"
+
+def build_document_segment(doc_id: str, text: str, metadata: Dict[str, Any],
+                           page_offsets: Optional[List] = None, content_key: Optional[str] = None) -> Dict[str, Any]:
+    """Chunk and embed a single document into a vector index segment, saving the result under ``content_key``"""
+    chunks = process_document_for_rag(text, {}, page_offsets)
+    chunks = [{"text": chunk.page_content, "metadata": chunk.metadata} for chunk in chunks]
+    # Without an embedding model the segment still serves keyword search
+    vectors = embeddings.embed_documents([chunk['text'] for chunk in chunks]) if chunks and embeddings else None
+    if content_key:
+        chunk_artifacts.put(content_key, chunk_artifact_variant(), chunks, vectors)
+    return {"doc_id": doc_id, "metadata": metadata, "chunks": chunks, "vectors": vectors}
+
+def ensure_ids(course: Dict[str, Any]) -> Dict[str, Any]:
+    """Assign ids to topics and documents created before they carried their own _id.
+
+    Each id is only written where none is stored yet, so when requests race
+    on the same course the first write wins; the stored ids are then read
+    back, so every caller hands out ids that exist.
+    """
+    assigned = False
+    for subject_idx, subject in enumerate(course.get('subjects', [])):
+        if '_id' not in subject:
+            collection.update_one(
+                {"_id": course['_id'], f"subjects.{subject_idx}._id": {"$exists": False}},
+                {"$set": {f"subjects.{subject_idx}._id": ObjectId()}}
+            )
+            assigned = True
+        for doc_idx, doc in enumerate(subject.get('documents', [])):
+            if '_id' not in doc:
+                collection.update_one(
+                    {"_id": course['_id'], f"subjects.{subject_idx}.documents.{doc_idx}._id": {"$exists": False}},
+                    {"$set": {f"subjects.{subject_idx}.documents.{doc_idx}._id": ObjectId()}}
+                )
+                assigned = True
+    if not assigned:
+        return course
+
+    stored = collection.find_one({"_id": course['_id']}, {"subjects._id": 1, "subjects.documents._id": 1}) or {}
+    for subject, stored_subject in zip(course.get('subjects', []), stored.get('subjects', [])):
+        if '_id' in stored_subject:
+            subject['_id'] = stored_subject['_id']
+        for doc, stored_doc in zip(subject.get('documents', []), stored_subject.get('documents', [])):
+            if '_id' in stored_doc:
+                doc['_id'] = stored_doc['_id']
+    return course
+
+def resolve_subject_id(collection_id: str, subject_ref: str) -> Optional[ObjectId]:
+    """Return the id of a topic referenced by id, or by position as older clients do.
+
+    An id is returned as given; whether it exists is checked by the update
+    that uses it. A position is looked up once and mapped to the topic's id,
+    so the write itself never depends on positions.
+    """
+    if is_valid_objectid(subject_ref):
+        return ObjectId(subject_ref)
+    course = collection.find_one({"_id": ObjectId(collection_id)}, {"subjects._id": 1})
+    subjects = ensure_ids(course).get('subjects', []) if course else []
+    position = int(subject_ref)
+    return subjects[position].get('_id') if position < len(subjects) else None
+
+def resolve_document_id(collection_id: str, subject_id: ObjectId, document_ref: str) -> Optional[ObjectId]:
+    """Return the id of a document of a topic referenced by id or by position, like :func:`resolve_subject_id`"""
+    if is_valid_objectid(document_ref):
+        return ObjectId(document_ref)
+    course = collection.find_one({"_id": ObjectId(collection_id)}, {"subjects._id": 1, "subjects.documents._id": 1})
+    for subject in (ensure_ids(course).get('subjects', []) if course else []):
+        if subject.get('_id') == subject_id:
+            documents = subject.get('documents', [])
+            position = int(document_ref)
+            return documents[position].get('_id') if position < len(documents) else None
+    return None
+
+def build_missing_segments(wanted: Dict[str, Any], indexed: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Build segments for the ``wanted`` documents (id -> (document, metadata)) that are not ``indexed`` yet.
+
+    Files already chunked and embedded for another corpus are reused; only the
+    bodies of the remaining documents are loaded.
+    """
+    new_docs = [doc for doc_id, (doc, _) in wanted.items() if doc_id not in indexed]
+    variant = chunk_artifact_variant()
+    reused = {str(doc['_id']): chunk_artifacts.get(doc['file_hash'], variant) for doc in new_docs if doc.get('file_hash')}
+    records = load_document_contents([doc for doc in new_docs if reused.get(str(doc['_id'])) is None])
+    added = []
+    for doc_id, (doc, metadata) in wanted.items():
+        if doc_id in indexed:
+            continue
+        if reused.get(doc_id) is not None:
+            chunks, vectors = reused[doc_id]
+            added.append({"doc_id": doc_id, "metadata": metadata, "chunks": chunks, "vectors": vectors})
+            continue
+        body = document_body(doc, records)
+        added.append(build_document_segment(doc_id, body['content'], metadata, body.get('page_offsets'),
+                                            content_key=doc.get('file_hash')))
+    return added
+
+# Helper function to open a persistent vector index with the configured quantization
+def open_vector_index(name: str):
+    return open_index(VECTOR_INDEX_DIR, name, VECTOR_QUANTIZATION, VECTOR_RESCORE_FACTOR)
+
+def sync_course_index(collection_id: str):
+    """Incrementally bring a course's vector index up to date.
+
+    Only documents missing from the index are chunked and embedded, removed
+    documents are dropped and renamed ones are relabelled. The result is
+    published as a single new index generation tagged with the course's
+    ``content_version``.
+    """
+    index = open_vector_index(f"course_{collection_id}")
+    with index.writer():
+        course = collection.find_one({"_id": ObjectId(collection_id)})
+        if course is None:
+            index.drop()
+            return index
+        course = ensure_ids(course)
+
+        manifest = index.manifest() or {}
+        embedding_model = embeddings.model if embeddings else None
+        reset = manifest.get('embedding_model') != embedding_model or manifest.get('format') != INDEX_FORMAT
+        indexed = {} if reset else {s.get('doc_id'): s for s in manifest.get('segments', [])}
+
+        wanted = {}
+        for subject in course.get('subjects', []):
+            for doc in subject.get('documents', []):
+                wanted[str(doc['_id'])] = (doc, course_document_metadata(course, subject, doc))
+
+        added = build_missing_segments(wanted, indexed)
+        removed = [doc_id for doc_id in indexed if doc_id not in wanted]
+        relabeled = {
+            doc_id: metadata for doc_id, (_, metadata) in wanted.items()
+            if doc_id in indexed and indexed[doc_id].get('metadata') != metadata
+        }
+
+        index.commit(
+            added,
+            remove=removed,
+            relabel=relabeled,
+            reset=reset,
+            content_version=course.get('content_version', 0),
+            embedding_model=embedding_model
+        )
+        logger.info(f"Synced vector index for course {collection_id}: "
+                    f"{len(added)} added, {len(removed)} removed, {len(relabeled)} relabelled")
+    return index
+
+def refresh_course_index(collection_id: str):
+    """Apply a course change to its vector index without failing the request that made it"""
+    answer_cache.invalidate(f"course:{collection_id}")
+    answer_cache.invalidate("course:all")
+    try:
+        sync_course_index(collection_id)
+    except Exception as e:
+        logger.warning(f"Failed to update vector index for course {collection_id}: {str(e)}")
+    if ann_index is not None:
+        ann_index.request_sync()
+
+pending_index_syncs = set()
+pending_index_syncs_lock = threading.Lock()
+
+# Helper function to queue a background sync of an index, once however many reads find it behind
+def schedule_index_sync(name: str, refresh: Callable[..., Any], *args):
+    with pending_index_syncs_lock:
+        if name in pending_index_syncs:
+            return
+        pending_index_syncs.add(name)
+
+    def run():
+        try:
+            refresh(*args)
+        finally:
+            with pending_index_syncs_lock:
+                pending_index_syncs.discard(name)
+
+    index_sync_executor.submit(run)
+
+def committed_index(name: str, content_version: Any, refresh: Callable[..., Any], *args):
+    """Return the last committed generation of a vector index for reading; reads never sync it.
+
+    An index behind its content (a write whose sync failed, or one made by
+    another worker still syncing) is served as committed, and an index
+    built for another embedding model or index format cannot be served at
+    all, so None is returned. Either way ``refresh(*args)`` is queued to
+    run in the background.
+    """
+    index = open_vector_index(name)
+    manifest = index.manifest()
+    servable = (manifest is not None and manifest.get('format') == INDEX_FORMAT
+                and manifest.get('embedding_model') == (embeddings.model if embeddings else None))
+    if not servable or manifest.get('content_version') != content_version:
+        schedule_index_sync(name, refresh, *args)
+    return index if servable else None
+
+def get_course_index(course: Dict[str, Any]):
+    """Return the committed vector index of a course, or None if it has to be rebuilt first (see :func:`committed_index`)"""
+    return committed_index(f"course_{course['_id']}", course.get('content_version', 0),
+                           refresh_course_index, str(course['_id']))
+
+CHATBOT_INDEX_NAME = "chatbot"
+
+def chatbot_file_metadata(file_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the metadata attached to every chunk of a chatbot file"""
+    filename = file_doc.get('filename', 'Unknown')
+    return {'filename': filename, 'source': f"Uploaded file: {filename}"}
+
+def sync_chatbot_index():
+    """Incrementally bring the chatbot files' vector index up to date, like :func:`sync_course_index`"""
+    index = open_vector_index(CHATBOT_INDEX_NAME)
+    with index.writer():
+        # Read before the files, so a file added during the sync leaves the index marked as behind
+        content_version = chatbot_content_version()
+        manifest = index.manifest() or {}
+        embedding_model = embeddings.model if embeddings else None
+        reset = manifest.get('embedding_model') != embedding_model or manifest.get('format') != INDEX_FORMAT
+        indexed = {} if reset else {s.get('doc_id'): s for s in manifest.get('segments', [])}
+
+        files = list(db.chatbot_files.find({}, {"content": 0, "page_offsets": 0}))
+        # Files uploaded before bodies moved to the content store still carry them inline
+        legacy_ids = [f['_id'] for f in files if not f.get('content_id') and str(f['_id']) not in indexed]
+        legacy = {f['_id']: f for f in db.chatbot_files.find({"_id": {"$in": legacy_ids}})} if legacy_ids else {}
+        wanted = {
+            str(file_doc['_id']): (legacy.get(file_doc['_id'], file_doc), chatbot_file_metadata(file_doc))
+            for file_doc in files
+        }
+
+        added = build_missing_segments(wanted, indexed)
+        removed = [doc_id for doc_id in indexed if doc_id not in wanted]
+        index.commit(
+            added,
+            remove=removed,
+            reset=reset,
+            content_version=content_version,
+            embedding_model=embedding_model
+        )
+        logger.info(f"Synced chatbot vector index: {len(added)} added, {len(removed)} removed")
+    return index
+
+def refresh_chatbot_index():
+    """Apply a change to the chatbot files to their vector index without failing the request that made it"""
+    answer_cache.invalidate("chatbot")
+    try:
+        sync_chatbot_index()
+    except Exception as e:
+        logger.warning(f"Failed to update the chatbot vector index: {str(e)}")
+
+def get_chatbot_index():
+    """Return the committed vector index of the chatbot files, or None if it has to be rebuilt first"""
+    return committed_index(CHATBOT_INDEX_NAME, chatbot_content_version(), refresh_chatbot_index)
+
+def locate_document(course: Dict[str, Any], doc_id: str):
+    """Find a document by id, returning its (subject index, document index, document)"""
+    for subject_idx, subject in enumerate(course.get('subjects', [])):
+        for doc_idx, doc in enumerate(subject.get('documents', [])):
+            if str(doc.get('_id')) == doc_id:
+                return subject_idx, doc_idx, doc
+    return None, None, None
+
+def cite_chunk(metadata: Dict[str, Any]) -> str:
+    """Source label for a retrieved chunk, including its page when known"""
+    source = metadata.get('source', 'Unknown Source')
+    page = metadata.get('page')
+    return f"{source} (page {page})" if page else source
+
+# Chat filters that select individual documents rather than whole courses
+DOCUMENT_FILTERS = ('subject_id', 'subject_index', 'document_ids', 'uploaded_after', 'uploaded_before')
+
+def course_scope_query(collection_id: Optional[str], filters: Dict[str, Any]):
+    """Build the (query, projection) that finds the courses a filtered chat searches"""
+    query_filter = {"_id": ObjectId(collection_id)} if collection_id else {}
+    if filters.get('tags'):
+        query_filter['tags'] = {"$in": filters['tags']}
+    projection = {"content_version": 1}
+    if any(name in filters for name in DOCUMENT_FILTERS):
+        projection.update({"subjects._id": 1, "subjects.documents._id": 1, "subjects.documents.uploaded_at": 1})
+    return query_filter, projection
+
+def scope_courses(courses, filters: Dict[str, Any]) -> List[Tuple[Dict[str, Any], Optional[List[str]]]]:
+    """Pair each course with the ids of its documents matching ``filters`` (None for all of them).
+
+    Courses without a matching document are left out, so their indexes are
+    never opened.
+    """
+    scoped = []
+    for course in courses:
+        if not any(name in filters for name in DOCUMENT_FILTERS):
+            scoped.append((course, None))
+            continue
+        doc_ids = []
+        for subject_idx, subject in enumerate(course.get('subjects', [])):
+            if 'subject_id' in filters and str(subject.get('_id')) != filters['subject_id']:
+                continue
+            if 'subject_index' in filters and subject_idx != filters['subject_index']:
+                continue
+            for doc in subject.get('documents', []):
+                uploaded_at = doc.get('uploaded_at')
+                if '_id' not in doc:
+                    continue
+                if 'document_ids' in filters and str(doc['_id']) not in filters['document_ids']:
+                    continue
+                if 'uploaded_after' in filters and (not uploaded_at or uploaded_at < filters['uploaded_after']):
+                    continue
+                if 'uploaded_before' in filters and (not uploaded_at or uploaded_at >= filters['uploaded_before']):
+                    continue
+                doc_ids.append(str(doc['_id']))
+        if doc_ids:
+            scoped.append((course, doc_ids))
+    return scoped
+
+def search_collection_chunks(collection_id: Optional[str], query: str, filters: Optional[Dict[str, Any]] = None,
+                             k: int = CONTEXT_CANDIDATES, mode: str = RETRIEVAL_MODE) -> List[Dict[str, Any]]:
+    """Retrieve context passages for a question from the course index(es).
+
+    Filters are resolved to documents first and only their index segments are
+    scored, rather than filtering the top results afterwards. ``mode`` picks
+    vector search, BM25 keyword search or both fused (see :func:`retrieve_passages`).
+    """
+    filters = filters or {}
+    scoped = [
+        (str(course['_id']), get_course_index(course), doc_ids)
+        for course, doc_ids in scope_courses(collection.find(*course_scope_query(collection_id, filters)), filters)
+    ]
+    scoped = [(course_id, index, doc_ids) for course_id, index, doc_ids in scoped if index is not None and index.size()]
+    if not scoped:
+        return []
+    use_ann = not collection_id and not filters and ann_index is not None
+    return retrieve_passages(
+        lambda: vector_search_courses(scoped, embeddings.embed_query(query), k, use_ann),
+        lambda: keyword_search_courses(scoped, query, k),
+        k,
+        mode
+    )
+
+def vector_search_courses(scoped: List[Tuple[str, Any, Optional[List[str]]]], query_vector, k: int,
+                          use_ann: bool = False) -> List[Dict[str, Any]]:
+    """Nearest-neighbour passages from (course id, index, document ids) scopes, through the IVF index if ``use_ann``"""
+    if use_ann:
+        return search_all_courses({course_id: index for course_id, index, _ in scoped}, query_vector, k)
+    ranked = search_indexes([index for _, index, _ in scoped], query_vector, k=k, with_vectors=True,
+                            doc_ids=[doc_ids for _, _, doc_ids in scoped], document_shortlist=DOCUMENT_SHORTLIST)
+    return [make_passage(chunk['text'], chunk['metadata'], score, vector) for chunk, score, vector in ranked]
+
+def keyword_search_courses(scoped: List[Tuple[str, Any, Optional[List[str]]]], query: str, k: int) -> List[Dict[str, Any]]:
+    """BM25 passages from (course id, index, document ids) scopes"""
+    ranked = bm25_search([index.snapshot() for _, index, _ in scoped], query, limit=k,
+                         doc_ids=[doc_ids for _, _, doc_ids in scoped])
+    return keyword_passages([(chunk, score) for _, chunk, score in ranked])
+
+# Helper function to turn BM25 hits into passages, scaling scores so the best hit scores 1.0 like a cosine match
+def keyword_passages(ranked: List[Tuple[Dict[str, Any], float]]) -> List[Dict[str, Any]]:
+    top = ranked[0][1] if ranked else 1.0
+    return [make_passage(chunk['text'], chunk['metadata'], score / top) for chunk, score in ranked]
+
+def fuse_passages(vector_ranked: List[Dict[str, Any]], keyword_ranked: List[Dict[str, Any]],
+                  k: int) -> List[Dict[str, Any]]:
+    """Merge vector and keyword passages with reciprocal rank fusion, keeping the top ``k``.
+
+    A chunk found by both keeps the vector leg's copy, and with it the
+    embedding used for diversity when the context is packed.
+    """
+    fused = reciprocal_rank_fusion([vector_ranked, keyword_ranked], key=chunk_key)
+    return [{**passage, 'score': score} for passage, score in fused[:k]]
+
+def run_retrieval_legs(vector_leg: Callable[[], List], keyword_leg: Callable[[], List], mode: str = RETRIEVAL_MODE):
+    """Run the retrieval legs ``mode`` asks for, returning (vector results, keyword results).
+
+    A leg that does not run yields None. A hybrid runs the keyword leg on the
+    retrieval pool while this thread embeds the query and runs the vector
+    leg, so it costs about as long as the slower leg. Without an embedding
+    backend only the keyword leg can run.
+    """
+    if mode == "keyword" or not embeddings:
+        return None, keyword_leg()
+    if mode == "vector":
+        return vector_leg(), None
+    keyword_future = retrieval_executor.submit(keyword_leg)
+    vector = vector_leg()
+    return vector, keyword_future.result()
+
+def retrieve_passages(vector_leg: Callable[[], List[Dict[str, Any]]], keyword_leg: Callable[[], List[Dict[str, Any]]],
+                      k: int, mode: str = RETRIEVAL_MODE) -> List[Dict[str, Any]]:
+    """Retrieve context passages with the legs ``mode`` asks for, fusing them for a hybrid"""
+    vector, keyword = run_retrieval_legs(vector_leg, keyword_leg, mode)
+    if vector is None or keyword is None:
+        return keyword if vector is None else vector
+    return fuse_passages(vector, keyword, k)
+
+NO_DOCUMENTS_ANSWER = "I don't have any documents to work with. Please add some documents first."
+
+def search_all_courses(indexes: Dict[str, Any], query_vector, k: int = CONTEXT_CANDIDATES) -> List[Dict[str, Any]]:
+    """Search every course through the approximate index.
+
+    The index follows course changes in the background (see
+    :func:`committed_course_indexes`), so a document indexed moments ago may
+    not be found yet. It scores quantized vectors, so its best
+    ``k * VECTOR_RESCORE_FACTOR`` hits are rescored against the course
+    indexes' full-precision vectors.
+    """
+    query = normalize_vectors(query_vector)[0]
+    passages = []
+    for (course_id, doc_id, offset), _, _ in ann_index.search(query, k * max(VECTOR_RESCORE_FACTOR, 1)):
+        snapshot = indexes[course_id].snapshot() if course_id in indexes else None
+        start, end = snapshot.partitions.get(doc_id, (0, 0)) if snapshot else (0, 0)
+        # A hit can refer to a document removed since the index last followed the courses
+        if offset >= end - start or not snapshot.has_vectors:
+            continue
+        chunk = snapshot.chunks[start + offset]
+        vector = np.array(snapshot.document_vectors(doc_id)[offset], dtype=np.float32)
+        passages.append(make_passage(chunk['text'], chunk['metadata'], float(vector @ query), vector))
+    return heapq.nlargest(k, passages, key=lambda passage: passage['score'])
+
+# Helper function to list the committed vector index of every course, which the approximate index mirrors
+def committed_course_indexes() -> Dict[str, Any]:
+    return {str(course['_id']): open_vector_index(f"course_{course['_id']}") for course in collection.find({}, {"_id": 1})}
+
+# Helper function to read a list parameter given as a JSON array or a comma-separated string
+def read_list_param(data, name: str) -> List[str]:
+    value = data.get(name)
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [str(item).strip() for item in value if str(item).strip()]
+
+# Helper function to validate the retrieval filters of a chat request; returns (filters, error message)
+def parse_chat_filters(data, collection_id: str):
+    filters = {}
+    
+    subject_id = data.get('subject_id')
+    if subject_id not in (None, ''):
+        if not collection_id:
+            return None, "A topic filter requires a course ID"
+        if not is_valid_objectid(subject_id):
+            return None, "Invalid topic ID"
+        filters['subject_id'] = subject_id
+    
+    subject_index = data.get('subject_index')
+    if subject_index not in (None, ''):
+        if not collection_id:
+            return None, "A topic filter requires a course ID"
+        try:
+            filters['subject_index'] = int(subject_index)
+        except (TypeError, ValueError):
+            return None, "Invalid topic index"
+        if filters['subject_index'] < 0:
+            return None, "Invalid topic index"
+    
+    document_ids = read_list_param(data, 'document_ids') or read_list_param(data, 'document_id')
+    if document_ids:
+        if not all(is_valid_objectid(doc_id) for doc_id in document_ids):
+            return None, "Invalid document ID"
+        filters['document_ids'] = sorted(set(document_ids))
+    
+    tags = read_list_param(data, 'tags')
+    if tags:
+        filters['tags'] = sorted(set(tags))
+    
+    for name in ('uploaded_after', 'uploaded_before'):
+        if data.get(name):
+            try:
+                value = datetime.fromisoformat(str(data[name]).replace('Z', '+00:00'))
+            except ValueError:
+                return None, f"Invalid {name} date; use ISO 8601"
+            # Upload times are stored as naive UTC
+            filters[name] = value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+    
+    return filters, None
+
+# Helper function to tag a corpus version with the chat filters, so filtered answers are cached separately
+def filtered_version(version: Any, filters: Optional[Dict[str, Any]]) -> Any:
+    if not filters or version is None:
+        return version
+    return f"{version}:{hashlib.md5(json.dumps(filters, sort_keys=True, default=str).encode('utf-8')).hexdigest()}"
+
+def prepare_course_chat(query: str, collection_id: str, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Retrieve context for a course question and build its Gemini prompt"""
+    # Search the persistent index of the selected course(s), scoped by any filters
+    candidates = search_collection_chunks(collection_id or None, query, filters)
+    return build_course_prompt(query, candidates)
+
+# Helper function to format one context passage the way it appears in a prompt
+def render_passage(passage: Dict[str, Any]) -> str:
+    return f"From {cite_chunk(passage['metadata'])}:\n{passage['text']}"
+
+# Helper function to fit retrieved passages into the context budget; returns (documents, context, report)
+def assemble_context(candidates: List[Dict[str, Any]]):
+    selected, report = pack_context(candidates, render_passage, CONTEXT_TOKEN_BUDGET, CONTEXT_MMR_LAMBDA,
+                                    max_passage_chars=3 * CHUNK_SIZE)
+    context = "\n\n".join(render_passage(passage) for passage in selected)
+    documents = [LangchainDocument(page_content=passage['text'], metadata=passage['metadata']) for passage in selected]
+    return documents, context, report
+
+def build_course_prompt(query: str, candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build the Gemini prompt and source list from retrieved course passages"""
+    if not candidates:
+        return {"prompt": None, "sources": [], "documents": [], "context": None}
+    
+    # Merge overlapping chunks, drop near-duplicates and pack the rest into the token budget
+    relevant_docs, context, report = assemble_context(candidates)
+    
+    # Prepare prompt
+    prompt = chat_prompt.format(
+        context=context,
+        question=query
+    )
+    report["prompt_tokens"] = estimate_tokens(prompt)
+    logger.info(f"Packed chat context: {report}")
+    
+    # Extract sources
+    sources = []
+    seen_sources = set()
+    for doc in relevant_docs:
+        source = doc.metadata.get("source")
+        if source and source not in seen_sources:
+            seen_sources.add(source)
+            sources.append(source)
+    
+    return {"prompt": prompt, "sources": sources, "documents": relevant_docs, "context": report}
+
+NO_MODEL_NOTICE = "AI generation is not configured, so here are the most relevant passages from your documents:"
+
+# Helper function to answer with the retrieved passages when no generative model is configured
+def extractive_answer(relevant_docs: List[LangchainDocument], max_passages: int = 3) -> str:
+    passages = [f"From {cite_chunk(doc.metadata)}:\n{doc.page_content.strip()}" for doc in relevant_docs[:max_passages]]
+    return "\n\n".join([NO_MODEL_NOTICE] + passages)
+
+# Helper function to stream an answer that is already complete (cached or extractive)
+def stream_full_answer(opening: Dict[str, Any], answer: str, closing: Dict[str, Any]):
+    yield sse_event("sources", opening)
+    yield sse_event("token", {"text": answer})
+    yield sse_event("done", closing)
+
+# Helper function to format a Server-Sent Event
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# Course fields read by the search endpoint
+SEARCH_COURSE_PROJECTION = {
+    "name": 1,
+    "content_version": 1,
+    "subjects._id": 1,
+    "subjects.name": 1,
+    "subjects.documents._id": 1,
+    "subjects.documents.filename": 1
+}
+
+# Helper function to search course and subject names
+def find_title_matches(courses: List[Dict[str, Any]], query: str) -> List[Dict[str, Any]]:
+    query_lower = query.lower()
+    title_matches = []
+    for course in courses:
+        if query_lower in course.get('name', '').lower():
+            title_matches.append({
+                "type": "course_name",
+                "course_id": str(course['_id']),
+                "content": course.get('name', ''),
+                "match_type": "title"
+            })
+        for subject_idx, subject in enumerate(course.get('subjects', [])):
+            if query_lower in subject.get('name', '').lower():
+                title_matches.append({
+                    "type": "subject_name",
+                    "course_id": str(course['_id']),
+                    "course_name": course.get('name', ''),
+                    "content": subject.get('name', ''),
+                    "subject_id": subject.get('_id'),
+                    "subject_index": subject_idx,
+                    "match_type": "title"
+                })
+    return title_matches
+
+def search_documents(courses: List[Dict[str, Any]], query: str, page: int, limit: int, mode: str = RETRIEVAL_MODE):
+    """Rank the documents of ``courses`` and return (page of results, total results, total courses).
+
+    Chunks are ranked with BM25, by similarity to the query embedding, or by
+    both fused, depending on ``mode``; then they are grouped per document.
+    """
+    opened = [(course, get_course_index(course)) for course in courses]
+    courses = [course for course, index in opened if index is not None]
+    ranked = retrieve_ranked_chunks([index for _, index in opened if index is not None], query, mode)
+    
+    documents = {}
+    for position, chunk, score in ranked:
+        key = (position, chunk['metadata'].get('doc_id'))
+        entry = documents.setdefault(key, {"position": position, "score": score, "chunks": []})
+        if len(entry["chunks"]) < 3:
+            entry["chunks"].append(chunk)
+    
+    ordered = sorted(documents.values(), key=lambda entry: entry["score"], reverse=True)
+    page_entries = ordered[(page - 1) * limit:page * limit]
+    
+    results = []
+    for entry in page_entries:
+        course = courses[entry["position"]]
+        doc_id = entry["chunks"][0]['metadata'].get('doc_id')
+        subject_idx, doc_idx, doc = locate_document(course, doc_id)
+        snippets = [snippet for chunk in entry["chunks"] for snippet in highlight_snippets(chunk['text'], query, max_snippets=1)]
+        results.append({
+            "type": "document_content",
+            "course_id": str(course['_id']),
+            "course_name": course.get('name', 'Unknown'),
+            "document_id": doc_id,
+            "filename": (doc or {}).get('filename', entry["chunks"][0]['metadata'].get('filename', 'Unknown')),
+            "subject_id": course['subjects'][subject_idx].get('_id') if subject_idx is not None else None,
+            "subject_index": subject_idx,
+            "document_index": doc_idx,
+            "score": entry["score"],
+            "content": snippets[0] if snippets else entry["chunks"][0]['text'][:200],
+            "snippets": snippets,
+            "match_type": "content"
+        })
+    return results, len(ordered), len({entry["position"] for entry in ordered})
+
+def retrieve_ranked_chunks(indexes: List[Any], query: str, mode: str = RETRIEVAL_MODE) -> List[Tuple[int, Dict[str, Any], float]]:
+    """Rank the chunks of several indexes for a content search as (index position, chunk, score), best first"""
+    def keyword_leg():
+        return bm25_search([index.snapshot() for index in indexes], query)
+
+    def vector_leg():
+        query_vector = normalize_vectors(embeddings.embed_query(query))[0]
+        scopes = [None] * len(indexes)
+        if DOCUMENT_SHORTLIST:
+            scopes = shortlist_documents([index.snapshot() for index in indexes], query_vector, DOCUMENT_SHORTLIST)
+        ranked = [
+            (position, chunk, score)
+            for position, index in enumerate(indexes)
+            for chunk, score in index.search(query_vector, SEARCH_VECTOR_CANDIDATES, doc_ids=scopes[position])
+            # Unrelated chunks would otherwise pad the results of every search
+            if score > 0
+        ]
+        return heapq.nlargest(SEARCH_VECTOR_CANDIDATES, ranked, key=lambda item: item[2])
+
+    vector, keyword = run_retrieval_legs(vector_leg, keyword_leg, mode)
+    if vector is None or keyword is None:
+        return keyword if vector is None else vector
+    fused = reciprocal_rank_fusion([vector, keyword], key=lambda item: (item[0], chunk_key(item[1])))
+    return [(position, chunk, score) for (position, chunk, _), score in fused]
+
+def ingest_chatbot_file(job, filename, file_size, file_hash):
+    """Background job: extract and store a file uploaded to the chatbot collection"""
+    # The same file may have been queued twice before either job finished
+    if db.chatbot_files.find_one({"file_hash": file_hash}, {"_id": 1}):
+        raise ValueError("File already exists")
+    
+    # The body is shared with any course the same file was uploaded to
+    file_id = ObjectId()
+    stored = store_upload(filename, file_hash, {"chatbot_file_id": file_id}, job)
+    preview = stored.get('content_preview', '')
+    
+    # Create document object
+    job.progress("storing", 80)
+    document = {
+        "_id": file_id,
+        "filename": filename,
+        "content_id": stored['_id'],
+        "file_size": file_size,
+        "file_hash": file_hash,
+        "uploaded_at": datetime.utcnow(),
+        "content_preview": content_preview(preview, 200)
+    }
+    
+    try:
+        db.chatbot_files.insert_one(document)
+    except Exception:
+        release_contents([stored['_id']], job.job_id, chatbot_file_id=file_id)
+        raise
+    bump_chatbot_version()
+    
+    logger.info(f"Uploaded chatbot file: {filename}")
+    return {
+        "file_id": str(file_id),
+        "filename": filename,
+        "file_size": file_size,
+        "content_length": stored.get('content_length'),
+        "deduplicated": stored['deduplicated']
+    }
+
+def detect_video_links(text):
+    """Detect and extract video links from text"""
+    video_patterns = [
+        r'https?://(?:www\.)?youtube\.com/watch\?v=[\w-]+',
+        r'https?://youtu\.be/[\w-]+',
+        r'https?://(?:www\.)?vimeo\.com/\d+',
+        r'https?://.*\.(?:mp4|avi|mov|wmv|flv|webm)'
+    ]
+    
+    links = []
+    for pattern in video_patterns:
+        matches = re.findall(pattern, text, re.IGNORECASE)
+        links.extend(matches)
+    
+    return links
+
+def prepare_chatbot_chat(query: str) -> Dict[str, Any]:
+    """Retrieve context from the uploaded chatbot files and build the RNS Reply prompt"""
+    context_from_files = ""
+    relevant_docs = []
+    report = None
+    if embeddings:
+        try:
+            # Search the persistent index of the uploaded files; only the query is embedded here
+            index = get_chatbot_index()
+            if index is not None and index.size():
+                candidates = retrieve_passages(
+                    lambda: [
+                        make_passage(chunk['text'], chunk['metadata'], score, vector)
+                        for chunk, score, vector in index.search(embeddings.embed_query(query), CONTEXT_CANDIDATES,
+                                                                 with_vectors=True,
+                                                                 document_shortlist=DOCUMENT_SHORTLIST)
+                    ],
+                    lambda: keyword_passages([(chunk, score) for _, chunk, score in
+                                              bm25_search([index.snapshot()], query, limit=CONTEXT_CANDIDATES)]),
+                    CONTEXT_CANDIDATES
+                )
+                relevant_docs, context_from_files, report = assemble_context(candidates)
+        except Exception as e:
+            logger.warning(f"Failed to process uploaded files for context: {str(e)}")
+    # Create enhanced prompt for RNS Reply with emphasis on uploaded files
+    if context_from_files:
+        prompt = f"""You are RNS Reply, an advanced AI assistant. Your primary goal is to answer questions using the uploaded documents as your main source of information.
+
+CRITICAL INSTRUCTIONS:
+1. **BASE YOUR ANSWER PRIMARILY ON THE UPLOADED FILES (95% of your response)**
+2. Use your general knowledge ONLY when the uploaded files don't contain relevant information (maximum 5%)
+3. If the uploaded files contain relevant information, prioritize that information heavily
+4. When the uploaded files don't have enough information, clearly state this and then provide minimal general knowledge
+5. Always cite which uploaded files you're referencing
+6. **ALWAYS suggest relevant YouTube videos** that complement your answer, even if files don't mention videos
+7. Format YouTube links properly for embedding (use format: https://www.youtube.com/watch?v=VIDEO_ID)
+
+**UPLOADED FILE CONTEXT (THIS IS YOUR PRIMARY SOURCE):**
+{context_from_files}
+
+**User Question:** {query}
+
+**Your Response Must:**
+- Be based primarily on the uploaded file content above
+- Only use general knowledge to fill small gaps if the files don't contain relevant information
+- Clearly indicate when you're using information from uploaded files vs general knowledge
+- **ALWAYS include 2-3 relevant YouTube video links** that help explain or demonstrate the topic
+- Be well-structured and easy to read
+- Provide actionable insights
+
+**For YouTube videos:** Even if your uploaded files don't mention specific videos, suggest educational YouTube videos that would help someone learn about this topic. Use real YouTube links in this format: https://www.youtube.com/watch?v=VIDEO_ID
+
+Remember: You are RNS Reply, and your uploaded files are your primary knowledge source, but you should always enhance answers with helpful video resources."""
+    else:
+        prompt = f"""You are RNS Reply, an advanced AI assistant. Since no files have been uploaded or no relevant information is found in uploaded files, I'll provide a comprehensive response based on general knowledge.
+
+INSTRUCTIONS:
+1. Provide detailed, well-researched answers based on general knowledge
+2. Be conversational, friendly, and professional
+3. **ALWAYS suggest 2-3 relevant YouTube videos** that help explain or demonstrate the topic
+4. Format YouTube links properly for embedding (use format: https://www.youtube.com/watch?v=VIDEO_ID)
+5. Always aim to be practical and actionable in your advice
+
+**User Question:** {query}
+
+**Note:** No uploaded files contain relevant information for this question.
+
+Provide a comprehensive answer that:
+- Is well-researched and accurate based on general knowledge
+- **Includes 2-3 relevant YouTube video links** that help explain the topic (format: https://www.youtube.com/watch?v=VIDEO_ID)
+- Is well-structured and easy to read
+- Offers practical value to the user
+
+**For YouTube videos:** Suggest educational YouTube videos that would help someone learn about this topic. Use real YouTube links in this format: https://www.youtube.com/watch?v=VIDEO_ID
+
+Remember: You are RNS Reply, designed to be your helpful digital assistant with enhanced video recommendations."""
+    
+    if report:
+        report["prompt_tokens"] = estimate_tokens(prompt)
+        logger.info(f"Packed chatbot context: {report}")
+    
+    # Prepare sources
+    sources = []
+    if context_from_files:
+        sources = [doc.metadata.get('source') for doc in relevant_docs if doc.metadata.get('source')]
+    
+    return {
+        "prompt": prompt,
+        "sources": sources,
+        "documents": relevant_docs if context_from_files else [],
+        "has_file_context": bool(context_from_files),
+        "context": report
+    }
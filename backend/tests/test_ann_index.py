@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex
+from vector_index import VectorIndex, normalize_vectors
+
+
+def clustered(count, dim=16, clusters=8, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = normalize_vectors(rng.normal(size=(clusters, dim)))
+    return normalize_vectors(centers[rng.integers(0, clusters, count)] + rng.normal(0, 0.2, (count, dim)))
+
+
+def add_document(index, doc_id, vectors):
+    index.commit([{
+        "doc_id": doc_id,
+        "metadata": {"title": doc_id},
+        "chunks": [{"text": f"{doc_id} {i}", "metadata": {"doc_id": doc_id}} for i in range(len(vectors))],
+        "vectors": np.asarray(vectors, dtype=np.float32)
+    }])
+
+
+@pytest.fixture
+def courses(tmp_path):
+    return {course_id: VectorIndex(str(tmp_path / course_id)) for course_id in ("c1", "c2")}
+
+
+@pytest.fixture
+def ivf(tmp_path, courses):
+    index = IVFIndex(str(tmp_path / "ivf"), nlist=8, min_train_size=200)
+    index._source = lambda: courses
+    index._embedding_model = "model"
+    return index
+
+
+def part_files(ivf):
+    return sorted(name for name in os.listdir(ivf.path) if name.startswith("part-"))
+
+
+def test_sync_adds_documents_and_tombstones_removed_ones(ivf, courses):
+    add_document(courses["c1"], "a", clustered(5, seed=1))
+    add_document(courses["c2"], "b", clustered(5, seed=2))
+    assert ivf.maintain()
+    assert not ivf.maintain()
+
+    courses["c1"].commit(remove=["a"])
+    assert ivf.maintain()
+
+    assert (ivf.stats()['vectors'], ivf.stats()['live'], ivf.stats()['tombstones']) == (10, 5, 5)
+    assert {key[:2] for key, _, _ in ivf.search(clustered(1, seed=1)[0], k=10)} == {("c2", "b")}
+
+
+def test_removed_course_is_tombstoned(ivf, courses):
+    add_document(courses["c1"], "a", clustered(5, seed=1))
+    add_document(courses["c2"], "b", clustered(5, seed=2))
+    ivf.maintain()
+
+    del courses["c2"]
+    ivf.maintain()
+
+    assert ivf.stats()['live'] == 5 and ivf.stats()['courses'] == 1
+
+
+def test_tombstone_only_change_leaves_parts_untouched(ivf, courses):
+    add_document(courses["c1"], "a", clustered(5, seed=1))
+    add_document(courses["c1"], "b", clustered(5, seed=2))
+    ivf.maintain()
+    parts = {name: os.stat(os.path.join(ivf.path, name)).st_mtime_ns for name in part_files(ivf)}
+
+    courses["c1"].commit(remove=["b"])
+    ivf.maintain()
+
+    assert {name: os.stat(os.path.join(ivf.path, name)).st_mtime_ns for name in part_files(ivf)} == parts
+
+
+def test_training_merges_parts_and_drops_tombstones(ivf, courses):
+    for i in range(4):
+        add_document(courses["c1"], f"d{i}", clustered(40, seed=i))
+        ivf.maintain()
+    courses["c1"].commit(remove=["d0"])
+    ivf.maintain()
+    assert ivf.stats()['lists'] == 0
+
+    add_document(courses["c2"], "big", clustered(200, seed=9))
+    ivf.maintain()
+
+    stats = ivf.stats()
+    assert (stats['lists'], stats['parts'], stats['vectors'], stats['tombstones']) == (8, 1, 320, 0)
+    assert stats['trained_on'] == 320
+
+
+def test_search_matches_exact_search_when_probing_every_list(ivf, courses):
+    data = clustered(400, seed=3)
+    add_document(courses["c1"], "a", data)
+    ivf.maintain()
+
+    query = data[17]
+    exact = [key for key, _, _ in ivf.exact_search(query, k=5)]
+
+    assert [key for key, _, _ in ivf.search(query, k=5, nprobe=8)] == exact
+    assert exact[0] == ("c1", "a", 17)
+    with pytest.raises(ValueError):
+        ivf.search(query, k=5, nprobe=0)
+
+
+def test_recall_report_measures_each_nprobe(ivf, courses):
+    add_document(courses["c1"], "a", clustered(400, seed=4))
+    ivf.maintain()
+
+    report = ivf.recall_report(k=5, nprobes=[1, 8], queries=20)
+
+    assert [result['nprobe'] for result in report['results']] == [1, 8]
+    assert report['results'][-1]['recall_at_k'] == 1.0
+    assert report['queries'] == 20 and report['vectors'] == 400
+
+
+def test_saved_index_reloads_in_another_instance(ivf, courses):
+    data = clustered(400, seed=5)
+    add_document(courses["c1"], "a", data)
+    ivf.maintain()
+
+    reloaded = IVFIndex(ivf.path, nlist=8, min_train_size=200)
+
+    assert reloaded.stats()['vectors'] == 400 and reloaded.stats()['lists'] == 8
+    assert reloaded.search(data[3], k=1)[0][0] == ("c1", "a", 3)
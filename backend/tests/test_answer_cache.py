@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from answer_cache import AnswerCache, normalize_query
+
+
+def key(query, version=1, corpus="course_a"):
+    return AnswerCache.make_key(corpus, version, query, "1")
+
+
+def test_rephrasings_share_an_entry():
+    assert normalize_query("  When is the MIDTERM?? ") == "when is the midterm"
+    assert key("When is the midterm?") == key("when is the   midterm")
+    assert key("when is the midterm", version=2) != key("when is the midterm")
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    cache.put(key("first"), {"answer": 1})
+    cache.put(key("second"), {"answer": 2})
+    assert cache.get(key("first")) == {"answer": 1}
+
+    cache.put(key("third"), {"answer": 3})
+
+    assert cache.get(key("second")) is None
+    assert cache.get(key("first")) == {"answer": 1}
+    assert cache.get(key("third")) == {"answer": 3}
+    assert cache.stats()['entries'] == 2
+
+
+def test_entries_expire(monkeypatch):
+    cache = AnswerCache(ttl_seconds=10)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    cache.put(key("question"), {"answer": 1})
+
+    monkeypatch.setattr(time, "time", lambda: now + 9)
+    assert cache.get(key("question")) == {"answer": 1}
+
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get(key("question")) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_invalidate_drops_every_version_of_one_corpus():
+    cache = AnswerCache()
+    cache.put(key("question", version=1), {"answer": 1})
+    cache.put(key("question", version=2), {"answer": 2})
+    cache.put(key("question", corpus="chatbot"), {"answer": 3})
+
+    assert cache.invalidate("course_a") == 2
+
+    assert cache.get(key("question", version=2)) is None
+    assert cache.get(key("question", corpus="chatbot")) == {"answer": 3}
+
+
+def test_similar_query_reuses_an_answer_for_the_same_corpus_version():
+    cache = AnswerCache(similarity_threshold=0.9)
+    cache.put(key("when is the midterm"), {"answer": "Oct 5"}, query_vector=[1.0, 0.0])
+
+    assert cache.get(key("midterm date"), query_vector=[0.95, 0.1]) == {"answer": "Oct 5"}
+    assert cache.get(key("office hours"), query_vector=[0.0, 1.0]) is None
+    assert cache.get(key("midterm date", version=2), query_vector=[0.95, 0.1]) is None
+    assert cache.get(key("midterm date", corpus="chatbot"), query_vector=[0.95, 0.1]) is None
+
+    stats = cache.stats()
+    assert (stats['similar_hits'], stats['misses']) == (1, 3)
+
+
+def test_similarity_reuse_is_off_without_a_threshold():
+    cache = AnswerCache()
+    cache.put(key("when is the midterm"), {"answer": "Oct 5"}, query_vector=[1.0, 0.0])
+
+    assert cache.get(key("midterm date"), query_vector=[1.0, 0.0]) is None
+
+
+def test_hit_rate_counts_exact_and_similar_hits():
+    cache = AnswerCache(similarity_threshold=0.9)
+    cache.put(key("question"), {"answer": 1}, query_vector=[1.0, 0.0])
+    cache.get(key("question"))
+    cache.get(key("rephrased"), query_vector=[1.0, 0.0])
+    cache.get(key("unrelated"), query_vector=[0.0, 1.0])
+
+    assert cache.stats()['hit_rate'] == pytest.approx(2 / 3)
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    # The app connects and creates its working files on import, so point both somewhere disposable first
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path_factory.mktemp("backend"))
+        patch.setenv("MONGODB_URI", "mongodb://localhost:27017/")
+        patch.setenv("GEMINI_API_KEY", "")
+        patch.setattr("pymongo.MongoClient", mongomock.MongoClient)
+        import flask_app
+        yield flask_app
+
+
+@pytest.fixture
+def client(server):
+    server.collection.delete_many({})
+    server.stats_collection.delete_many({})
+    return server.app.test_client()
+
+
+def add_courses(server, count):
+    created = datetime(2024, 1, 1)
+    server.collection.insert_many([
+        # Every other course shares its creation time with the previous one, so ties are paged by _id
+        {"name": f"Course {i}", "subjects": [{"name": f"Week {week}", "documents": []} for week in range(i)],
+         "created_at": created + timedelta(minutes=i // 2), "updated_at": created, "tags": []}
+        for i in range(count)
+    ])
+
+
+def test_cursor_pages_through_every_course_once(server, client):
+    add_courses(server, 7)
+
+    names, cursor = [], None
+    while True:
+        response = client.get("/api/collections", query_string={"limit": 3, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        body = response.get_json()
+        names.extend(course['name'] for course in body['collections'])
+        cursor = body['pagination']['next_cursor']
+        if not cursor:
+            break
+
+    assert names == [f"Course {i}" for i in (6, 5, 4, 3, 2, 1, 0)]
+
+
+def test_listing_counts_on_the_server_and_summary_drops_subjects(server, client):
+    add_courses(server, 3)
+
+    full = client.get("/api/collections", query_string={"sort_by": "name", "sort_order": "asc"}).get_json()
+    summary = client.get("/api/collections", query_string={"view": "summary"}).get_json()
+
+    assert [course['subject_count'] for course in full['collections']] == [0, 1, 2]
+    assert full['pagination']['total'] == 3
+    assert all('subjects' not in course for course in summary['collections'])
+
+
+def test_invalid_cursor_and_sort_field_are_rejected(client):
+    assert client.get("/api/collections", query_string={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/api/collections", query_string={"sort_by": "content"}).status_code == 400
+
+
+def stats(client, **params):
+    response = client.get("/api/stats", query_string=params)
+    assert response.status_code == 200
+    body = response.get_json()
+    return body['total_collections'], body['total_subjects'], body['total_documents']
+
+
+def test_write_endpoints_keep_the_counters_in_step(client):
+    assert stats(client) == (0, 0, 0)
+
+    first = client.post("/api/collections", json={"name": "Algebra"}).get_json()['_id']
+    client.post("/api/collections", json={"name": "Biology"})
+    client.post(f"/api/collections/{first}/subjects", json={"name": "Week 1"})
+    assert stats(client) == (2, 1, 0)
+
+    client.delete(f"/api/collections/{first}")
+    assert stats(client) == (1, 0, 0)
+
+
+def test_reconcile_recounts_from_the_courses(server, client):
+    add_courses(server, 3)
+    server.stats_collection.insert_one({"_id": server.STATS_ID, "collections": 40, "subjects": 7, "documents": 0})
+    assert stats(client) == (40, 7, 0)
+
+    assert stats(client, reconcile="true") == (3, 3, 0)
+    assert server.stats_collection.find_one({"_id": server.STATS_ID})['reconciled_at'] is not None
+
+
+def test_missing_counters_are_rebuilt_on_first_read(server, client):
+    add_courses(server, 2)
+
+    assert stats(client) == (2, 1, 0)
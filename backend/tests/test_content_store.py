@@ -0,0 +1,83 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from bson import ObjectId
+
+from content_store import ContentStore
+
+
+@pytest.fixture
+def store():
+    return ContentStore(mongomock.MongoClient().db.contents)
+
+
+# Owners are built the way the upload and delete routes build them
+def owner(course_id=None):
+    return {"course_id": course_id or ObjectId(), "document_id": ObjectId()}
+
+
+def test_put_then_acquire_shares_one_body(store):
+    first, second = owner(), owner()
+    content_id = store.put("hash-1", "shared text", [0, 5], first)
+
+    record = store.acquire("hash-1", second)
+
+    assert record['_id'] == content_id
+    assert 'content' not in record
+    assert record['owners'] == [first, second]
+    assert store.acquire("hash-missing", owner()) is None
+    assert store.get(content_id)['content'] == "shared text"
+
+
+def test_put_of_a_stored_hash_adds_an_owner(store):
+    first, second = owner(), owner()
+    content_id = store.put("hash-1", "shared text", None, first)
+
+    assert store.put("hash-1", "ignored", None, second) == content_id
+    assert store.contents.count_documents({}) == 1
+    assert store.get(content_id)['content'] == "shared text"
+
+
+def test_body_is_deleted_with_its_last_owner(store):
+    first, second = owner(), owner()
+    content_id = store.put("hash-1", "shared text", None, first)
+    store.acquire("hash-1", second)
+
+    assert store.release([content_id], **first) == []
+    assert store.exists("hash-1")
+
+    assert store.release([content_id], **second) == ["hash-1"]
+    assert not store.exists("hash-1")
+    assert store.release([content_id], **second) == []
+
+
+def test_chatbot_and_course_owners_share_a_body(store):
+    course_owner, chatbot_owner = owner(), {"chatbot_file_id": ObjectId()}
+    content_id = store.put("hash-1", "shared text", None, course_owner)
+    store.acquire("hash-1", chatbot_owner)
+
+    assert store.release([content_id], **course_owner) == []
+    assert store.release([content_id], **chatbot_owner) == ["hash-1"]
+
+
+def test_release_course_drops_only_that_course(store):
+    course = ObjectId()
+    in_course = owner(course)
+    elsewhere = owner()
+    shared = store.put("hash-shared", "shared", None, in_course)
+    store.acquire("hash-shared", elsewhere)
+    store.put("hash-own", "own", None, owner(course))
+
+    assert store.release_course(course) == ["hash-own"]
+    assert store.exists("hash-shared")
+    assert store.contents.find_one({"_id": shared})['owners'] == [elsewhere]
+
+
+def test_bodies_are_compressed_and_decoded(store):
+    content_id = store.put("hash-1", "text " * 100, None, owner())
+
+    raw = store.contents.find_one({"_id": content_id})
+    assert raw['codec'] == "zlib"
+    assert not isinstance(raw['content'], str)
+    assert store.get_many([content_id])[content_id]['content'] == "text " * 100
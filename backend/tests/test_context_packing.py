@@ -0,0 +1,82 @@
+import numpy as np
+
+from context_packing import estimate_tokens, make_passage, merge_adjacent, mmr_order, pack_context
+
+
+def passage(text, start, score, doc_id="doc", vector=None):
+    return make_passage(text, {"doc_id": doc_id, "start_index": start}, score,
+                        None if vector is None else np.asarray(vector, dtype=np.float32))
+
+
+def render(p):
+    return f"[{p['metadata'].get('doc_id')}]\n{p['text']}"
+
+
+def test_overlapping_chunks_merge_once():
+    merged = merge_adjacent([passage("abcdef", 0, 0.5), passage("efghij", 4, 0.9), passage("xyz", 100, 0.1)])
+
+    assert [p['text'] for p in merged] == ["abcdefghij", "xyz"]
+    assert merged[0]['score'] == 0.9
+
+
+def test_chunks_of_other_documents_or_without_position_stay_apart():
+    unplaced = make_passage("loose", {"doc_id": "doc"}, 0.3)
+
+    merged = merge_adjacent([passage("abcd", 0, 0.5), passage("defg", 3, 0.4, doc_id="other"), unplaced])
+
+    assert sorted(p['text'] for p in merged) == ["abcd", "defg", "loose"]
+
+
+def test_merged_passage_stops_growing_at_max_chars():
+    chunks = [passage("a" * 10, start, 0.5) for start in range(0, 40, 10)]
+
+    merged = merge_adjacent(chunks, max_chars=20)
+
+    assert [len(p['text']) for p in merged] == [20, 20]
+
+
+def test_merged_vector_is_the_normalized_mean():
+    merged = merge_adjacent([passage("abcd", 0, 0.5, vector=[1, 0]), passage("defg", 3, 0.4, vector=[0, 1])])
+
+    np.testing.assert_allclose(merged[0]['vector'], [2 ** -0.5, 2 ** -0.5], rtol=1e-6)
+
+
+def test_mmr_sinks_near_duplicates():
+    first = passage("midterm exam date october", 0, 0.9, vector=[1, 0])
+    duplicate = passage("midterm exam date october again", 100, 0.85, vector=[1, 0])
+    different = passage("office hours on friday", 200, 0.6, vector=[0, 1])
+
+    ordered = mmr_order([first, duplicate, different], lambda_mult=0.5)
+
+    assert [p['text'] for p in ordered] == [first['text'], different['text'], duplicate['text']]
+
+
+def test_mmr_measures_word_overlap_without_vectors():
+    first = passage("midterm exam date october", 0, 0.9)
+    duplicate = passage("midterm exam date october", 100, 0.85)
+    different = passage("office hours on friday", 200, 0.6)
+
+    ordered = mmr_order([first, duplicate, different], lambda_mult=0.5)
+
+    assert ordered[1] is different
+    assert all('_tokens' not in p for p in ordered)
+
+
+def test_pack_context_keeps_within_the_token_budget():
+    passages = [passage(f"{'word ' * 40}{i}", i * 1000, 1.0 - i / 10, doc_id=f"doc{i}") for i in range(10)]
+
+    selected, report = pack_context(passages, render, token_budget=150)
+
+    assert report['tokens'] == sum(estimate_tokens(render(p)) for p in selected) <= 150
+    assert report['passages'] == len(selected) == 2
+    assert (report['candidates'], report['merged'], report['budget']) == (10, 10, 150)
+    assert selected[0]['metadata']['doc_id'] == "doc0"
+
+
+def test_pack_context_truncates_a_best_passage_over_budget():
+    selected, report = pack_context([passage("x" * 1000, 0, 0.9)], render, token_budget=50)
+
+    assert len(selected) == 1
+    assert report['tokens'] <= 50
+    assert selected[0]['text'] == "x" * len(selected[0]['text'])
+
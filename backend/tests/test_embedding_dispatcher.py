@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+import embedding_dispatcher
+from embedding_backends import EmbeddingBackend, TransientEmbeddingError
+from embedding_dispatcher import EmbeddingDispatcher
+
+
+class RecordingBackend(EmbeddingBackend):
+    """Embeds each text as [its number], recording the batches and how many ran at once"""
+
+    name = "recording"
+    model = "recording-v1"
+
+    def __init__(self, max_batch_size=100, max_batch_chars=200000, delay=0.0, failures=()):
+        self.max_batch_size = max_batch_size
+        self.max_batch_chars = max_batch_chars
+        self.delay = delay
+        self.failures = list(failures)
+        self.batches = []
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def embed_batch(self, texts, kind="document"):
+        with self.lock:
+            self.batches.append(list(texts))
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            failure = self.failures.pop(0) if self.failures else None
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            if failure is not None:
+                raise failure
+            return [[float(text)] for text in texts]
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(embedding_dispatcher.time, "sleep", delays.append)
+    return delays
+
+
+def texts(count):
+    return [str(i) for i in range(count)]
+
+
+def test_batches_are_limited_by_count_and_keep_order():
+    backend = RecordingBackend(max_batch_size=10)
+    dispatcher = EmbeddingDispatcher(backend, batch_size=3)
+
+    vectors = dispatcher.embed_documents(texts(7))
+
+    assert vectors == [[float(i)] for i in range(7)]
+    assert sorted(len(batch) for batch in backend.batches) == [1, 3, 3]
+    assert dispatcher.stats()['batches'] == 3
+    assert dispatcher.batch_size == 3
+
+
+def test_batch_size_is_capped_by_the_backend():
+    assert EmbeddingDispatcher(RecordingBackend(max_batch_size=5), batch_size=50).batch_size == 5
+
+
+def test_batches_are_limited_by_characters():
+    backend = RecordingBackend(max_batch_chars=4)
+    dispatcher = EmbeddingDispatcher(backend)
+
+    dispatcher.embed_documents(["11", "22", "33", "44444"])
+
+    assert sorted(backend.batches) == [["11", "22"], ["33"], ["44444"]]
+
+
+def test_concurrent_requests_are_bounded():
+    backend = RecordingBackend(max_batch_size=1, delay=0.05)
+    dispatcher = EmbeddingDispatcher(backend, max_concurrency=2)
+
+    callers = [threading.Thread(target=dispatcher.embed_documents, args=(texts(4),)) for _ in range(3)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+
+    assert len(backend.batches) == 12
+    assert backend.peak == 2
+
+
+def test_transient_errors_are_retried_with_backoff(sleeps):
+    backend = RecordingBackend(failures=[TransientEmbeddingError("rate limited"), TimeoutError("slow")])
+    dispatcher = EmbeddingDispatcher(backend, base_delay=1.0, max_delay=1.5)
+
+    assert dispatcher.embed_query("7") == [7.0]
+
+    assert len(backend.batches) == 3
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 1.0 and 0 <= sleeps[1] <= 1.5
+    assert dispatcher.stats()['retries'] == 2
+
+
+def test_retries_give_up_after_max_retries(sleeps):
+    backend = RecordingBackend(failures=[TransientEmbeddingError("rate limited")] * 3)
+    dispatcher = EmbeddingDispatcher(backend, max_retries=2)
+
+    with pytest.raises(TransientEmbeddingError):
+        dispatcher.embed_documents(["1"])
+
+    assert len(backend.batches) == 3
+    assert dispatcher.stats()['failures'] == 1
+
+
+def test_other_errors_are_not_retried(sleeps):
+    backend = RecordingBackend(failures=[ValueError("bad request")])
+    dispatcher = EmbeddingDispatcher(backend)
+
+    with pytest.raises(ValueError):
+        dispatcher.embed_documents(["1"])
+
+    assert len(backend.batches) == 1
+    assert sleeps == []
+
+
+def test_failed_batch_fails_the_whole_call(sleeps):
+    backend = RecordingBackend(max_batch_size=1, failures=[ValueError("bad request")])
+    dispatcher = EmbeddingDispatcher(backend)
+
+    with pytest.raises(ValueError):
+        dispatcher.embed_documents(texts(3))
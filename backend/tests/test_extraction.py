@@ -0,0 +1,101 @@
+import io
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import extraction
+from extraction import _assemble_pages, extract_docx, extract_pdf, extract_txt, page_for_offset, start_pool
+
+
+def make_pdf(page_texts):
+    """A minimal PDF with one line of Helvetica text per page"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = output.tell()
+    output.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        output.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    output.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return output.getvalue()
+
+
+def test_pages_are_joined_with_their_start_offsets():
+    extracted = _assemble_pages([(1, "first page"), (3, "third page")])
+
+    assert extracted.text == "--- Page 1 ---\nfirst page\n--- Page 3 ---\nthird page"
+    assert extracted.page_offsets == [(1, 0), (3, len("--- Page 1 ---\nfirst page"))]
+    assert page_for_offset(extracted.page_offsets, extracted.text.index("first")) == 1
+    assert page_for_offset(extracted.page_offsets, extracted.text.index("third")) == 3
+    assert page_for_offset([], 10) is None
+
+
+def test_small_pdf_is_extracted_in_process():
+    extracted = extract_pdf(make_pdf(["Alpha", "Beta"]))
+
+    assert "Alpha" in extracted.text and "Beta" in extracted.text
+    assert [page for page, _ in extracted.page_offsets] == [1, 2]
+    assert page_for_offset(extracted.page_offsets, extracted.text.index("Beta")) == 2
+
+
+def test_broken_pool_falls_back_to_in_process_extraction(monkeypatch):
+    class BrokenPool:
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("workers exited")
+
+    monkeypatch.setattr(extraction, "_pool", BrokenPool())
+    monkeypatch.setattr(extraction, "PARALLEL_PDF_MIN_PAGES", 1)
+
+    extracted = extract_pdf(make_pdf(["Alpha", "Beta", "Gamma"]))
+
+    assert [page for page, _ in extracted.page_offsets] == [1, 2, 3]
+    assert "Gamma" in extracted.text
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_large_pdf_is_split_across_workers_in_page_order(monkeypatch):
+    monkeypatch.setattr(extraction, "_pool", None)
+    monkeypatch.setattr(extraction, "PDF_EXTRACTION_WORKERS", 2)
+    monkeypatch.setattr(extraction, "PARALLEL_PDF_MIN_PAGES", 2)
+    pool = start_pool()
+    try:
+        extracted = extract_pdf(make_pdf([f"Page{i}" for i in range(1, 6)]))
+    finally:
+        pool.shutdown()
+
+    assert [page for page, _ in extracted.page_offsets] == [1, 2, 3, 4, 5]
+    assert [page_for_offset(extracted.page_offsets, extracted.text.index(f"Page{i}")) for i in range(1, 6)] \
+        == [1, 2, 3, 4, 5]
+
+
+def test_docx_paragraphs_and_tables_are_extracted():
+    docx = pytest.importorskip("docx")
+    document = docx.Document()
+    document.add_paragraph("Syllabus")
+    table = document.add_table(rows=1, cols=2)
+    table.rows[0].cells[0].text = "Week 1"
+    table.rows[0].cells[1].text = "Intro"
+    source = io.BytesIO()
+    document.save(source)
+    source.seek(0)
+
+    assert extract_docx(source).text == "Syllabus\nWeek 1 Intro"
+
+
+def test_txt_is_decoded_and_stripped():
+    assert extract_txt(io.BytesIO("  café notes \n".encode("utf-8"))).text == "café notes"
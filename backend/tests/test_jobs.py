@@ -0,0 +1,123 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from jobs import (ABANDONED_ERROR, JOB_COMPLETED, JOB_FAILED, JOB_QUEUED, JOB_RUNNING,
+                  JobQueue)
+
+
+@pytest.fixture
+def jobs_collection():
+    return mongomock.MongoClient().db.jobs
+
+
+@pytest.fixture
+def queue(jobs_collection):
+    queue = JobQueue(jobs_collection, max_workers=1, heartbeat_interval=0.05, stale_after=60)
+    yield queue
+    queue.stop()
+    queue.executor.shutdown(wait=True)
+
+
+def wait_for(queue, job_id, statuses, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} never reached {statuses}")
+
+
+def test_job_runs_through_to_completion(queue):
+    started, release = threading.Event(), threading.Event()
+
+    def work(context, name):
+        started.set()
+        context.progress("embedding", 40)
+        release.wait(5)
+        return {"name": name}
+
+    job_id = queue.submit("upload", work, "notes.pdf", course_id="c1")
+    assert started.wait(5)
+    job = wait_for(queue, job_id, [JOB_RUNNING])
+    deadline = time.monotonic() + 5
+    while job['stage'] != "embedding" and time.monotonic() < deadline:
+        job = queue.get(job_id)
+    assert (job['stage'], job['progress']) == ("embedding", 40)
+    assert queue.has_pending(course_id="c1")
+    assert not queue.has_pending(course_id="c2")
+
+    release.set()
+    job = wait_for(queue, job_id, [JOB_COMPLETED])
+
+    assert job['progress'] == 100
+    assert job['result'] == {"name": "notes.pdf"}
+    assert job['details'] == {"course_id": "c1"}
+    assert job['finished_at'] is not None
+    assert not queue.has_pending(course_id="c1")
+
+
+def test_failing_job_records_its_error(queue):
+    def work(context):
+        raise ValueError("unreadable file")
+
+    job = wait_for(queue, queue.submit("upload", work), [JOB_COMPLETED, JOB_FAILED])
+
+    assert job['status'] == JOB_FAILED
+    assert job['error'] == "unreadable file"
+
+
+def test_queued_job_waits_for_a_free_worker(queue):
+    release = threading.Event()
+    first = queue.submit("upload", lambda context: release.wait(5))
+    second = queue.submit("upload", lambda context: None)
+
+    wait_for(queue, first, [JOB_RUNNING])
+    assert queue.get(second)['status'] == JOB_QUEUED
+    assert queue.has_pending(exclude=queue.get(first)['_id'])
+
+    release.set()
+    wait_for(queue, second, [JOB_COMPLETED])
+
+
+def test_jobs_of_a_dead_worker_are_failed(queue, jobs_collection):
+    stale = datetime.utcnow() - timedelta(minutes=10)
+    abandoned = jobs_collection.insert_one({"status": JOB_RUNNING, "worker": "gone:1:dead",
+                                            "heartbeat_at": stale, "updated_at": stale}).inserted_id
+    legacy = jobs_collection.insert_one({"status": JOB_QUEUED, "updated_at": stale}).inserted_id
+    alive = jobs_collection.insert_one({"status": JOB_RUNNING, "worker": "other:2:live",
+                                        "heartbeat_at": datetime.utcnow()}).inserted_id
+    finished = jobs_collection.insert_one({"status": JOB_COMPLETED, "worker": "gone:1:dead",
+                                           "heartbeat_at": stale}).inserted_id
+    cleaned = []
+
+    queue.start(on_abandoned=cleaned.append)
+
+    assert sorted(job['_id'] for job in cleaned) == sorted([abandoned, legacy])
+    for job_id in (abandoned, legacy):
+        job = jobs_collection.find_one({"_id": job_id})
+        assert (job['status'], job['error']) == (JOB_FAILED, ABANDONED_ERROR)
+    assert jobs_collection.find_one({"_id": alive})['status'] == JOB_RUNNING
+    assert jobs_collection.find_one({"_id": finished})['status'] == JOB_COMPLETED
+    assert queue.recover_abandoned() == 0
+
+
+def test_heartbeat_keeps_own_jobs_alive(queue, jobs_collection):
+    release = threading.Event()
+    job_id = queue.submit("upload", lambda context: release.wait(5))
+    first_beat = queue.get(job_id)['heartbeat_at']
+
+    queue.start()
+    deadline = time.monotonic() + 5
+    while queue.get(job_id)['heartbeat_at'] == first_beat and time.monotonic() < deadline:
+        time.sleep(0.01)
+    beat = queue.get(job_id)['heartbeat_at']
+    release.set()
+
+    assert beat > first_beat
+    assert wait_for(queue, job_id, [JOB_COMPLETED, JOB_FAILED])['status'] == JOB_COMPLETED
@@ -0,0 +1,82 @@
+from search_index import bm25_search, chunk_key, reciprocal_rank_fusion
+from vector_index import VectorIndex
+
+
+def chunk(doc_id, start, text):
+    return {"text": text, "metadata": {"doc_id": doc_id, "start_index": start}}
+
+
+def build_snapshot(tmp_path, name, segments):
+    index = VectorIndex(str(tmp_path / name))
+    index.commit([{"doc_id": doc_id, "chunks": chunks, "vectors": None} for doc_id, chunks in segments])
+    return index.snapshot()
+
+
+def test_bm25_ranks_matching_chunks_first(tmp_path):
+    snapshot = build_snapshot(tmp_path, "course", [
+        ("a", [chunk("a", 0, "Photosynthesis converts light into chemical energy"),
+               chunk("a", 100, "Mitochondria produce energy for the cell")]),
+        ("b", [chunk("b", 0, "The French revolution began in 1789")]),
+    ])
+
+    results = bm25_search([snapshot], "photosynthesis energy")
+
+    assert [c['text'] for _, c, _ in results] == [
+        "Photosynthesis converts light into chemical energy",
+        "Mitochondria produce energy for the cell",
+    ]
+    assert results[0][2] > results[1][2] > 0
+
+
+def test_bm25_phrases_scope_and_limit(tmp_path):
+    snapshot = build_snapshot(tmp_path, "course", [
+        ("a", [chunk("a", 0, "cell energy and the cell wall"), chunk("a", 50, "the wall of the cell")]),
+        ("b", [chunk("b", 0, "cell wall structure")]),
+    ])
+
+    phrase = bm25_search([snapshot], '"cell wall"')
+    assert sorted(c['text'] for _, c, _ in phrase) == ["cell energy and the cell wall", "cell wall structure"]
+
+    scoped = bm25_search([snapshot], "cell", doc_ids=[["b"]])
+    assert [c['metadata']['doc_id'] for _, c, _ in scoped] == ["b"]
+
+    assert len(bm25_search([snapshot], "cell", limit=1)) == 1
+    assert bm25_search([snapshot], "the and of") == []
+
+
+def test_bm25_reports_snapshot_positions(tmp_path):
+    first = build_snapshot(tmp_path, "first", [("a", [chunk("a", 0, "enzymes speed up reactions")])])
+    second = build_snapshot(tmp_path, "second", [("b", [chunk("b", 0, "catalysts and enzymes")])])
+
+    results = bm25_search([first, second], "enzymes")
+
+    assert sorted(position for position, _, _ in results) == [0, 1]
+
+
+def test_rrf_favours_items_found_by_every_ranking():
+    a, b, c, d = (chunk("doc", start, f"chunk {start}") for start in range(4))
+
+    fused = reciprocal_rank_fusion([[a, b, c], [d, c, a]], key=chunk_key)
+
+    assert [item['metadata']['start_index'] for item, _ in fused] == [0, 2, 3, 1]
+    assert fused[0][1] < 1.0
+    assert all(fused[i][1] >= fused[i + 1][1] for i in range(len(fused) - 1))
+
+
+def test_rrf_scales_a_unanimous_top_item_to_one():
+    a, b = chunk("doc", 0, "first"), chunk("doc", 1, "second")
+
+    fused = reciprocal_rank_fusion([[a, b], [a, b]], key=chunk_key)
+
+    assert fused[0][0] is a
+    assert fused[0][1] == 1.0
+
+
+def test_rrf_keeps_the_copy_from_the_earliest_ranking():
+    keyword = {"text": "same", "metadata": {"doc_id": "doc", "start_index": 0}, "highlights": ["same"]}
+    vector = {"text": "same", "metadata": {"doc_id": "doc", "start_index": 0}}
+
+    fused = reciprocal_rank_fusion([[keyword], [vector]], key=chunk_key)
+
+    assert len(fused) == 1
+    assert fused[0][0] is keyword
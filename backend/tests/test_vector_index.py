@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from vector_index import VectorIndex, open_index, search_indexes
+
+
+def segment(doc_id, texts, vectors):
+    return {
+        "doc_id": doc_id,
+        "metadata": {"title": doc_id},
+        "chunks": [{"text": text, "metadata": {"doc_id": doc_id, "start_index": i}} for i, text in enumerate(texts)],
+        "vectors": np.array(vectors, dtype=np.float32)
+    }
+
+
+@pytest.fixture(params=["int8", "float16", "none"])
+def index(request, tmp_path):
+    return VectorIndex(str(tmp_path / "course"), quantization=request.param)
+
+
+def test_commit_then_search_returns_nearest_chunks(index):
+    index.commit([
+        segment("a", ["north", "east"], [[1, 0, 0], [0, 1, 0]]),
+        segment("b", ["up"], [[0, 0, 1]]),
+    ], course_version="v1")
+
+    results = index.search([0.1, 0.9, 0.0], k=2)
+
+    assert [chunk['text'] for chunk, _ in results] == ["east", "north"]
+    assert results[0][1] == pytest.approx(0.9 / np.linalg.norm([0.1, 0.9]), abs=1e-3)
+    assert results[0][0]['metadata'] == {"title": "a", "doc_id": "a", "start_index": 1}
+    assert index.size() == 3
+    assert index.manifest()['course_version'] == "v1"
+
+
+def test_search_scopes_to_documents_and_shortlist(index):
+    index.commit([
+        segment("a", ["north"], [[1, 0, 0]]),
+        segment("b", ["up"], [[0, 0, 1]]),
+    ])
+
+    assert [c['text'] for c, _ in index.search([1, 0, 0], k=5, doc_ids=["b"])] == ["up"]
+    assert [c['text'] for c, _ in index.search([0, 0, 1], k=5, document_shortlist=1)] == ["up"]
+    assert index.search([1, 0, 0], k=5, doc_ids=["missing"]) == []
+
+
+def test_commits_publish_new_generations(index):
+    first = index.commit([segment("a", ["north"], [[1, 0, 0]]), segment("b", ["up"], [[0, 0, 1]])])
+    second = index.commit(remove=["a"])
+    third = index.commit(relabel={"b": {"title": "renamed"}})
+
+    assert (first['generation'], second['generation'], third['generation']) == (1, 2, 3)
+    assert index.doc_ids() == ["b"]
+    assert [c['text'] for c, _ in index.search([1, 0, 0], k=5)] == ["up"]
+    assert index.manifest()['segments'][0]['metadata'] == {"title": "renamed"}
+
+    index.commit([segment("c", ["east"], [[0, 1, 0]])], reset=True)
+    assert index.doc_ids() == ["c"]
+
+
+def test_commit_is_visible_to_another_instance(tmp_path):
+    writer = VectorIndex(str(tmp_path / "course"))
+    reader = VectorIndex(str(tmp_path / "course"))
+    assert reader.search([1, 0, 0]) == []
+
+    writer.commit([segment("a", ["north"], [[1, 0, 0]])])
+
+    assert [c['text'] for c, _ in reader.search([1, 0, 0])] == ["north"]
+    assert reader.snapshot().generation == 1
+
+
+def test_index_without_vectors_serves_keywords_only(tmp_path):
+    index = VectorIndex(str(tmp_path / "course"))
+    index.commit([{**segment("a", ["north"], [[1, 0, 0]]), "vectors": None}])
+
+    assert index.search([1, 0, 0]) == []
+    assert "north" in index.snapshot().postings
+
+
+def test_search_indexes_merges_results_by_score(tmp_path):
+    first = VectorIndex(str(tmp_path / "first"))
+    second = VectorIndex(str(tmp_path / "second"))
+    first.commit([segment("a", ["north", "up"], [[1, 0, 0], [0, 0, 1]])])
+    second.commit([segment("b", ["north-east"], [[1, 1, 0]])])
+
+    results = search_indexes([first, second], [1, 0.2, 0], k=2)
+
+    assert [c['text'] for c, _ in results] == ["north", "north-east"]
+
+
+def test_drop_removes_the_index(tmp_path):
+    index = open_index(str(tmp_path), "course")
+    assert open_index(str(tmp_path), "course") is index
+    index.commit([segment("a", ["north"], [[1, 0, 0]])])
+
+    index.drop()
+
+    assert index.size() == 0
+    assert index.search([1, 0, 0]) == []
+    assert not (tmp_path / "course").exists()
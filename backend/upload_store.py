@@ -0,0 +1,65 @@
+"""Content-addressed storage for raw uploaded files."""
+
+import hashlib
+import os
+import re
+import tempfile
+from typing import BinaryIO, Tuple
+
+# Bytes copied per read; bounds the memory an upload needs while it is stored
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class FileTooLargeError(ValueError):
+    """Raised when an upload exceeds the size limit while it is being stored"""
+
+
+class UploadStore:
+    """Keeps each uploaded file once under ``root``, named by its MD5 hash.
+
+    ``save`` copies a stream to disk in fixed-size chunks, hashing and
+    measuring it in the same pass and stopping as soon as the size limit is
+    exceeded, so an upload is never held in memory. Extraction then reads the
+    stored file by path.
+    """
+
+    def __init__(self, root: str, max_size: int):
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, file_hash: str) -> str:
+        return os.path.join(self.root, re.sub(r'[^\w.-]', '_', file_hash))
+
+    def save(self, stream: BinaryIO) -> Tuple[str, int]:
+        """Store ``stream``, returning its hash and size"""
+        digest = hashlib.md5()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise FileTooLargeError(f"File too large. Maximum size is {self.max_size // (1024*1024)}MB")
+                    digest.update(chunk)
+                    f.write(chunk)
+            file_hash = digest.hexdigest()
+            # Identical uploads map to the same name, so replacing an existing copy is harmless
+            os.replace(tmp_path, self.path(file_hash))
+            return file_hash, size
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def discard(self, file_hash: str):
+        try:
+            os.remove(self.path(file_hash))
+        except FileNotFoundError:
+            pass
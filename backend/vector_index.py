@@ -0,0 +1,533 @@
+"""Persistent on-disk vector indexes used by the RAG chat endpoints."""
+
+import heapq
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+import numpy as np
+
+from search_index import term_frequencies
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = ".lock"
+SEGMENT_DIR = "segments"
+# Bumped whenever the segment layout changes so stale indexes are rebuilt
+INDEX_FORMAT = 4
+# Encodings of the compact copy of segment vectors that queries scan
+QUANTIZATIONS = ("int8", "float16", "none")
+# Rows scored per block when a quantized block is widened to float32
+SCORE_BLOCK_ROWS = 16384
+
+
+def normalize_vectors(vectors) -> np.ndarray:
+    """Convert embeddings to a float32 matrix of unit-length rows"""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_vectors(matrix: np.ndarray, quantization: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """Encode unit vectors compactly, returning (codes, per-row scales)"""
+    if quantization == "float16":
+        return matrix.astype(np.float16), None
+    if quantization == "int8":
+        # Symmetric per-row scaling keeps the full int8 range for every row
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return None, None
+
+
+class SegmentVectors:
+    """Memory-mapped vectors of one segment.
+
+    ``vectors`` holds the full-precision unit rows and ``codes`` an optional
+    int8 or float16 copy (int8 rows are multiplied by ``scales``). Both are
+    mapped read-only, so every worker process shares the page cache instead
+    of holding its own copy, and only the rows a query touches are read.
+    ``centroid`` is the normalized mean of the rows, a summary of the whole
+    document that is small enough to keep in memory.
+    """
+
+    def __init__(self, vectors: np.ndarray, codes: Optional[np.ndarray] = None, scales: Optional[np.ndarray] = None,
+                 centroid: Optional[np.ndarray] = None):
+        self.vectors = vectors
+        self.codes = codes
+        self.scales = scales
+        self.centroid = centroid
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """Score every row against a unit query, from the compact copy when there is one"""
+        source = self.vectors if self.codes is None else self.codes
+        scores = np.empty(len(source), dtype=np.float32)
+        for start in range(0, len(source), SCORE_BLOCK_ROWS):
+            block = source[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32, copy=False) @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+
+class IndexSnapshot:
+    """Immutable in-memory view of one index generation.
+
+    ``partitions`` maps each document id to the contiguous ``(start, end)``
+    chunk positions of its segment, and ``vectors`` maps it to the segment's
+    :class:`SegmentVectors` (``vectors`` is None when the index was built
+    without embeddings). ``postings`` maps each term to
+    ``(chunk position, term frequency)`` pairs for keyword search.
+    ``centroids`` stacks the documents' centroids, one row per entry of
+    ``centroid_doc_ids``, for shortlisting documents before their chunks.
+    """
+
+    def __init__(self, generation: Optional[int], chunks: List[Dict[str, Any]],
+                 vectors: Optional[Dict[str, SegmentVectors]], postings: Dict[str, List[Tuple[int, int]]],
+                 lengths: List[int], partitions: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.generation = generation
+        self.chunks = chunks
+        self.vectors = vectors
+        self.postings = postings
+        self.lengths = lengths
+        self.total_length = sum(lengths)
+        self.partitions = partitions or {}
+        self.centroid_doc_ids = list(vectors.keys()) if vectors else []
+        self.centroids = (np.vstack([v.centroid for v in vectors.values()])
+                          if vectors and all(v.centroid is not None for v in vectors.values()) else None)
+
+    @property
+    def has_vectors(self) -> bool:
+        return self.vectors is not None and bool(self.chunks)
+
+    def document_vectors(self, doc_id: str) -> np.ndarray:
+        """Full-precision vectors of one document's chunks, in chunk order"""
+        return self.vectors[doc_id].vectors
+
+    def document_scores(self, query: np.ndarray, doc_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Similarity of a unit query to each document's centroid, optionally only for ``doc_ids``"""
+        if self.centroids is None:
+            return []
+        scores = self.centroids @ query
+        if doc_ids is None:
+            return list(zip(self.centroid_doc_ids, scores.tolist()))
+        wanted = set(doc_ids)
+        return [(doc_id, float(score)) for doc_id, score in zip(self.centroid_doc_ids, scores) if doc_id in wanted]
+
+
+EMPTY_SNAPSHOT = IndexSnapshot(None, [], None, {}, [])
+
+
+class VectorIndex:
+    """Chunk index for a single corpus (one course, or the chatbot files).
+
+    Each chunk is stored with its embedding (when an embedding model is
+    configured) and its term frequencies, so the same chunks serve vector and
+    keyword search. The index is a directory of immutable segments, one per
+    source document, plus a manifest that lists the live segments. A write
+    builds its segment files first and then atomically replaces the manifest,
+    so a reader always sees one complete generation of the index.
+
+    Segment vectors are memory-mapped rather than loaded. Queries scan a
+    quantized copy (``quantization``) and rescore the best
+    ``k * rescore_factor`` rows against the full-precision vectors. The
+    quantization of each segment is recorded in the manifest, so segments
+    written under another setting stay readable. Each segment also stores
+    its document's centroid when it is written, so a query can first pick
+    the most promising documents and score only their chunks.
+    """
+
+    def __init__(self, path: str, quantization: str = "int8", rescore_factor: int = 4):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown vector quantization: {quantization}")
+        self.path = path
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self._lock = threading.RLock()
+        self._writer_depth = 0
+        self._manifest = None
+        self._manifest_stamp = None
+        self._segments = {}
+        self._snapshot = EMPTY_SNAPSHOT
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.path, MANIFEST_NAME)
+
+    def _segment_path(self, segment_id: str, ext: str) -> str:
+        return os.path.join(self.path, SEGMENT_DIR, f"{segment_id}.{ext}")
+
+    def manifest(self) -> Optional[Dict[str, Any]]:
+        """Return the current manifest, re-reading it only when it changed on disk"""
+        with self._lock:
+            try:
+                stat = os.stat(self.manifest_path)
+            except FileNotFoundError:
+                self._manifest = None
+                self._manifest_stamp = None
+                return None
+
+            stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if stamp != self._manifest_stamp:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+                self._manifest_stamp = stamp
+            return self._manifest
+
+    @contextmanager
+    def writer(self):
+        """Serialize writers of this index across threads and worker processes"""
+        with self._lock:
+            # The thread lock is reentrant; only the outermost writer takes the file lock
+            if fcntl is None or self._writer_depth:
+                self._writer_depth += 1
+                try:
+                    yield
+                finally:
+                    self._writer_depth -= 1
+                return
+
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, LOCK_NAME), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._writer_depth += 1
+                try:
+                    yield
+                finally:
+                    self._writer_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def commit(self, segments: Iterable[Dict[str, Any]] = (), remove: Iterable[str] = (),
+               relabel: Optional[Dict[str, Dict[str, Any]]] = None, reset: bool = False,
+               **fields) -> Dict[str, Any]:
+        """Write new segments and publish them in a new manifest generation.
+
+        Each segment is a dict with ``doc_id``, ``metadata``, ``chunks`` (a list
+        of ``{"text": ..., "metadata": ...}``) and ``vectors`` (None when no
+        embedding model is available). Segments whose
+        ``doc_id`` is in ``remove`` are dropped, ``relabel`` replaces the
+        metadata of existing segments without re-embedding them, and ``reset``
+        drops every previous segment. Extra keyword arguments are stored on the
+        manifest.
+        """
+        with self.writer():
+            os.makedirs(os.path.join(self.path, SEGMENT_DIR), exist_ok=True)
+            previous = self.manifest()
+            remove = set(remove)
+            relabel = relabel or {}
+            live = []
+            if not reset and previous is not None:
+                for segment in previous.get('segments', []):
+                    if segment.get('doc_id') in remove:
+                        continue
+                    if segment.get('doc_id') in relabel:
+                        segment = {**segment, "metadata": relabel[segment['doc_id']]}
+                    live.append(segment)
+
+            for segment in segments:
+                chunks = segment.get('chunks', [])
+                if not chunks:
+                    continue
+                segment_id = uuid.uuid4().hex
+                has_vectors = segment.get('vectors') is not None
+                if has_vectors:
+                    vectors = normalize_vectors(segment['vectors'])
+                    np.save(self._segment_path(segment_id, 'npy'), vectors)
+                    codes, scales = quantize_vectors(vectors, self.quantization)
+                    if codes is not None:
+                        np.save(self._segment_path(segment_id, 'q.npy'), codes)
+                    if scales is not None:
+                        np.save(self._segment_path(segment_id, 's.npy'), scales)
+                    np.save(self._segment_path(segment_id, 'c.npy'), normalize_vectors(vectors.mean(axis=0))[0])
+                with open(self._segment_path(segment_id, 'json'), 'w', encoding='utf-8') as f:
+                    json.dump([{**chunk, "tf": term_frequencies(chunk['text'])} for chunk in chunks], f)
+                live.append({
+                    "id": segment_id,
+                    "doc_id": segment.get('doc_id'),
+                    "count": len(chunks),
+                    "has_vectors": has_vectors,
+                    "quantization": self.quantization if has_vectors else None,
+                    "metadata": segment.get('metadata', {})
+                })
+
+            manifest = dict(previous or {})
+            manifest.update(fields)
+            manifest['format'] = INDEX_FORMAT
+            manifest['generation'] = (previous or {}).get('generation', 0) + 1
+            manifest['segments'] = live
+            self._write_manifest(manifest)
+
+            if previous:
+                live_ids = {s['id'] for s in live}
+                for segment in previous.get('segments', []):
+                    if segment['id'] not in live_ids:
+                        self._remove_segment_files(segment['id'])
+
+            return manifest
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        tmp_path = f"{self.manifest_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _remove_segment_files(self, segment_id: str):
+        for ext in ('npy', 'q.npy', 's.npy', 'c.npy', 'json'):
+            try:
+                os.remove(self._segment_path(segment_id, ext))
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                # Windows refuses to delete a file that is still mapped
+                logger.debug(f"Segment file {segment_id}.{ext} is in use; leaving it behind")
+
+    def _load_segment(self, segment: Dict[str, Any]) -> Tuple[Optional[SegmentVectors], List[Dict[str, Any]]]:
+        cached = self._segments.get(segment['id'])
+        if cached is None:
+            vectors = None
+            if segment.get('has_vectors', True):
+                quantization = segment.get('quantization')
+                vectors = SegmentVectors(
+                    np.load(self._segment_path(segment['id'], 'npy'), mmap_mode='r'),
+                    np.load(self._segment_path(segment['id'], 'q.npy'), mmap_mode='r')
+                    if quantization in ("int8", "float16") else None,
+                    np.load(self._segment_path(segment['id'], 's.npy'), mmap_mode='r')
+                    if quantization == "int8" else None,
+                    np.load(self._segment_path(segment['id'], 'c.npy'))
+                )
+            with open(self._segment_path(segment['id'], 'json'), 'r', encoding='utf-8') as f:
+                chunks = json.load(f)
+            cached = (vectors, chunks)
+            self._segments[segment['id']] = cached
+        return cached
+
+    def _ensure_loaded(self) -> IndexSnapshot:
+        """Load the segments of the current generation into a snapshot"""
+        for attempt in range(2):
+            manifest = self.manifest()
+            if manifest is None:
+                self._segments = {}
+                self._snapshot = EMPTY_SNAPSHOT
+                return self._snapshot
+            if manifest['generation'] == self._snapshot.generation:
+                return self._snapshot
+            try:
+                loaded = [(s, *self._load_segment(s)) for s in manifest.get('segments', [])]
+            except FileNotFoundError:
+                # A concurrent writer replaced the manifest while we were loading
+                self._manifest_stamp = None
+                continue
+
+            live_ids = {s['id'] for s in manifest.get('segments', [])}
+            self._segments = {k: v for k, v in self._segments.items() if k in live_ids}
+            self._snapshot = self._build_snapshot(manifest['generation'], loaded)
+            return self._snapshot
+        raise RuntimeError(f"Vector index at {self.path} changed while loading")
+
+    @staticmethod
+    def _build_snapshot(generation: int, loaded: List[Tuple[Dict[str, Any], Optional[SegmentVectors], List[Dict[str, Any]]]]) -> IndexSnapshot:
+        chunks = []
+        postings = {}
+        lengths = []
+        partitions = {}
+        for segment, _, segment_chunks in loaded:
+            partitions[segment.get('doc_id')] = (len(chunks), len(chunks) + len(segment_chunks))
+            # Segment metadata can be relabelled between generations, so merge it per load
+            metadata = {**segment.get('metadata', {}), 'doc_id': segment.get('doc_id')}
+            for chunk in segment_chunks:
+                position = len(chunks)
+                chunks.append({"text": chunk['text'], "metadata": {**metadata, **chunk.get('metadata', {})}})
+                tf = chunk.get('tf', {})
+                lengths.append(sum(tf.values()))
+                for term, count in tf.items():
+                    postings.setdefault(term, []).append((position, count))
+
+        vectors = None
+        if loaded and all(v is not None for _, v, _ in loaded):
+            # Segments stay separate mapped arrays; stacking them would copy every vector into this process
+            vectors = {segment.get('doc_id'): v for segment, v, _ in loaded}
+        return IndexSnapshot(generation, chunks, vectors, postings, lengths, partitions)
+
+    def snapshot(self) -> IndexSnapshot:
+        """Return the in-memory view of the current generation"""
+        with self._lock:
+            return self._ensure_loaded()
+
+    def search(self, query_vector, k: int = 5, with_vectors: bool = False,
+               doc_ids: Optional[Iterable[str]] = None, document_shortlist: int = 0) -> List[Tuple]:
+        """Return the ``k`` chunks most similar to the query vector as (chunk, score[, vector]).
+
+        With ``doc_ids``, only the segments of those documents are scored.
+        With ``document_shortlist``, only the chunks of that many documents
+        whose centroids best match the query are scored.
+        """
+        snapshot = self.snapshot()
+        if not snapshot.has_vectors:
+            return []
+
+        query = normalize_vectors(query_vector)[0]
+        if document_shortlist:
+            doc_ids = shortlist_documents([snapshot], query, document_shortlist, [doc_ids])[0]
+        wanted = snapshot.partitions.keys() if doc_ids is None else set(doc_ids)
+        segments = [(doc_id, snapshot.partitions[doc_id]) for doc_id in wanted if doc_id in snapshot.partitions]
+        segments = [(doc_id, start, end) for doc_id, (start, end) in segments if end > start]
+        if not segments:
+            return []
+
+        # Shortlist from the compact copies, then rescore the shortlist at full precision
+        approximate = np.concatenate([snapshot.vectors[doc_id].approximate_scores(query) for doc_id, _, _ in segments])
+        owners = np.concatenate([np.full(end - start, i, dtype=np.int32) for i, (_, start, end) in enumerate(segments)])
+        local = np.concatenate([np.arange(end - start) for _, start, end in segments])
+        shortlist = min(max(k, 1) * max(self.rescore_factor, 1), len(approximate))
+        candidates = np.argpartition(-approximate, shortlist - 1)[:shortlist]
+
+        rescored = []
+        for candidate in candidates:
+            doc_id, start, _ = segments[owners[candidate]]
+            vector = np.array(snapshot.vectors[doc_id].vectors[local[candidate]], dtype=np.float32)
+            rescored.append((start + int(local[candidate]), float(vector @ query), vector))
+        rescored = heapq.nlargest(k, rescored, key=lambda item: item[1])
+        if with_vectors:
+            return [(snapshot.chunks[position], score, vector) for position, score, vector in rescored]
+        return [(snapshot.chunks[position], score) for position, score, _ in rescored]
+
+    def size(self) -> int:
+        manifest = self.manifest()
+        if not manifest:
+            return 0
+        return sum(s.get('count', 0) for s in manifest.get('segments', []))
+
+    def doc_ids(self) -> List[str]:
+        manifest = self.manifest()
+        if not manifest:
+            return []
+        return [s.get('doc_id') for s in manifest.get('segments', [])]
+
+    def drop(self):
+        """Delete the index from disk"""
+        with self._lock:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._manifest = None
+            self._manifest_stamp = None
+            self._segments = {}
+            self._snapshot = EMPTY_SNAPSHOT
+
+
+class ChunkArtifactStore:
+    """Chunks and vectors of extracted files, shared by every index containing the same file.
+
+    Artifacts are keyed by the file's content hash and a variant naming the
+    embedding model and chunking settings, so a file uploaded to several
+    courses is chunked and embedded only once.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _paths(self, key: str, variant: str) -> Tuple[str, str]:
+        base = os.path.join(self.root, re.sub(r'[^\w.-]', '_', key), re.sub(r'[^\w.-]', '_', variant))
+        return f"{base}.json", f"{base}.npy"
+
+    def get(self, key: str, variant: str) -> Optional[Tuple[List[Dict[str, Any]], Optional[np.ndarray]]]:
+        chunks_path, vectors_path = self._paths(key, variant)
+        try:
+            with open(chunks_path, 'r', encoding='utf-8') as f:
+                artifact = json.load(f)
+            vectors = np.load(vectors_path) if artifact['has_vectors'] else None
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        return artifact['chunks'], vectors
+
+    def put(self, key: str, variant: str, chunks: List[Dict[str, Any]], vectors):
+        chunks_path, vectors_path = self._paths(key, variant)
+        os.makedirs(os.path.dirname(chunks_path), exist_ok=True)
+        suffix = f".{uuid.uuid4().hex}.tmp"
+        # Vectors are published before the chunk file that announces them
+        if vectors is not None:
+            with open(vectors_path + suffix, 'wb') as f:
+                np.save(f, np.asarray(vectors, dtype=np.float32))
+            os.replace(vectors_path + suffix, vectors_path)
+        with open(chunks_path + suffix, 'w', encoding='utf-8') as f:
+            json.dump({"chunks": chunks, "has_vectors": vectors is not None}, f)
+        os.replace(chunks_path + suffix, chunks_path)
+
+    def discard(self, key: str):
+        """Delete the artifacts of ``key`` for every variant"""
+        shutil.rmtree(os.path.join(self.root, re.sub(r'[^\w.-]', '_', key)), ignore_errors=True)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def open_index(root: str, name: str, quantization: str = "int8", rescore_factor: int = 4) -> VectorIndex:
+    """Return the process-wide ``VectorIndex`` for ``name`` under ``root``"""
+    path = os.path.join(root, name)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = VectorIndex(path, quantization, rescore_factor)
+            _indexes[path] = index
+        return index
+
+
+def shortlist_documents(snapshots: List[IndexSnapshot], query: np.ndarray, limit: int,
+                        doc_ids: Optional[List[Optional[Iterable[str]]]] = None) -> List[Optional[List[str]]]:
+    """Pick the ``limit`` documents across ``snapshots`` whose centroids best match a unit query.
+
+    Returns the chosen document ids per snapshot, in the form ``doc_ids``
+    scopes a search. When the scope holds no more than ``limit`` documents,
+    or a snapshot has no centroids, the scope is returned unchanged.
+    """
+    doc_ids = doc_ids or [None] * len(snapshots)
+    if any(snapshot.centroids is None for snapshot in snapshots if snapshot.has_vectors):
+        return doc_ids
+    scored = [
+        (score, position, doc_id)
+        for position, snapshot in enumerate(snapshots) if snapshot.has_vectors
+        for doc_id, score in snapshot.document_scores(query, doc_ids[position])
+    ]
+    if len(scored) <= limit:
+        return doc_ids
+    shortlist = [[] for _ in snapshots]
+    for _, position, doc_id in heapq.nlargest(limit, scored, key=lambda item: item[0]):
+        shortlist[position].append(doc_id)
+    return shortlist
+
+
+def search_indexes(indexes: List[VectorIndex], query_vector, k: int = 5, with_vectors: bool = False,
+                   doc_ids: Optional[List[Optional[Iterable[str]]]] = None, document_shortlist: int = 0) -> List[Tuple]:
+    """Search several indexes and merge their results by score.
+
+    ``doc_ids`` optionally scopes each index. ``document_shortlist`` first
+    picks that many documents across all indexes by their centroids, so
+    only their chunks are scored.
+    """
+    if document_shortlist:
+        query_vector = normalize_vectors(query_vector)[0]
+        doc_ids = shortlist_documents([index.snapshot() for index in indexes], query_vector, document_shortlist, doc_ids)
+    results = []
+    for position, index in enumerate(indexes):
+        results.extend(index.search(query_vector, k, with_vectors, doc_ids[position] if doc_ids else None))
+    return heapq.nlargest(k, results, key=lambda item: item[1])
@@ -25,6 +25,10 @@ import {
   FolderOpen
 } from 'lucide-react';
 
+// Upload jobs are polled this often, and given up on after this long
+const JOB_POLL_INTERVAL_MS = 1000;
+const JOB_POLL_TIMEOUT_MS = 10 * 60 * 1000;
+
 const F1 = () => {
   const [collections, setCollections] = useState([]);
   const [collectionName, setCollectionName] = useState('');
@@ -55,6 +59,7 @@ const F1 = () => {
   const collectionsPerPage = 8;
 
   const chatEndRef = useRef(null);
+  const jobPollRef = useRef(null);
 
   useEffect(() => {
     setIsLoading(true);
@@ -131,7 +136,33 @@ const F1 = () => {
     }
     setIsLoading(false);
   };
-  const handleUploadDocument = async (collectionId, subjectIndex) => {
+  // Stop polling upload jobs once the page is left
+  useEffect(() => {
+    const controller = new AbortController();
+    jobPollRef.current = controller;
+    return () => controller.abort();
+  }, []);
+
+  const waitForJob = async (jobId) => {
+    // Uploads are processed in the background; poll until the job finishes, the wait runs out or the page is left
+    const { signal } = jobPollRef.current;
+    const deadline = Date.now() + JOB_POLL_TIMEOUT_MS;
+    while (Date.now() < deadline) {
+      const { data } = await axios.get(`http://localhost:5000/api/jobs/${jobId}`, { signal });
+      if (data.status === 'completed') return data;
+      if (data.status === 'failed') throw new Error(data.error || 'Document processing failed');
+      await new Promise((resolve, reject) => {
+        const timer = setTimeout(resolve, JOB_POLL_INTERVAL_MS);
+        signal.addEventListener('abort', () => {
+          clearTimeout(timer);
+          reject(new axios.CanceledError());
+        }, { once: true });
+      });
+    }
+    throw new Error('Document processing is taking longer than expected. Check the course again in a few minutes.');
+  };
+
+  const handleUploadDocument = async (collectionId, subjectIndex, subjectRef) => {
     if (!file) {
       alert('Please select a file.');
       return;
@@ -144,13 +175,14 @@ const F1 = () => {
     formData.append('file', file);
 
     try {
-      const response = await axios.post(`http://localhost:5000/api/collections/${collectionId}/subjects/${subjectIndex}/documents`, formData, {
+      const response = await axios.post(`http://localhost:5000/api/collections/${collectionId}/subjects/${subjectRef}/documents`, formData, {
         onUploadProgress: (progressEvent) => {
           const percentCompleted = Math.round((progressEvent.loaded * 100) / progressEvent.total);
           setUploadProgress(prev => ({ ...prev, [uploadId]: percentCompleted }));
         }
       });
 
+      await waitForJob(response.data.job_id);
       setFile(null);
 
       // Refresh collections data
@@ -173,7 +205,9 @@ const F1 = () => {
         });
       }, 1000);
     } catch (error) {
+      if (axios.isCancel(error)) return;
       console.error('Error uploading document:', error);
+      alert(`Upload failed: ${error.response?.data?.error || error.message}`);
       // Remove progress on error
       setUploadProgress(prev => {
         const newProgress = { ...prev };
@@ -713,7 +747,11 @@ const F1 = () => {
                                     className="w-full p-3 bg-white border-2 border-red-200 rounded-xl text-sm file:mr-3 file:py-2 file:px-4 file:rounded-lg file:border-0 file:bg-red-600 file:text-white hover:file:bg-red-700 transition-all duration-300"
                                   />
                                   <button
-                                    onClick={() => handleUploadDocument(selectedCollectionForSubjects._id, index)}
+                                    onClick={() => handleUploadDocument(
+                                      selectedCollectionForSubjects._id,
+                                      index,
+                                      subject._id ?? (currentSubjectsPage - 1) * subjectsPerPage + index
+                                    )}
                                     disabled={!file}
                                     className="w-full bg-gradient-to-r from-red-600 to-red-700 hover:from-red-700 hover:to-red-800 text-white py-3 rounded-xl transition-all duration-300 disabled:opacity-50 disabled:cursor-not-allowed font-semibold shadow-md"
                                   >
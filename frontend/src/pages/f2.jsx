@@ -2,6 +2,10 @@ import React, { useState, useEffect, useRef } from 'react';
 import Navbar from '../components/navbar';
 import { User, Bot, Send, Mic, StopCircle, Trash2, FileText, File, UploadCloud, RefreshCw, X, Paperclip, AlertCircle, CheckCircle2 } from 'lucide-react';
 
+// Upload jobs are polled this often, and given up on after this long
+const JOB_POLL_INTERVAL_MS = 1000;
+const JOB_POLL_TIMEOUT_MS = 10 * 60 * 1000;
+
 const RNSReply = () => {
   const [messages, setMessages] = useState([]);
   const [inputMessage, setInputMessage] = useState('');
@@ -16,6 +20,7 @@ const RNSReply = () => {
   const messagesEndRef = useRef(null);
   const fileInputRef = useRef(null);
   const recognitionRef = useRef(null);
+  const jobPollRef = useRef(null);
 
   // Scroll to bottom when new messages arrive
   const scrollToBottom = () => {
@@ -62,6 +67,33 @@ const RNSReply = () => {
     }
   }, []);
 
+  // Stop polling upload jobs once the page is left
+  useEffect(() => {
+    const controller = new AbortController();
+    jobPollRef.current = controller;
+    return () => controller.abort();
+  }, []);
+
+  const waitForJob = async (jobId) => {
+    // Uploads are processed in the background; poll until the job finishes, the wait runs out or the page is left
+    const { signal } = jobPollRef.current;
+    const deadline = Date.now() + JOB_POLL_TIMEOUT_MS;
+    while (Date.now() < deadline) {
+      const response = await fetch(`http://localhost:5000/api/jobs/${jobId}`, { signal });
+      const data = await response.json();
+      if (data.status === 'completed') return data;
+      if (data.status === 'failed') throw new Error(data.error || 'File processing failed');
+      await new Promise((resolve, reject) => {
+        const timer = setTimeout(resolve, JOB_POLL_INTERVAL_MS);
+        signal.addEventListener('abort', () => {
+          clearTimeout(timer);
+          reject(new DOMException('Polling stopped', 'AbortError'));
+        }, { once: true });
+      });
+    }
+    throw new Error('File processing is taking longer than expected. Refresh the file list in a few minutes.');
+  };
+
   const loadUploadedFiles = async () => {
     try {
       const response = await fetch('http://localhost:5000/api/chatbot/files');
@@ -184,10 +216,19 @@ const RNSReply = () => {
       });
 
       xhr.onload = () => {
-        if (xhr.status === 201) {
-          loadUploadedFiles();
-          setUploadProgress(0);
-          alert('File uploaded successfully!');
+        if (xhr.status === 202) {
+          const { job_id } = JSON.parse(xhr.responseText);
+          waitForJob(job_id)
+            .then(() => {
+              loadUploadedFiles();
+              setUploadProgress(0);
+              alert('File uploaded successfully!');
+            })
+            .catch((error) => {
+              if (error.name === 'AbortError') return;
+              alert(`Upload failed: ${error.message}`);
+              setUploadProgress(0);
+            });
         } else {
           const errorData = JSON.parse(xhr.responseText);
           alert(`Upload failed: ${errorData.error}`);